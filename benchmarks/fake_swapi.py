@@ -0,0 +1,198 @@
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlsplit
+
+PAGE_SIZE = 10
+
+FIRST_NAMES = (
+    "Luke",
+    "Leia",
+    "Han",
+    "Anakin",
+    "Padme",
+    "Obi-Wan",
+    "Owen",
+    "Beru",
+    "Biggs",
+    "Wedge",
+    "Lando",
+    "Mon",
+)
+LAST_NAMES = (
+    "Skywalker",
+    "Organa",
+    "Solo",
+    "Amidala",
+    "Kenobi",
+    "Lars",
+    "Darklighter",
+    "Antilles",
+    "Calrissian",
+    "Mothma",
+)
+
+
+def make_fixtures(base_url: str, people: int, planets: int) -> dict:
+    """
+    Generates SWAPI-like people and planets records with unique names.
+
+    Args:
+        base_url (str): The base URL of the fake API, used in the record URLs.
+        people (int): The number of people.
+        planets (int): The number of planets.
+
+    Returns:
+        dict: The records of the "people" and "planets" collections.
+    """
+    names = [f"{first} {last}" for last in LAST_NAMES for first in FIRST_NAMES]
+    return {
+        "people": [
+            {
+                "name": names[i % len(names)]
+                + (f" {i // len(names)}" if i >= len(names) else ""),
+                "height": str(150 + i % 60),
+                "mass": str(50 + i % 50),
+                "birth_year": f"{i % 100}BBY",
+                "homeworld": f"{base_url}/planets/{i % planets + 1}/",
+                "films": [f"{base_url}/films/{i % 6 + 1}/"],
+                "species": [],
+                "vehicles": [],
+                "starships": [],
+                "edited": "2014-12-20T21:17:56.891000Z",
+                "url": f"{base_url}/people/{i + 1}/",
+            }
+            for i in range(people)
+        ],
+        "planets": [
+            {
+                "name": f"Planet {i + 1}",
+                "population": str(1000 * (i + 1)),
+                "orbital_period": str(300 + i % 200),
+                "rotation_period": str(20 + i % 10),
+                "residents": [],
+                "edited": "2014-12-20T20:58:18.411000Z",
+                "url": f"{base_url}/planets/{i + 1}/",
+            }
+            for i in range(planets)
+        ],
+    }
+
+
+class FakeSwapi(ThreadingHTTPServer):
+    """
+    A local stand-in for SWAPI serving generated people and planets, with the
+    search and pagination of the real API, a fixed latency per request and a
+    share of requests failing with a 500 error.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        people: int = 100,
+        planets: int = 20,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+    ):
+        super().__init__(("127.0.0.1", port), FakeSwapiHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/api"
+        self.fixtures = make_fixtures(self.url, people, planets)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+
+    def start(self) -> "FakeSwapi":
+        """
+        Serves requests from a background thread.
+
+        Returns:
+            FakeSwapi: The server.
+        """
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeSwapiHandler(BaseHTTPRequestHandler):
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        server = self.server
+        server.requests += 1
+        time.sleep(server.latency)
+        if random.random() < server.error_rate:
+            return self.send_json(500, {"detail": "Injected error"})
+
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        records = server.fixtures.get(parts[1]) if len(parts) > 1 else None
+        if parts[:1] != ["api"] or records is None:
+            return self.send_json(404, {"detail": "Not found"})
+        if len(parts) == 3:
+            index = int(parts[2]) - 1
+            if not 0 <= index < len(records):
+                return self.send_json(404, {"detail": "Not found"})
+            return self.send_json(200, records[index])
+
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        search = params.get("search", "").lower()
+        page = int(params.get("page", 1))
+        matches = [record for record in records if search in record["name"].lower()]
+        following = None
+        if page * PAGE_SIZE < len(matches):
+            following = f"{server.url}/{parts[1]}/?search={search}&page={page + 1}"
+        self.send_json(
+            200,
+            {
+                "count": len(matches),
+                "next": following,
+                "previous": None,
+                "results": matches[(page - 1) * PAGE_SIZE : page * PAGE_SIZE],
+            },
+        )
+
+    def send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="A local stand-in for SWAPI. Point SWAPER at it with "
+        "SWAPER_SWAPI_URL=http://127.0.0.1:<port>/api."
+    )
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--people", type=int, default=100, help="Number of people")
+    parser.add_argument("--planets", type=int, default=20, help="Number of planets")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to each request"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of requests failing with a 500 error, between 0 and 1",
+    )
+    args = parser.parse_args()
+
+    server = FakeSwapi(
+        args.port, args.people, args.planets, args.latency, args.error_rate
+    )
+    print(f"Serving a fake SWAPI on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+PLOTTING = ("matplotlib", "pandas", "numpy")
+
+# The modules each task imports, and the packages it must never import.
+TASKS = {
+    "search": (["main", "src.libs.swapi", "src.libs.batch"], PLOTTING),
+    "sync": (["main", "src.libs.sync"], PLOTTING),
+    "cache": (["main"], PLOTTING + ("requests",)),
+}
+
+
+def measure_imports(modules: list) -> dict:
+    """
+    Imports the given modules in a fresh interpreter with -X importtime.
+
+    Args:
+        modules (list): The modules to import.
+
+    Returns:
+        dict: The self import time in microseconds of every imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        timings[name.strip()] = int(self_us)
+    return timings
+
+
+def check_task(task: str, budget_ms: float = None) -> bool:
+    """
+    Checks the startup imports of a task and prints a report.
+
+    Args:
+        task (str): The task, one of TASKS.
+        budget_ms (float, optional): The maximum total import time in milliseconds.
+
+    Returns:
+        bool: Whether the task passed the check.
+    """
+    modules, forbidden = TASKS[task]
+    timings = measure_imports(modules)
+    total_ms = sum(timings.values()) / 1000
+    leaked = sorted(
+        {name.split(".")[0] for name in timings if name.split(".")[0] in forbidden}
+    )
+    slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[:5]
+
+    print(f"{task}: {len(timings)} modules imported in {total_ms:.1f} ms")
+    for name, self_us in slowest:
+        print(f"    {self_us / 1000:8.1f} ms  {name}")
+
+    passed = True
+    if leaked:
+        print(f"    FAIL: imports {', '.join(leaked)}")
+        passed = False
+    if budget_ms is not None and total_ms > budget_ms:
+        print(f"    FAIL: over the {budget_ms:.0f} ms budget")
+        passed = False
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import-time regression check for the SWAPER tasks. Fails if a "
+        "task imports a package it does not need or exceeds the import time budget."
+    )
+    parser.add_argument(
+        "--task",
+        choices=sorted(TASKS),
+        action="append",
+        help="Task to check, may be repeated, defaults to every task",
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=None,
+        help="Maximum total import time of a task in milliseconds",
+    )
+    args = parser.parse_args()
+
+    results = [check_task(task, args.budget_ms) for task in args.task or sorted(TASKS)]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
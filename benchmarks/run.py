@@ -0,0 +1,341 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from os.path import abspath, dirname, getsize, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_swapi import FakeSwapi  # noqa: E402
+
+
+def start_fake_swapi(people: int, latency: float, error_rate: float) -> FakeSwapi:
+    """
+    Starts the local stand-in for SWAPI and points SWAPER at it. Must be called
+    before the SWAPER modules are imported, as they read SWAPI_URL on import.
+
+    Args:
+        people (int): The number of people the fake API serves.
+        latency (float): The seconds added to each request.
+        error_rate (float): The share of requests failing with a 500 error.
+
+    Returns:
+        FakeSwapi: The running server.
+    """
+    fake = FakeSwapi(people=people, latency=latency, error_rate=error_rate).start()
+    os.environ["SWAPER_SWAPI_URL"] = fake.url
+    return fake
+
+
+def use_database(path: str) -> None:
+    """
+    Switches SWAPER to a new database file and creates its tables.
+
+    Args:
+        path (str): The path of the database file.
+
+    Returns:
+        None.
+    """
+    from src.db import db
+
+    close_database()
+    db.DATABASE = path
+    db.init_db()
+
+
+def close_database() -> None:
+    """
+    Writes the pending hits and closes the current database.
+
+    Returns:
+        None.
+    """
+    from src.db import db
+    from src.db.hits import flush_hits
+
+    flush_hits()
+    db.close_db()
+
+
+def summarize(samples: list) -> dict:
+    """
+    Summarizes latency samples.
+
+    Args:
+        samples (list): The latencies in seconds.
+
+    Returns:
+        dict: The number of samples and their mean, median, 95th and 99th
+            percentile in milliseconds.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {"samples": 0}
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        "samples": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+    }
+
+
+def time_call(function, *args) -> float:
+    """
+    Times a call.
+
+    Returns:
+        float: The duration of the call in seconds.
+    """
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def measure(function, calls: list) -> dict:
+    """
+    Times a function over a list of calls. Calls failing with a ValueError, such
+    as SWAPI errors that outlasted the retries, are counted instead of timed.
+
+    Args:
+        function (Callable): The function to time.
+        calls (list): The argument tuples of each call.
+
+    Returns:
+        dict: The latency summary of the successful calls and the number of errors.
+    """
+    samples, errors = [], 0
+    for args in calls:
+        try:
+            samples.append(time_call(function, *args))
+        except ValueError:
+            errors += 1
+    return {**summarize(samples), "errors": errors}
+
+
+def bench_search(names: list, workdir: str) -> dict:
+    """
+    Measures the latency of single searches on an empty cache, then on a warm one.
+
+    Args:
+        names (list): The names of the characters to search for.
+        workdir (str): The directory of the benchmark databases.
+
+    Returns:
+        dict: The cold and warm latency summaries, with and without homeworlds.
+    """
+    from src.libs.swapi import lookup_character
+
+    results = {}
+    for world in (False, True):
+        label = "world" if world else "character"
+        use_database(join(workdir, f"search-{label}.db"))
+        calls = [(name, world) for name in names]
+        results[f"cold_{label}"] = measure(lookup_character, calls)
+        results[f"warm_{label}"] = measure(lookup_character, calls)
+    return results
+
+
+def bench_batch(names: list, workers: int, workdir: str) -> dict:
+    """
+    Measures the throughput of a batch search on an empty cache, then on a warm one.
+
+    Args:
+        names (list): The names of the characters to search for.
+        workers (int): The number of batch workers.
+        workdir (str): The directory of the benchmark databases.
+
+    Returns:
+        dict: The number of queries and the cold and warm queries per second.
+    """
+    from src.libs.batch import batch_search
+
+    use_database(join(workdir, "batch.db"))
+    results = {"queries": len(names), "workers": workers}
+    for phase in ("cold", "warm"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds = time_call(batch_search, names, True, workers)
+        results[f"{phase}_seconds"] = seconds
+        results[f"{phase}_queries_per_second"] = len(names) / seconds
+    return results
+
+
+def populate(start: int, stop: int, chunk: int = 10000) -> None:
+    """
+    Adds synthetic cache entries and search events with IDs in [start, stop).
+
+    Args:
+        start (int): The first ID.
+        stop (int): The ID after the last one.
+        chunk (int, optional): The number of entries per transaction. Defaults to 10000.
+
+    Returns:
+        None.
+    """
+    from src.db.db import add_search_events, write_cache_batch
+    from src.utils.storage_utils import encode_character
+
+    now = datetime.now()
+    for first in range(start, stop, chunk):
+        ids = range(first, min(first + chunk, stop))
+        write_cache_batch(
+            [
+                (
+                    f"query {i}",
+                    encode_character(
+                        {
+                            "name": f"Character {i}",
+                            "height": "172",
+                            "mass": "77",
+                            "birth_year": "19BBY",
+                            "homeworld": "https://swapi.dev/api/planets/1/",
+                            "url": f"https://swapi.dev/api/people/{i}/",
+                            "edited": "2014-12-20T21:17:56.891000Z",
+                        }
+                    ),
+                    now,
+                )
+                for i in ids
+            ]
+        )
+        add_search_events([(now, f"query {i}", f"Character {i}", "found") for i in ids])
+
+
+def bench_scale(sizes: list, lookups: int, workdir: str) -> list:
+    """
+    Grows one cache through the given sizes and measures the database size, the
+    latency of exact query lookups, of name lookups that find a stored character
+    and of name lookups that find none, and the plot render time at each of them.
+
+    Eviction is disabled, so that the cache reaches every size.
+
+    Args:
+        sizes (list): The numbers of cache entries to measure at.
+        lookups (int): The number of lookups of each kind per size.
+        workdir (str): The directory of the benchmark databases.
+
+    Returns:
+        list: The measurements at each size.
+    """
+    from src.db import db
+    from src.libs.visualization import visualize
+
+    db.CACHE_MAX_ROWS = db.CACHE_MAX_BYTES = db.NEGATIVE_CACHE_MAX_ROWS = None
+    path = join(workdir, "scale.db")
+    use_database(path)
+    results, rows = [], 0
+    for size in sorted(sizes):
+        populate_seconds = time_call(populate, rows, size)
+        rows = size
+        with db.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        sample = [random.randrange(size) for _ in range(lookups)]
+        results.append(
+            {
+                "rows": size,
+                "populate_seconds": populate_seconds,
+                "database_bytes": getsize(path),
+                "exact_lookup": measure(
+                    db.get_cache, [(f"query {i}",) for i in sample]
+                ),
+                "name_lookup": measure(
+                    db.get_cache, [(f"character {i}",) for i in sample]
+                ),
+                "name_miss": measure(
+                    db.get_cache, [(f"character {i}x",) for i in sample]
+                ),
+                "plot_seconds": time_call(visualize, join(workdir, "plot.png")),
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks SWAPER against a local stand-in for SWAPI and "
+        "writes the results as JSON."
+    )
+    parser.add_argument(
+        "--people", type=int, default=200, help="Number of people the fake API serves"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Seconds added to each fake API request",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of fake API requests failing with a 500 error",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=50, help="Number of single searches"
+    )
+    parser.add_argument(
+        "--batch", type=int, default=200, help="Number of queries of the batch search"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="Number of batch search workers"
+    )
+    parser.add_argument(
+        "--sizes",
+        default="100,1000,10000,100000",
+        help="Comma separated cache sizes to measure, e.g. 100,10000,1000000",
+    )
+    parser.add_argument(
+        "--lookups", type=int, default=200, help="Number of lookups per cache size"
+    )
+    parser.add_argument(
+        "-o", "--output", default=None, help="JSON results file, defaults to stdout"
+    )
+    args = parser.parse_args()
+
+    fake = start_fake_swapi(args.people, args.latency, args.error_rate)
+    names = [person["name"] for person in fake.fixtures["people"]]
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["SWAPER_DATABASE"] = join(workdir, "swapi.db")
+        results = {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "settings": vars(args),
+            "search": bench_search(random.sample(names, args.queries), workdir),
+            "batch": bench_batch(
+                random.sample(names, min(args.batch, len(names))),
+                args.workers,
+                workdir,
+            ),
+            "scale": bench_scale(
+                [int(size) for size in args.sizes.split(",")], args.lookups, workdir
+            ),
+            "requests": fake.requests,
+        }
+        close_database()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,306 @@
-import json
+import sys
 from os.path import splitext
 
-import requests
-
 from src.cli import parse_args
-from src.db.db import clean_cache, get_cache, init_db, insert_cache
-from src.libs.swapi import handle_character_response, swapi_search
-from src.libs.visualization import visualize
+from src.config import TRANSFER_BATCH_SIZE, WARM_TOP
+from src.db.db import (
+    cache_stats,
+    clean_cache,
+    evict,
+    get_cache,
+    get_sync_state,
+    init_db,
+    popular_queries,
+)
+from src.utils.metrics_utils import increment, print_profile, span, write_metrics
+
+# Task modules are imported by the task that needs them, so that a search does
+# not pay for importing the plotting libraries and a cache clean does not pay
+# for importing requests.
 
 
-def search_task(search_query: str, world: str):
+def require_mirror(offline: bool) -> None:
+    """
+    Exits with status 1, after printing how to sync it, if an offline search lacks
+    the local mirror it is answered from.
+
+    Args:
+        offline (bool): Whether the search must not reach SWAPI.
+
+    Returns:
+        None.
+    """
+    if offline and not get_sync_state("people"):
+        print("Offline search needs a local mirror, run 'python main.py sync' first")
+        sys.exit(1)
+
+
+def search_task(
+    search_query: str, world: str, offline: bool = False, expand: tuple = ()
+):
     """
     Perform a search for a Star Wars character using the SWAPI and handle the response.
 
+    The snapshot is looked up first, the database is only opened if it misses.
+
     Args:
         search_query (str): The search query to use.
         world (str): Whether to retrieve homeworld information (True or False).
+        offline (bool): Whether to answer from the local mirror without reaching SWAPI.
+        expand (tuple): The related resources to retrieve, such as ("films", "starships").
 
     Returns:
         None.
     """
-    _id, response, hits, timestamp = get_cache(search_query)
-    response = json.loads(response) if response else None
+    with span("import.search"):
+        from src.libs.refresh import schedule_refresh
+        from src.libs.snapshot import lookup_snapshot
+        from src.libs.swapi import (
+            handle_character_response,
+            handle_snapshot_response,
+            search_character,
+        )
+        from src.utils.storage_utils import decode_response
+
+    record = lookup_snapshot(search_query)
+    if record is not None:
+        with span("search.handle_response"):
+            handle_snapshot_response(search_query, record, world, offline, expand)
+        return
+
+    init_db()
+    require_mirror(offline)
+    _id, response, hits, timestamp, stale = get_cache(search_query)
+    # A cached "[]" is a search without results, only a missing entry is a miss
+    response = decode_response(response) if response is not None else None
     save = False
     if response is None:
-        response = swapi_search(search_query)
-        save = True
-    handle_character_response(search_query, response, world, save, _id, hits, timestamp)
+        response, _id = search_character(search_query, offline)
+        save = _id is None
+    elif stale and not offline:
+        # Served from the cache now, refreshed in the background before exit
+        schedule_refresh(_id, response)
+    with span("search.handle_response"):
+        handle_character_response(
+            search_query,
+            response,
+            world,
+            save,
+            _id,
+            hits,
+            timestamp,
+            offline,
+            expand,
+        )
+
+
+def search_all_task(
+    queries: list, world: bool, offline: bool = False, expand: tuple = ()
+):
+    """
+    Search for every Star Wars character matching each query.
+
+    Args:
+        queries (list): The search queries.
+        world (bool): Whether to retrieve homeworld information.
+        offline (bool): Whether to answer from the local mirror without reaching SWAPI.
+        expand (tuple): The related resources to retrieve, such as ("films", "starships").
+
+    Returns:
+        None.
+    """
+    with span("import.search"):
+        from src.libs.swapi import search_all
+
+    for query in queries:
+        query = query.strip()
+        if len(queries) > 1:
+            print(f"Query: {query}")
+            print("-" * len(f"Query: {query}"))
+        search_all(query, world, offline, expand)
+
+
+def read_queries(query: list, file: str = None) -> list:
+    """
+    Collect the search queries given on the command line and in a queries file.
+
+    Args:
+        query (list): The search queries given on the command line.
+        file (str): A file with one search query per line, "-" reads from stdin.
+
+    Returns:
+        list: The search queries.
+    """
+    queries = list(query)
+    if file == "-":
+        queries.extend(sys.stdin.read().splitlines())
+    elif file:
+        with open(file) as f:
+            queries.extend(f.read().splitlines())
+    return [query for query in queries if query.strip()]
+
+
+def batch_search_task(
+    queries: list,
+    world: bool,
+    workers: int = None,
+    offline: bool = False,
+    expand: tuple = (),
+):
+    """
+    Perform a concurrent search for many Star Wars characters and handle the responses.
+
+    Args:
+        queries (list): The search queries to use.
+        world (bool): Whether to retrieve homeworld information.
+        workers (int): The number of concurrent workers.
+        offline (bool): Whether to answer from the local mirror without reaching SWAPI.
+        expand (tuple): The related resources to retrieve, such as ("films", "starships").
+
+    Returns:
+        None.
+    """
+    with span("import.search"):
+        from src.libs.batch import batch_search
+
+    batch_search(queries, world, workers, offline, expand)
+
+
+def cache_stats_task():
+    """
+    Print the size of the cache, its expired entries and the eviction settings.
+
+    Returns:
+        None.
+    """
+    stats = cache_stats()
+    print(f"Entries: {stats['entries']} (max {stats['max_entries']})")
+    print(
+        f"Entries without results: {stats['negative_entries']} "
+        f"(max {stats['max_negative_entries']}, ttl {stats['negative_ttl']} seconds)"
+    )
+    print(f"Responses size: {stats['bytes']} bytes (max {stats['max_bytes']})")
+    print(f"Backend: {stats['backend']}")
+    if stats["database_bytes"] is not None:
+        print(f"Database size: {stats['database_bytes']} bytes")
+    print(f"Expired entries: {stats['expired']} (ttl {stats['ttl']} seconds)")
+    print(f"Oldest fetch: {stats['oldest_fetch']}")
+    print(f"Latest hit: {stats['latest_hit']}")
+    print(f"Eviction policy: {stats['policy']}")
 
 
 def main():
-    init_db()
     args = parse_args()
+    # A single search opens the database only when the snapshot misses
+    if args.task != "search":
+        init_db()
     if args.task == "search":
-        if not args.query:
+        queries = read_queries(args.query, args.file)
+        if not queries:
             print("Query parameter cannot be empty")
-        search_task(args.query.strip(), args.world)
+        elif len(queries) == 1 and args.file is None and not args.all:
+            search_task(queries[0].strip(), args.world, args.offline, args.expand)
+        else:
+            init_db()
+            require_mirror(args.offline)
+            if args.all:
+                search_all_task(queries, args.world, args.offline, args.expand)
+            else:
+                batch_search_task(
+                    queries, args.world, args.workers, args.offline, args.expand
+                )
 
     elif args.task == "cache":
-        if not args.clean:
+        if args.clean:
+            with span("import.cache"):
+                from src.libs.snapshot import remove_snapshot
+
+            clean_cache()
+            remove_snapshot()
+        elif args.stats:
+            cache_stats_task()
+        elif args.evict:
+            print(f"evicted {evict()} entries")
+        elif args.export:
+            with span("import.cache"):
+                from src.libs.transfer import export_cache
+
+            entries, resources = export_cache(args.export)
+            print(
+                f"exported {entries} entries and {resources} resources",
+                file=sys.stderr if args.export == "-" else sys.stdout,
+            )
+        elif args.import_file:
+            with span("import.cache"):
+                from src.libs.transfer import import_cache
+
+            entries, resources = import_cache(args.import_file)
+            print(f"imported {entries} entries and {resources} resources")
+        elif args.warm:
+            with span("import.cache"):
+                from src.libs.warm import history_queries, warm_cache
+
+            if args.history:
+                queries = history_queries(args.history, args.top or WARM_TOP)
+            elif args.file:
+                queries = read_queries([], args.file)
+            else:
+                queries = popular_queries(args.top or WARM_TOP)
+            warmed, cached, failed = warm_cache(queries, args.workers)
+            print(f"warmed {warmed} queries, {cached} already cached, {failed} failed")
+        elif args.migrate:
+            with span("import.cache"):
+                from src.db.backends import migrate_cache
+                from src.libs.snapshot import remove_snapshot
+
+            source, target = args.migrate
+            count = migrate_cache(source, target, TRANSFER_BATCH_SIZE)
+            remove_snapshot()
+            print(f"migrated {count} entries from {source} to {target}")
+        else:
             print("Cache option cannot be empty")
-        clean_cache()
+    elif args.task == "snapshot":
+        with span("import.snapshot"):
+            from src.libs.snapshot import build_snapshot, snapshot_path
+
+        path = args.output or snapshot_path()
+        print(
+            f"snapshot of {build_snapshot(path, args.source)} names written to {path}"
+        )
+    elif args.task == "serve":
+        with span("import.serve"):
+            from src.libs.server import serve
+
+        serve(args.host, args.port, args.warm)
+    elif args.task == "sync":
+        with span("import.sync"):
+            from src.libs.sync import sync
+
+        sync(args.workers)
     elif args.task == "plot":
         filename, extension = splitext(args.output)
         if extension != ".png":
             raise ValueError("Output file must have png extension")
-        visualize(args.output)
+        with span("import.plot"):
+            from src.libs.plot_cache import plot_is_current
+
+        if plot_is_current(args.output):
+            increment("plot.cached")
+        else:
+            with span("import.plot"):
+                from src.libs.visualization import visualize
+
+            visualize(args.output)
     else:
         print(
             "Invalid task, please refer to the command-line tool's '--help' manual for valid options."
         )
 
+    if getattr(args, "profile", False):
+        print_profile()
+    if getattr(args, "metrics", None):
+        write_metrics(args.metrics, sys.argv[1:])
+
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,28 @@
 import argparse
 
+from src.utils.storage_utils import RELATED_FIELDS
+
+
+def expand_fields(value: str) -> tuple:
+    """
+    Parse the comma separated related resources of the search --expand option.
+
+    Args:
+    value (str): The option value, such as "films,starships".
+
+    Returns:
+    tuple: The related fields, without repeats.
+    """
+    fields = tuple(
+        dict.fromkeys(field.strip() for field in value.split(",") if field.strip())
+    )
+    unknown = [field for field in fields if field not in RELATED_FIELDS]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"unknown related resources {', '.join(unknown)}, choose from {', '.join(RELATED_FIELDS)}"
+        )
+    return fields
+
 
 def parse_args() -> argparse.Namespace:
     """
@@ -18,9 +41,51 @@ def parse_args() -> argparse.Namespace:
         python main.py search "anakin" --world
             Search for a Star Wars character named "anakin" and retrieve homeworld information.
 
+        python main.py search "luke" --expand films,starships
+            Search for "luke" and resolve the titles of his films and the names of his starships.
+
+        python main.py search "sky" --all
+            Search for every Star Wars character whose name contains "sky".
+
+        python main.py search "luke" "leia" "han" --world
+            Search for many Star Wars characters concurrently.
+
+        python main.py search --file queries.txt (--workers 16)
+            Search for every query in queries.txt, one per line, use "-" to read from stdin.
+
+        python main.py search "luke" --world --offline
+            Search the local mirror only, without reaching SWAPI.
+
+        python main.py sync (--workers 8)
+            Mirror the SWAPI people and planets locally, later runs only write changed records.
+
+        python main.py serve (--host 127.0.0.1 --port 8000 --warm)
+            Serve searches over HTTP, e.g. GET /search?q=luke&world=1, and counters on GET /metrics, --warm prefetches the most searched queries meanwhile.
+
+        python main.py search "luke" --profile (--metrics metrics.jsonl)
+            Print the time spent in each stage, and append the timings and counters to a file.
+
         python main.py cache --clean
             Clear the cache.
-        
+
+        python main.py cache --stats
+            Show the cache size, expired entries and eviction settings.
+
+        python main.py cache --evict
+            Evict expired entries and the entries over the cache budget.
+
+        python main.py cache --export cache.jsonl.gz
+            Export the cache, then warm another node with: python main.py cache --import cache.jsonl.gz
+
+        python main.py cache --warm (--top 100 | -f queries.txt | --history cache.jsonl.gz)
+            Prefetch the most searched queries, or the given ones, into the cache, e.g. after a clean.
+
+        python main.py cache --migrate sqlite sharded
+            Copy the cache entries to another backend, then select it with SWAPER_CACHE_BACKEND=sharded.
+
+        python main.py snapshot build (--source mirror)
+            Compile the cache, or the local mirror, into a read-only file that searches look names up in first.
+
         python main.py plot (-o plot.png)
             Generate a plot of the cached Star Wars characters and save it to a png file, default file is swapi_plots.png.
     """
@@ -30,20 +95,184 @@ def parse_args() -> argparse.Namespace:
         epilog=epilog,
     )
 
+    # Options shared by every task
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--profile",
+        default=False,
+        action="store_true",
+        help="Print the time spent in each stage to stderr",
+    )
+    common.add_argument(
+        "--metrics",
+        required=False,
+        default=None,
+        help="Append the timings and counters to this file as a JSON line",
+    )
+
     tasks = parser.add_subparsers(
         title="subcommands", description="Available tasks", dest="task", metavar=""
     )
 
-    search_task = tasks.add_parser("search", help="Search for a Star Wars character")
-    search_task.add_argument("query", help="Search query")
+    search_task = tasks.add_parser(
+        "search", help="Search for a Star Wars character", parents=[common]
+    )
+    search_task.add_argument("query", nargs="*", help="Search query")
     search_task.add_argument(
         "--world", default=False, action="store_true", help="Retrieve homeworld info"
     )
+    search_task.add_argument(
+        "--expand",
+        type=expand_fields,
+        default=(),
+        metavar="FIELDS",
+        help="Comma separated related resources to retrieve: "
+        + ",".join(RELATED_FIELDS),
+    )
+    search_task.add_argument(
+        "--all",
+        default=False,
+        action="store_true",
+        help="Show every matching character instead of the first one",
+    )
+    search_task.add_argument(
+        "-f",
+        "--file",
+        required=False,
+        default=None,
+        help="File with one search query per line, use - for stdin",
+    )
+    search_task.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of concurrent workers for batch searches",
+    )
+    search_task.add_argument(
+        "--offline",
+        default=False,
+        action="store_true",
+        help="Answer from the local mirror without reaching SWAPI",
+    )
+
+    sync_task = tasks.add_parser(
+        "sync", help="Mirror the SWAPI people and planets locally", parents=[common]
+    )
+    sync_task.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of concurrent page fetches",
+    )
+
+    serve_task = tasks.add_parser(
+        "serve", help="Serve Star Wars character searches over HTTP", parents=[common]
+    )
+    serve_task.add_argument(
+        "--host", required=False, default=None, help="Address to listen on"
+    )
+    serve_task.add_argument(
+        "--port", type=int, required=False, default=None, help="Port to listen on"
+    )
+    serve_task.add_argument(
+        "--warm",
+        default=False,
+        action="store_true",
+        help="Warm the cache with the most searched queries in the background",
+    )
+
+    cache_task = tasks.add_parser(
+        "cache", help="Cache Star Wars characters", parents=[common]
+    )
+    cache_options = cache_task.add_mutually_exclusive_group()
+    cache_options.add_argument("--clean", action="store_true", help="Clear cache")
+    cache_options.add_argument(
+        "--stats", action="store_true", help="Show cache size and eviction settings"
+    )
+    cache_options.add_argument(
+        "--evict",
+        action="store_true",
+        help="Evict expired entries and entries over the cache budget",
+    )
+    cache_options.add_argument(
+        "--export",
+        metavar="FILE",
+        default=None,
+        help="Export the cache to a JSON lines file, gzip compressed if it ends with .gz, - for stdout",
+    )
+    cache_options.add_argument(
+        "--import",
+        dest="import_file",
+        metavar="FILE",
+        default=None,
+        help="Merge a cache export into the cache, - for stdin",
+    )
+    cache_options.add_argument(
+        "--warm",
+        action="store_true",
+        help="Prefetch the most searched queries, or those of --file or --history, into the cache",
+    )
+    cache_options.add_argument(
+        "--migrate",
+        nargs=2,
+        metavar=("FROM", "TO"),
+        choices=["sqlite", "sharded"],
+        default=None,
+        help="Copy the cache entries from one backend to another, sqlite or sharded",
+    )
+    cache_task.add_argument(
+        "--top",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of most searched queries to warm",
+    )
+    cache_task.add_argument(
+        "-f",
+        "--file",
+        required=False,
+        default=None,
+        help="File with one query to warm per line, use - for stdin",
+    )
+    cache_task.add_argument(
+        "--history",
+        metavar="FILE",
+        default=None,
+        help="Warm the most hit queries of a cache export",
+    )
+    cache_task.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of concurrent fetches while warming",
+    )
 
-    cache_task = tasks.add_parser("cache", help="Cache Star Wars characters")
-    cache_task.add_argument("--clean", action="store_true", help="Clear cache")
+    snapshot_task = tasks.add_parser(
+        "snapshot",
+        help="Build a read-only snapshot for fast searches",
+        parents=[common],
+    )
+    snapshot_task.add_argument("action", choices=["build"], help="Snapshot action")
+    snapshot_task.add_argument(
+        "--source",
+        choices=["cache", "mirror"],
+        default="cache",
+        help="Compile the cache or the synced local mirror",
+    )
+    snapshot_task.add_argument(
+        "-o",
+        "--output",
+        required=False,
+        default=None,
+        help="Snapshot file, defaults to SNAPSHOT next to the database",
+    )
 
-    plot_task = tasks.add_parser("plot", help="Plot cache Star Wars characters")
+    plot_task = tasks.add_parser(
+        "plot", help="Plot cache Star Wars characters", parents=[common]
+    )
     plot_task.add_argument(
         "-o",
         "--output",
@@ -1 +1,91 @@
-DATABASE = "swapi.db"
+import os
+
+# The database file, relative to src/db, and the SWAPI URL can be overridden from the
+# environment, e.g. to point the benchmarks at a local stand-in server
+DATABASE = os.environ.get("SWAPER_DATABASE", "swapi.db")
+
+# Batch search
+BATCH_WORKERS = 8
+BATCH_WRITE_SIZE = 100
+
+# SWAPI HTTP client
+SWAPI_URL = os.environ.get("SWAPER_SWAPI_URL", "https://swapi.dev/api")
+HTTP_POOL_SIZE = 10
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 10
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_BACKOFF_MAX = 8
+PAGE_WORKERS = 8
+
+# SQLite connection
+SQLITE_BUSY_TIMEOUT = 5.0
+SQLITE_SYNCHRONOUS = "NORMAL"
+SQLITE_CACHE_SIZE = -16000
+SQLITE_MMAP_SIZE = 268435456
+
+# Storage of the cache entries: "sqlite" keeps them in DATABASE, "sharded" spreads them
+# over CACHE_SHARDS SQLite files next to it so that writes run concurrently, "memory"
+# keeps them in the process, for tests and serve. Move them with 'python main.py cache --migrate'
+CACHE_BACKEND = os.environ.get("SWAPER_CACHE_BACKEND", "sqlite")
+CACHE_SHARDS = 4
+
+# Resource cache
+RESOURCE_TTL = 7 * 24 * 60 * 60
+# The local mirror answers cache misses until this many seconds after the last sync, and
+# always offline, later misses reach SWAPI until 'python main.py sync' runs again
+MIRROR_TTL = 7 * 24 * 60 * 60
+# Number of related resources, such as films, fetched concurrently by search --expand
+EXPAND_WORKERS = 8
+
+# Cache eviction, set a limit to None to disable it
+CACHE_TTL = 30 * 24 * 60 * 60
+# Entries older than this are served stale and refreshed in the background, until CACHE_TTL
+CACHE_SOFT_TTL = 24 * 60 * 60
+REFRESH_WORKERS = 2
+# Seconds a process waits at exit for its queued background refreshes
+REFRESH_EXIT_WAIT = 5
+# A process fetching a missed search holds a lease on it, concurrent processes wait for its result
+LEASE_TTL = 30
+LEASE_WAIT = 10
+LEASE_POLL_INTERVAL = 0.05
+CACHE_MAX_ROWS = 100000
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_EVICTION_POLICY = "lfu"
+CACHE_EVICTION_BATCH = 100
+# Cached responses keep only the displayed fields, the longer ones are compressed with zlib
+CACHE_COMPRESS = True
+CACHE_COMPRESS_MIN_BYTES = 256
+# Searches without results are cached separately, for a shorter time
+NEGATIVE_CACHE_TTL = 24 * 60 * 60
+NEGATIVE_CACHE_MAX_ROWS = 10000
+
+# Hit accounting, buffered hits are written at most this many seconds or hits late
+HITS_FLUSH_INTERVAL = 5.0
+HITS_FLUSH_SIZE = 100
+
+# HTTP server
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8000
+SERVE_WORKERS = 16
+SERVE_L1_SIZE = 1024
+SERVE_L1_TTL = 60
+
+# Cache export and import, the number of entries read or written per transaction
+TRANSFER_BATCH_SIZE = 1000
+
+# Cache warming by 'python main.py cache --warm' and 'serve --warm': the number of most
+# searched queries, the concurrent fetches and the maximum queries fetched per second
+WARM_TOP = 100
+WARM_WORKERS = 4
+WARM_RATE = 5.0
+
+# Read-only snapshot of the cache, built by 'python main.py snapshot build' next to the
+# database, searches look names up in it before the cache while it is younger than CACHE_TTL
+SNAPSHOT = os.environ.get("SWAPER_SNAPSHOT", "swapi.snapshot")
+
+# Rendered plot panels and the data fingerprint of each plot, in this directory next to the database
+PLOT_CACHE = "plot_cache"
+
+# Analytics, search events older than this many seconds are pruned, rollups are kept
+SEARCH_EVENTS_TTL = 90 * 24 * 60 * 60
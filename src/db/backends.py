@@ -0,0 +1,885 @@
+from contextlib import closing
+from datetime import datetime, timedelta
+from hashlib import blake2b
+from math import ceil
+from os.path import splitext
+from threading import RLock
+from typing import Iterator, Optional, Union
+
+from src.config import CACHE_SHARDS
+from src.db import db
+from src.db.db import (
+    EVICTION_ORDER,
+    INSERT_CACHE,
+    MERGE_CACHE,
+    SHARD_MIGRATIONS,
+    UPDATE_CACHE,
+    SqliteStore,
+    evict_cache,
+    lookup_cache,
+    lookup_key,
+    lookup_name,
+    migrate_db,
+    normalize_query,
+    stale_after,
+)
+from src.utils.storage_utils import response_name
+
+# The names CACHE_BACKEND accepts.
+BACKENDS = ("sqlite", "sharded", "memory")
+
+
+class CacheBackend:
+    """The storage of the cache entries, behind get_cache, insert_cache, update_cache
+    and the other cache functions of src/db/db.py.
+
+    Entries are keyed by their normalized query and identified by the integer ID
+    their lookups return. Every backend keeps the TTL, stale, eviction and lease
+    rules of the CACHE table. The resources, the mirror and the analytics stay in
+    the shared database whatever the backend.
+    """
+
+    def lookup(self, query: str) -> Optional[tuple]:
+        """Looks up the cache entry of a search query, see lookup_cache.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            tuple: The ID, response, hits and timestamp of the cache entry and
+                whether it is stale, or None.
+        """
+        raise NotImplementedError
+
+    def lookup_many(self, queries: list) -> dict:
+        """Looks up the cache entries of several search queries.
+
+        Args:
+            queries (list): The search queries.
+
+        Returns:
+            dict: The result of lookup for each query.
+        """
+        return {query: self.lookup(query) for query in queries}
+
+    def insert(self, query: str, response: Union[str, bytes], timestamp: str) -> int:
+        """Inserts a cache entry, or replaces the response of the entry with the same
+        normalized query, releases the lease on the query and evicts up to
+        CACHE_EVICTION_BATCH entries.
+
+        Args:
+            query (str): The search query.
+            response (str | bytes): The stored response.
+            timestamp (str): The time the response was fetched.
+
+        Returns:
+            int: The ID of the cache entry.
+        """
+        raise NotImplementedError
+
+    def update(
+        self, query_id: int, response: Union[str, bytes], hits: int, timestamp: str
+    ) -> None:
+        """Replaces the response, hits and timestamps of a cache entry.
+
+        Args:
+            query_id (int): The ID of the cache entry.
+            response (str | bytes): The stored response.
+            hits (int): The hits of the entry.
+            timestamp (str): The time the response was fetched.
+
+        Returns:
+            None.
+        """
+        raise NotImplementedError
+
+    def write(self, inserts: list = (), updates: list = ()) -> None:
+        """Writes a group of inserts and updates at once, see write_cache_batch.
+
+        Args:
+            inserts (list): (query, response, timestamp) tuples.
+            updates (list): (response, timestamp, hits, query_id) tuples.
+
+        Returns:
+            None.
+        """
+        raise NotImplementedError
+
+    def refresh(
+        self,
+        query_id: int,
+        response: Optional[Union[str, bytes]],
+        timestamp: str,
+        validators: tuple,
+    ) -> None:
+        """Replaces the response of a cache entry with a refetched one, see refresh_cache.
+
+        Args:
+            query_id (int): The ID of the cache entry.
+            response (str | bytes): The refetched response, or None if it has not changed.
+            timestamp (str): The time the response was fetched or revalidated.
+            validators (tuple): The ETag and Last-Modified validators of the response.
+
+        Returns:
+            None.
+        """
+        raise NotImplementedError
+
+    def validators(self, query_id: int) -> tuple:
+        """Retrieves the validators of a cache entry.
+
+        Args:
+            query_id (int): The ID of the cache entry.
+
+        Returns:
+            tuple: The ETag and Last-Modified validators, or (None, None).
+        """
+        raise NotImplementedError
+
+    def add_hits(self, hits: list) -> None:
+        """Adds buffered hits to cache entries, see add_hits_cache.
+
+        Args:
+            hits (list): (count, timestamp, query_id) tuples.
+
+        Returns:
+            None.
+        """
+        raise NotImplementedError
+
+    def entries(self, batch_size: int) -> Iterator[tuple]:
+        """Yields every cache entry, reading batch_size entries at a time.
+
+        Args:
+            batch_size (int): The number of entries read at a time.
+
+        Yields:
+            tuple: The ID, query, stored response, hits, last hit time and fetch
+                time of an entry.
+        """
+        raise NotImplementedError
+
+    def merge(self, entries: list) -> None:
+        """Merges exported cache entries, see merge_cache_batch.
+
+        Args:
+            entries (list): (query, response, hits, timestamp, fetched) tuples.
+
+        Returns:
+            None.
+        """
+        raise NotImplementedError
+
+    def evict(self, limit: Optional[int] = None) -> int:
+        """Evicts the cache entries that are expired or over the cache budget, see evict_cache.
+
+        Args:
+            limit (int, optional): The maximum number of entries to remove. Defaults to None.
+
+        Returns:
+            int: The number of evicted entries.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Retrieves statistics about the cache entries.
+
+        Returns:
+            dict: The number of entries and of searches without results, their size
+                in bytes, the number of expired entries, the oldest fetch and
+                latest hit times, and the size of the files holding them, or None.
+        """
+        raise NotImplementedError
+
+    def clean(self) -> None:
+        """Deletes every cache entry.
+
+        Returns:
+            None.
+        """
+        raise NotImplementedError
+
+    def acquire_lease(self, key: str, owner: str, duration: float) -> bool:
+        """Acquires the lease on a key, see acquire_lease.
+
+        Args:
+            key (str): The key to lease, a normalized search query.
+            owner (str): A unique identifier of the caller.
+            duration (float): The number of seconds after which the lease expires.
+
+        Returns:
+            bool: Whether the lease was acquired.
+        """
+        raise NotImplementedError
+
+    def release_lease(self, key: str, owner: str) -> None:
+        """Releases a lease, if it is still held by the given owner.
+
+        Args:
+            key (str): The leased key.
+            owner (str): The identifier the lease was acquired with.
+
+        Returns:
+            None.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Releases the resources of the backend, such as its connections.
+
+        Returns:
+            None.
+        """
+
+
+class SqliteBackend(CacheBackend):
+    """Stores the cache entries in the CACHE table of a SQLite database.
+
+    Args:
+        store (SqliteStore): The database.
+        share (float, optional): The share of the cache budgets the database holds.
+            Defaults to 1.0.
+    """
+
+    def __init__(self, store: SqliteStore, share: float = 1.0):
+        self.store = store
+        self.share = share
+
+    def lookup(self, query):
+        with self.store.connection() as conn:
+            return lookup_cache(conn, query)
+
+    def lookup_key(self, key: str) -> Optional[tuple]:
+        """Looks up a normalized query only, see lookup_key."""
+        with self.store.connection() as conn:
+            return lookup_key(conn, key)
+
+    def lookup_name(self, query: str) -> Optional[tuple]:
+        """Looks up the character names only, see lookup_name."""
+        with self.store.connection() as conn:
+            return lookup_name(conn, query)
+
+    def lookup_many(self, queries):
+        # All lookups run back to back on the connection
+        with self.store.connection() as conn:
+            return {query: lookup_cache(conn, query) for query in queries}
+
+    def insert(self, query, response, timestamp):
+        query_key = normalize_query(query)
+        with self.store.transaction() as conn:
+            conn.execute(
+                INSERT_CACHE,
+                (query, query_key, response, timestamp, response_name(response)),
+            )
+            conn.execute("DELETE FROM LEASES WHERE KEY = ?;", (query_key,))
+            query_id = conn.execute(
+                "SELECT ID FROM CACHE WHERE QUERY_KEY = ?;", (query_key,)
+            ).fetchone()[0]
+            evict_cache(conn, db.CACHE_EVICTION_BATCH, self.share)
+        return query_id
+
+    def update(self, query_id, response, hits, timestamp):
+        with self.store.transaction() as conn:
+            conn.execute(
+                UPDATE_CACHE,
+                (response, timestamp, hits, query_id, response_name(response)),
+            )
+            evict_cache(conn, db.CACHE_EVICTION_BATCH, self.share)
+
+    def write(self, inserts=(), updates=()):
+        with self.store.transaction() as conn:
+            conn.executemany(
+                INSERT_CACHE,
+                [
+                    (
+                        query,
+                        normalize_query(query),
+                        response,
+                        timestamp,
+                        response_name(response),
+                    )
+                    for query, response, timestamp in inserts
+                ],
+            )
+            conn.executemany(
+                "DELETE FROM LEASES WHERE KEY = ?;",
+                [(normalize_query(query),) for query, _, _ in inserts],
+            )
+            conn.executemany(
+                UPDATE_CACHE,
+                [(*update, response_name(update[0])) for update in updates],
+            )
+            evict_cache(conn, db.CACHE_EVICTION_BATCH, self.share)
+
+    def refresh(self, query_id, response, timestamp, validators):
+        with self.store.transaction() as conn:
+            if response is not None:
+                conn.execute(
+                    "UPDATE CACHE SET RESPONSE = ?1, NEGATIVE = ?1 = '[]', NAME = ?2 WHERE ID = ?3;",
+                    (response, response_name(response), query_id),
+                )
+            conn.execute(
+                "UPDATE CACHE SET FETCHED = ?, ETAG = ?, LAST_MODIFIED = ? WHERE ID = ?;",
+                (timestamp, *validators, query_id),
+            )
+
+    def validators(self, query_id):
+        with self.store.connection() as conn:
+            validators = conn.execute(
+                "SELECT ETAG, LAST_MODIFIED FROM CACHE WHERE ID = ?;", (query_id,)
+            ).fetchone()
+        return validators or (None, None)
+
+    def add_hits(self, hits):
+        with self.store.transaction() as conn:
+            conn.executemany(
+                "UPDATE CACHE SET HITS = HITS + ?, TIMESTAMP = MAX(TIMESTAMP, ?) WHERE ID = ?;",
+                hits,
+            )
+
+    def entries(self, batch_size):
+        last = 0
+        while True:
+            with self.store.connection() as conn:
+                rows = conn.execute(
+                    """SELECT ID, QUERY, RESPONSE, HITS, TIMESTAMP, FETCHED FROM CACHE
+                        WHERE ID > ? ORDER BY ID LIMIT ?;""",
+                    (last, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield from rows
+
+    def merge(self, entries):
+        with self.store.transaction() as conn:
+            conn.executemany(
+                MERGE_CACHE,
+                [
+                    (
+                        query,
+                        normalize_query(query),
+                        response,
+                        hits,
+                        timestamp,
+                        fetched,
+                        response_name(response),
+                    )
+                    for query, response, hits, timestamp, fetched in entries
+                ],
+            )
+            evict_cache(conn, db.CACHE_EVICTION_BATCH, self.share)
+
+    def evict(self, limit=None):
+        with self.store.transaction() as conn:
+            return evict_cache(conn, limit, self.share)
+
+    def stats(self):
+        oldest, negative, _ = stale_after()
+        with self.store.connection() as conn:
+            rows, size = conn.execute("SELECT ROWS, BYTES FROM CACHE_STATS;").fetchone()
+            expired = conn.execute(
+                "SELECT COUNT(*) FROM CACHE WHERE FETCHED < (CASE WHEN NEGATIVE THEN ? ELSE ? END);",
+                (negative, oldest),
+            ).fetchone()[0]
+            negatives = conn.execute(
+                "SELECT COUNT(*) FROM CACHE WHERE NEGATIVE = 1;"
+            ).fetchone()[0]
+            oldest_fetch, latest_hit = conn.execute(
+                "SELECT MIN(FETCHED), MAX(TIMESTAMP) FROM CACHE;"
+            ).fetchone()
+            page_count = conn.execute("PRAGMA page_count;").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size;").fetchone()[0]
+        return {
+            "entries": rows,
+            "negative_entries": negatives,
+            "bytes": size,
+            "expired": expired,
+            "oldest_fetch": oldest_fetch,
+            "latest_hit": latest_hit,
+            "database_bytes": page_count * page_size,
+        }
+
+    def clean(self):
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM CACHE;")
+
+    def acquire_lease(self, key, owner, duration):
+        now = datetime.now()
+        with self.store.transaction() as conn:
+            return (
+                conn.execute(
+                    """INSERT INTO LEASES (KEY, OWNER, EXPIRES) VALUES (?, ?, ?)
+                        ON CONFLICT (KEY) DO UPDATE SET OWNER = excluded.OWNER, EXPIRES = excluded.EXPIRES
+                        WHERE LEASES.EXPIRES < ?;""",
+                    (key, owner, now + timedelta(seconds=duration), now),
+                ).rowcount
+                > 0
+            )
+
+    def release_lease(self, key, owner):
+        with self.store.transaction() as conn:
+            conn.execute(
+                "DELETE FROM LEASES WHERE KEY = ? AND OWNER = ?;", (key, owner)
+            )
+
+    def close(self):
+        self.store.close()
+
+
+class ShardedSqliteBackend(CacheBackend):
+    """Spreads the cache entries over several SQLite files by the hash of their
+    normalized query.
+
+    Every shard has its own connection, lock and write lock, so writes to
+    different shards run concurrently, across threads and processes. The ID of an
+    entry is its ID in its shard times the number of shards plus the shard number.
+    A query is looked up in its own shard, and the name fallback then asks every
+    shard in turn. Each shard holds an equal share of the cache budgets, and only
+    the cache tables, see SHARD_MIGRATIONS.
+
+    Args:
+        paths (list): The paths of the shard files, created if they do not exist.
+    """
+
+    def __init__(self, paths: list):
+        self.shards = []
+        for path in paths:
+            store = SqliteStore(path)
+            migrate_db(store, SHARD_MIGRATIONS)
+            self.shards.append(SqliteBackend(store, 1 / len(paths)))
+
+    def shard_of(self, key: str) -> int:
+        """Returns the number of the shard holding a normalized query."""
+        digest = blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % len(self.shards)
+
+    def locate(self, query_id: int) -> tuple:
+        """Returns the shard of an entry ID and the ID of the entry in it."""
+        return self.shards[query_id % len(self.shards)], query_id // len(self.shards)
+
+    def entry_id(self, shard: int, query_id: int) -> int:
+        """Returns the ID of the entry with the given ID in a shard."""
+        return query_id * len(self.shards) + shard
+
+    def with_entry_id(self, shard: int, row: Optional[tuple]) -> Optional[tuple]:
+        return (self.entry_id(shard, row[0]), *row[1:]) if row else None
+
+    def lookup(self, query):
+        key = normalize_query(query)
+        shard = self.shard_of(key)
+        row = self.shards[shard].lookup_key(key)
+        if row:
+            return self.with_entry_id(shard, row)
+        for shard, backend in enumerate(self.shards):
+            row = backend.lookup_name(query)
+            if row:
+                return self.with_entry_id(shard, row)
+        return None
+
+    def insert(self, query, response, timestamp):
+        shard = self.shard_of(normalize_query(query))
+        return self.entry_id(
+            shard, self.shards[shard].insert(query, response, timestamp)
+        )
+
+    def update(self, query_id, response, hits, timestamp):
+        backend, query_id = self.locate(query_id)
+        backend.update(query_id, response, hits, timestamp)
+
+    def write(self, inserts=(), updates=()):
+        groups = [([], []) for _ in self.shards]
+        for insert in inserts:
+            groups[self.shard_of(normalize_query(insert[0]))][0].append(insert)
+        for *update, query_id in updates:
+            groups[query_id % len(self.shards)][1].append(
+                (*update, query_id // len(self.shards))
+            )
+        for backend, (shard_inserts, shard_updates) in zip(self.shards, groups):
+            if shard_inserts or shard_updates:
+                backend.write(shard_inserts, shard_updates)
+
+    def refresh(self, query_id, response, timestamp, validators):
+        backend, query_id = self.locate(query_id)
+        backend.refresh(query_id, response, timestamp, validators)
+
+    def validators(self, query_id):
+        backend, query_id = self.locate(query_id)
+        return backend.validators(query_id)
+
+    def add_hits(self, hits):
+        groups = [[] for _ in self.shards]
+        for count, timestamp, query_id in hits:
+            groups[query_id % len(self.shards)].append(
+                (count, timestamp, query_id // len(self.shards))
+            )
+        for backend, shard_hits in zip(self.shards, groups):
+            if shard_hits:
+                backend.add_hits(shard_hits)
+
+    def entries(self, batch_size):
+        for shard, backend in enumerate(self.shards):
+            for row in backend.entries(batch_size):
+                yield self.with_entry_id(shard, row)
+
+    def merge(self, entries):
+        groups = [[] for _ in self.shards]
+        for entry in entries:
+            groups[self.shard_of(normalize_query(entry[0]))].append(entry)
+        for backend, shard_entries in zip(self.shards, groups):
+            if shard_entries:
+                backend.merge(shard_entries)
+
+    def evict(self, limit=None):
+        return sum(backend.evict(limit) for backend in self.shards)
+
+    def stats(self):
+        shards = [backend.stats() for backend in self.shards]
+        totals = {
+            name: sum(stats[name] for stats in shards)
+            for name in (
+                "entries",
+                "negative_entries",
+                "bytes",
+                "expired",
+                "database_bytes",
+            )
+        }
+        fetches = [stats["oldest_fetch"] for stats in shards if stats["oldest_fetch"]]
+        hits = [stats["latest_hit"] for stats in shards if stats["latest_hit"]]
+        return {
+            **totals,
+            "oldest_fetch": min(fetches, default=None),
+            "latest_hit": max(hits, default=None),
+        }
+
+    def clean(self):
+        for backend in self.shards:
+            backend.clean()
+
+    def acquire_lease(self, key, owner, duration):
+        return self.shards[self.shard_of(key)].acquire_lease(key, owner, duration)
+
+    def release_lease(self, key, owner):
+        self.shards[self.shard_of(key)].release_lease(key, owner)
+
+    def close(self):
+        for backend in self.shards:
+            backend.close()
+
+
+def response_size(response: Union[str, bytes]) -> int:
+    """Returns the size of a stored response in bytes, as SQLite counts it."""
+    return len(response.encode() if isinstance(response, str) else response)
+
+
+class MemoryBackend(CacheBackend):
+    """Keeps the cache entries in the memory of the process, for tests and long
+    running processes such as serve. Nothing is persisted and leases only
+    coordinate the threads of the process.
+
+    Entries over the cache budgets are evicted on every write, like in SQLite,
+    while expired entries, which lookups already skip, are swept every
+    CACHE_EVICTION_BATCH writes so that writes do not scan the whole cache.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        # Entries by normalized query, in the order of their IDs
+        self._entries = {}
+        self._ids = {}
+        self._leases = {}
+        self._next_id = 1
+        self._writes = 0
+        self._bytes = 0
+        self._negatives = 0
+
+    def _set_response(self, entry: dict, response: Union[str, bytes]) -> None:
+        if "response" in entry:
+            self._bytes -= response_size(entry["response"])
+            self._negatives -= entry["response"] == "[]"
+        entry["response"] = response
+        entry["name"] = response_name(response)
+        self._bytes += response_size(response)
+        self._negatives += response == "[]"
+
+    def _add(self, query: str, hits: int) -> dict:
+        entry = {"id": self._next_id, "key": normalize_query(query), "query": query}
+        entry.update(hits=hits, etag=None, last_modified=None)
+        self._next_id += 1
+        self._entries[entry["key"]] = entry
+        self._ids[entry["id"]] = entry
+        return entry
+
+    def _remove(self, entry: dict) -> None:
+        del self._entries[entry["key"]]
+        del self._ids[entry["id"]]
+        self._bytes -= response_size(entry["response"])
+        self._negatives -= entry["response"] == "[]"
+
+    def _put(self, query: str, response: Union[str, bytes], timestamp: str) -> dict:
+        entry = self._entries.get(normalize_query(query)) or self._add(query, 1)
+        self._set_response(entry, response)
+        entry["timestamp"] = entry["fetched"] = str(timestamp)
+        self._leases.pop(entry["key"], None)
+        return entry
+
+    def _row(self, entry: dict, soft: datetime) -> tuple:
+        stale = entry["response"] != "[]" and entry["fetched"] < str(soft)
+        return entry["id"], entry["response"], entry["hits"], entry["timestamp"], stale
+
+    def _expired(self, entry: dict, oldest: datetime, negative: datetime) -> bool:
+        return entry["fetched"] < str(negative if entry["response"] == "[]" else oldest)
+
+    def _evict(self, limit: Optional[int] = None, sweep: bool = True) -> int:
+        oldest, negative, _ = stale_after()
+        victims = []
+        if sweep:
+            by_fetch = sorted(
+                self._entries.values(), key=lambda entry: entry["fetched"]
+            )
+            victims = [e for e in by_fetch if self._expired(e, oldest, negative)]
+            if db.NEGATIVE_CACHE_MAX_ROWS is not None:
+                negatives = [
+                    entry
+                    for entry in by_fetch
+                    if entry["response"] == "[]"
+                    and not self._expired(entry, oldest, negative)
+                ]
+                victims += negatives[
+                    : max(0, len(negatives) - db.NEGATIVE_CACHE_MAX_ROWS)
+                ]
+        elif db.NEGATIVE_CACHE_MAX_ROWS is not None:
+            excess = self._negatives - db.NEGATIVE_CACHE_MAX_ROWS
+            if excess > 0:
+                negatives = [e for e in self._entries.values() if e["response"] == "[]"]
+                victims = sorted(negatives, key=lambda entry: entry["fetched"])[:excess]
+        victims = victims if limit is None else victims[:limit]
+        for entry in victims:
+            self._remove(entry)
+        evicted = len(victims)
+
+        rows, size = len(self._entries), self._bytes
+        over_rows = rows - db.CACHE_MAX_ROWS if db.CACHE_MAX_ROWS is not None else 0
+        over_bytes = size - db.CACHE_MAX_BYTES if db.CACHE_MAX_BYTES is not None else 0
+        excess = max(over_rows, ceil(over_bytes * rows / size) if over_bytes > 0 else 0)
+        if excess > 0 and (limit is None or evicted < limit):
+            count = excess if limit is None else min(excess, limit - evicted)
+            columns = EVICTION_ORDER[db.CACHE_EVICTION_POLICY].lower().split(", ")
+            order = sorted(
+                self._entries.values(),
+                key=lambda entry: tuple(entry[column] for column in columns),
+            )
+            for entry in order[:count]:
+                self._remove(entry)
+            evicted += min(count, len(order))
+        return evicted
+
+    def _evict_on_write(self) -> None:
+        self._writes += 1
+        batch = db.CACHE_EVICTION_BATCH
+        self._evict(batch, self._writes % batch == 0)
+
+    def lookup(self, query):
+        oldest, negative, soft = stale_after()
+        with self._lock:
+            entry = self._entries.get(normalize_query(query))
+            if entry and not self._expired(entry, oldest, negative):
+                return self._row(entry, soft)
+            needle = query.strip().casefold()
+            for entry in self._entries.values():
+                if (
+                    entry["name"] is not None
+                    and needle in entry["name"].casefold()
+                    and entry["fetched"] >= str(oldest)
+                ):
+                    return self._row(entry, soft)
+        return None
+
+    def insert(self, query, response, timestamp):
+        with self._lock:
+            query_id = self._put(query, response, timestamp)["id"]
+            self._evict_on_write()
+        return query_id
+
+    def update(self, query_id, response, hits, timestamp):
+        with self._lock:
+            entry = self._ids.get(query_id)
+            if entry:
+                self._set_response(entry, response)
+                entry["timestamp"] = entry["fetched"] = str(timestamp)
+                entry["hits"] = hits
+            self._evict_on_write()
+
+    def write(self, inserts=(), updates=()):
+        with self._lock:
+            for query, response, timestamp in inserts:
+                self._put(query, response, timestamp)
+            for response, timestamp, hits, query_id in updates:
+                entry = self._ids.get(query_id)
+                if entry:
+                    self._set_response(entry, response)
+                    entry["timestamp"] = entry["fetched"] = str(timestamp)
+                    entry["hits"] = hits
+            self._evict_on_write()
+
+    def refresh(self, query_id, response, timestamp, validators):
+        with self._lock:
+            entry = self._ids.get(query_id)
+            if entry:
+                if response is not None:
+                    self._set_response(entry, response)
+                entry["fetched"] = str(timestamp)
+                entry["etag"], entry["last_modified"] = validators
+
+    def validators(self, query_id):
+        with self._lock:
+            entry = self._ids.get(query_id)
+            return (entry["etag"], entry["last_modified"]) if entry else (None, None)
+
+    def add_hits(self, hits):
+        with self._lock:
+            for count, timestamp, query_id in hits:
+                entry = self._ids.get(query_id)
+                if entry:
+                    entry["hits"] += count
+                    entry["timestamp"] = max(entry["timestamp"], str(timestamp))
+
+    def entries(self, batch_size):
+        with self._lock:
+            rows = [
+                (
+                    e["id"],
+                    e["query"],
+                    e["response"],
+                    e["hits"],
+                    e["timestamp"],
+                    e["fetched"],
+                )
+                for e in self._entries.values()
+            ]
+        return iter(rows)
+
+    def merge(self, entries):
+        with self._lock:
+            for query, response, hits, timestamp, fetched in entries:
+                entry = self._entries.get(normalize_query(query))
+                if entry is None:
+                    entry = self._add(query, hits)
+                    entry["timestamp"] = entry["fetched"] = ""
+                    self._set_response(entry, response)
+                elif str(fetched) > entry["fetched"]:
+                    self._set_response(entry, response)
+                entry["hits"] = max(entry["hits"], hits)
+                entry["timestamp"] = max(entry["timestamp"], str(timestamp))
+                entry["fetched"] = max(entry["fetched"], str(fetched))
+            self._evict_on_write()
+
+    def evict(self, limit=None):
+        with self._lock:
+            return self._evict(limit)
+
+    def stats(self):
+        oldest, negative, _ = stale_after()
+        with self._lock:
+            entries = list(self._entries.values())
+            return {
+                "entries": len(entries),
+                "negative_entries": self._negatives,
+                "bytes": self._bytes,
+                "expired": sum(self._expired(e, oldest, negative) for e in entries),
+                "oldest_fetch": min((e["fetched"] for e in entries), default=None),
+                "latest_hit": max((e["timestamp"] for e in entries), default=None),
+                "database_bytes": None,
+            }
+
+    def clean(self):
+        with self._lock:
+            self._entries.clear()
+            self._ids.clear()
+            self._bytes = self._negatives = 0
+
+    def acquire_lease(self, key, owner, duration):
+        now = datetime.now()
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease and lease[1] >= now:
+                return False
+            self._leases[key] = (owner, now + timedelta(seconds=duration))
+            return True
+
+    def release_lease(self, key, owner):
+        with self._lock:
+            if self._leases.get(key, (None,))[0] == owner:
+                del self._leases[key]
+
+
+def shard_paths(path: str, shards: int = CACHE_SHARDS) -> list:
+    """Returns the paths of the shard files of the sharded backend, next to a database.
+
+    Args:
+        path (str): The path of the database, such as swapi.db.
+        shards (int, optional): The number of shards. Defaults to CACHE_SHARDS.
+
+    Returns:
+        list: The paths, such as swapi-shard0.db.
+    """
+    base, extension = splitext(path)
+    return [f"{base}-shard{shard}{extension}" for shard in range(shards)]
+
+
+def create_backend(name: str, store: SqliteStore) -> CacheBackend:
+    """Creates a cache backend.
+
+    Args:
+        name (str): "sqlite" to keep the entries in the shared database, "sharded"
+            to spread them over CACHE_SHARDS files next to it, or "memory".
+        store (SqliteStore): The shared database.
+
+    Returns:
+        CacheBackend: The backend.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if name == "sqlite":
+        return SqliteBackend(store)
+    if name == "sharded":
+        return ShardedSqliteBackend(shard_paths(store.path))
+    if name == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown cache backend {name}, use one of {list(BACKENDS)}")
+
+
+def migrate_cache(source: str, target: str, batch_size: int) -> int:
+    """Copies every cache entry of a backend into another, batch_size entries at a
+    time. Entries already in the target are merged, see merge_cache_batch, so a
+    migration can be repeated.
+
+    Args:
+        source (str): The backend to read, such as "sqlite".
+        target (str): The backend to write, such as "sharded".
+        batch_size (int): The number of entries per write.
+
+    Returns:
+        int: The number of copied entries.
+
+    Raises:
+        ValueError: If the backends are the same.
+    """
+    if source == target:
+        raise ValueError(f"Cannot migrate the {source} cache backend to itself")
+    batch, count = [], 0
+    # Closed even if the copy fails, the shared database reconnects on next use
+    with closing(db.open_backend(source)) as reader:
+        with closing(db.open_backend(target)) as writer:
+            for _, *entry in reader.entries(batch_size):
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    writer.merge(batch)
+                    count += len(batch)
+                    batch.clear()
+            if batch:
+                writer.merge(batch)
+                count += len(batch)
+    return count
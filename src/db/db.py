@@ -1,15 +1,185 @@
+import atexit
 import sqlite3
-import sys
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from json import dumps, loads
+from math import ceil
 from os.path import dirname, join
+from threading import RLock
+from typing import TYPE_CHECKING, Iterator, Optional, Union
 
-from src.config import DATABASE
+from src.config import (
+    CACHE_BACKEND,
+    CACHE_EVICTION_BATCH,
+    CACHE_EVICTION_POLICY,
+    CACHE_MAX_BYTES,
+    CACHE_MAX_ROWS,
+    CACHE_SOFT_TTL,
+    CACHE_TTL,
+    DATABASE,
+    MIRROR_TTL,
+    NEGATIVE_CACHE_MAX_ROWS,
+    NEGATIVE_CACHE_TTL,
+    SEARCH_EVENTS_TTL,
+    SQLITE_BUSY_TIMEOUT,
+    SQLITE_CACHE_SIZE,
+    SQLITE_MMAP_SIZE,
+    SQLITE_SYNCHRONOUS,
+)
 from src.utils.filesystem_utils import file_exists
+from src.utils.metrics_utils import increment, span, timed
+from src.utils.storage_utils import (
+    decode_response,
+    encode_character,
+    encode_planet,
+    response_name,
+)
+
+if TYPE_CHECKING:
+    from src.db.backends import CacheBackend
 
 DATABASE = join(dirname(__file__), DATABASE)
 
+# The order in which each eviction policy removes cache entries.
+EVICTION_ORDER = {"lfu": "HITS, TIMESTAMP", "lru": "TIMESTAMP"}
+
+NAME_TOKENIZER = "trigram" if sqlite3.sqlite_version_info >= (3, 34, 0) else "unicode61"
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a search query into its cache key.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        str: The query in lower case with surrounding and repeated whitespace removed.
+    """
+    return " ".join(query.split()).casefold()
+
+
+class SqliteStore:
+    """A SQLite database file and the connection the process shares to it.
+
+    The connection runs in autocommit mode with WAL journaling and the pragmas set
+    in src/config.py. It is guarded by a lock, so several threads use it through
+    connection() and transaction().
+
+    Args:
+        path (str, optional): The path of the database file. Defaults to None,
+            which is DATABASE.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._conn = None
+        self._lock = RLock()
+        # The nesting depth of the currently open transaction
+        self._depth = 0
+
+    @property
+    def path(self) -> str:
+        return self._path or DATABASE
+
+    def get_db(self) -> sqlite3.Connection:
+        """Returns the connection to the database, connecting on first use.
+
+        Returns:
+            sqlite3.Connection: A connection object to the SQLite database.
+
+        Raises:
+            Exception: If an error occurs while connecting to the database.
+        """
+        with self._lock:
+            if self._conn is None:
+                try:
+                    with span("db.connect"):
+                        conn = sqlite3.connect(
+                            self.path,
+                            timeout=SQLITE_BUSY_TIMEOUT,
+                            isolation_level=None,
+                            check_same_thread=False,
+                        )
+                        conn.execute("PRAGMA journal_mode = WAL;")
+                        conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS};")
+                        conn.execute(f"PRAGMA cache_size = {SQLITE_CACHE_SIZE};")
+                        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE};")
+                        conn.execute("PRAGMA temp_store = MEMORY;")
+                except (sqlite3.Error, sqlite3.Warning) as e:
+                    raise Exception(e)
+                self._conn = conn
+                atexit.register(self.close)
+            return self._conn
+
+    def close(self) -> None:
+        """Closes the connection, if it is open.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Gives the calling thread exclusive use of the connection, for reads.
+
+        Yields:
+            sqlite3.Connection: The connection.
+        """
+        with self._lock:
+            yield self.get_db()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Runs the enclosed statements in one transaction on the connection.
+
+        The transaction is committed when the block exits and rolled back if it
+        raises. Nested transactions join the enclosing one through a savepoint, so
+        callers can group several writes into a single commit.
+
+        Yields:
+            sqlite3.Connection: The connection.
+        """
+        with self._lock:
+            conn = self.get_db()
+            savepoint = f"SP{self._depth}"
+            conn.execute(
+                "BEGIN IMMEDIATE;" if self._depth == 0 else f"SAVEPOINT {savepoint};"
+            )
+            self._depth += 1
+            try:
+                yield conn
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    conn.rollback()
+                else:
+                    conn.execute(f"ROLLBACK TO {savepoint};")
+                    conn.execute(f"RELEASE {savepoint};")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                conn.commit()
+            else:
+                conn.execute(f"RELEASE {savepoint};")
+
+
+# The database shared by the whole process, which holds the resources, the mirror
+# and the analytics, and the cache entries unless CACHE_BACKEND stores them elsewhere.
+_store = SqliteStore()
+
+# The cache backend of the process, created on first use by get_backend().
+_backend = None
+_backend_lock = RLock()
+
 
-def get_db():
-    """Connects to the SQLite database and returns a Connection object.
+def get_db() -> sqlite3.Connection:
+    """Returns the SQLite connection shared by the process, connecting on first use.
+
+    Use connection() or transaction() to access it from several threads.
 
     Returns:
         sqlite3.Connection: A connection object to the SQLite database.
@@ -17,153 +187,1675 @@ def get_db():
     Raises:
         Exception: If an error occurs while connecting to the database.
     """
-    try:
-        return sqlite3.connect(DATABASE)
-    except (sqlite3.Error, sqlite3.Warning) as e:
-        raise Exception(e)
+    return _store.get_db()
+
+
+def close_db() -> None:
+    """Closes the shared SQLite connection and the cache backend, if they are open.
+
+    Returns:
+        None.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+            _backend = None
+    _store.close()
+
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    """Gives the calling thread exclusive use of the shared connection, for reads.
+
+    Yields:
+        sqlite3.Connection: The shared connection.
+    """
+    with _store.connection() as conn:
+        yield conn
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Runs the enclosed statements in one transaction on the shared connection.
+
+    See SqliteStore.transaction.
+
+    Yields:
+        sqlite3.Connection: The shared connection.
+    """
+    with _store.transaction() as conn:
+        yield conn
+
+
+def get_backend() -> "CacheBackend":
+    """Returns the cache backend of the process, creating it on first use.
+
+    The backend is chosen by CACHE_BACKEND, see src/db/backends.py.
+
+    Returns:
+        CacheBackend: The backend storing the cache entries.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = open_backend(CACHE_BACKEND)
+        return _backend
+
+
+def open_backend(name: str) -> "CacheBackend":
+    """Creates a cache backend over the shared database.
+
+    Args:
+        name (str): The backend, see src/db/backends.py.
+
+    Returns:
+        CacheBackend: The backend.
+    """
+    # Imported here, as the backends build on this module
+    from src.db.backends import create_backend
 
+    return create_backend(name, _store)
 
-def create_cache_table():
+
+def create_cache_table(store: Optional[SqliteStore] = None) -> None:
     """Creates the CACHE table in the SQLite database.
 
+    Args:
+        store (SqliteStore, optional): The database. Defaults to None, the shared one.
+
     Returns:
         None.
     """
     try:
-        conn = get_db()
-        conn.execute(
-            """CREATE TABLE CACHE
+        with (store or _store).transaction() as conn:
+            conn.execute(
+                """CREATE TABLE CACHE
                      (ID            INTEGER PRIMARY KEY AUTOINCREMENT,
                      QUERY          TEXT NOT NULL,
                      RESPONSE       TEXT NOT NULL,
                      TIMESTAMP      DATETIME NOT NULL,
                      HITS           INT NOT NULL DEFAULT 1
                      );"""
-        )
-        conn.close()
+            )
     except (sqlite3.Error, sqlite3.Warning) as e:
         raise Exception(e)
 
 
-def insert_cache(query: str, response: str, timestamp: str) -> None:
-    """Inserts a cache entry into the CACHE table.
+def add_query_key(conn: sqlite3.Connection) -> None:
+    """Adds the normalized QUERY_KEY column and its unique index to the CACHE table.
+
+    Entries whose queries normalize to the same key are merged into the oldest one,
+    which keeps the sum of their hits and the latest timestamp.
 
     Args:
-        query (str): The search query.
-        response (str): The response to the search query.
-        timestamp (str): The timestamp of the cache entry.
+        conn (sqlite3.Connection): The connection to migrate.
 
     Returns:
         None.
     """
-    try:
+    conn.execute("ALTER TABLE CACHE ADD COLUMN QUERY_KEY TEXT;")
+    rows = conn.execute("SELECT ID, QUERY FROM CACHE;").fetchall()
+    conn.executemany(
+        "UPDATE CACHE SET QUERY_KEY = ? WHERE ID = ?;",
+        [(normalize_query(query), query_id) for query_id, query in rows],
+    )
+    conn.execute(
+        """UPDATE CACHE SET
+                HITS = (SELECT SUM(HITS) FROM CACHE AS C WHERE C.QUERY_KEY = CACHE.QUERY_KEY),
+                TIMESTAMP = (SELECT MAX(TIMESTAMP) FROM CACHE AS C WHERE C.QUERY_KEY = CACHE.QUERY_KEY)
+            WHERE ID IN (SELECT MIN(ID) FROM CACHE GROUP BY QUERY_KEY HAVING COUNT(*) > 1);"""
+    )
+    conn.execute(
+        "DELETE FROM CACHE WHERE ID NOT IN (SELECT MIN(ID) FROM CACHE GROUP BY QUERY_KEY);"
+    )
+    conn.execute("CREATE UNIQUE INDEX CACHE_QUERY_KEY ON CACHE (QUERY_KEY);")
+
+
+def create_name_index(conn: sqlite3.Connection) -> None:
+    """Creates the CACHE_NAMES full-text index over the character names of the CACHE table.
+
+    The index is kept in sync with the CACHE table by triggers and backs the
+    substring fallback of get_cache.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute(
+        f"CREATE VIRTUAL TABLE CACHE_NAMES USING fts5(NAME, tokenize='{NAME_TOKENIZER}');"
+    )
+    has_name = "json_valid(new.RESPONSE) AND json_type(new.RESPONSE, '$.name') = 'text'"
+    index_name = "INSERT INTO CACHE_NAMES (rowid, NAME) VALUES (new.ID, json_extract(new.RESPONSE, '$.name'));"
+    conn.execute(
+        f"""CREATE TRIGGER CACHE_NAMES_INSERT AFTER INSERT ON CACHE WHEN {has_name}
+            BEGIN {index_name} END;"""
+    )
+    conn.execute(
+        f"""CREATE TRIGGER CACHE_NAMES_UPDATE AFTER UPDATE OF RESPONSE ON CACHE
+            BEGIN
+                DELETE FROM CACHE_NAMES WHERE rowid = old.ID;
+                INSERT INTO CACHE_NAMES (rowid, NAME)
+                    SELECT new.ID, json_extract(new.RESPONSE, '$.name') WHERE {has_name};
+            END;"""
+    )
+    conn.execute(
+        """CREATE TRIGGER CACHE_NAMES_DELETE AFTER DELETE ON CACHE
+            BEGIN DELETE FROM CACHE_NAMES WHERE rowid = old.ID; END;"""
+    )
+    conn.execute(
+        """INSERT INTO CACHE_NAMES (rowid, NAME)
+            SELECT ID, json_extract(RESPONSE, '$.name') FROM CACHE
+            WHERE json_valid(RESPONSE) AND json_type(RESPONSE, '$.name') = 'text';"""
+    )
+
+
+def create_resources_table(conn: sqlite3.Connection) -> None:
+    """Creates the RESOURCES table, which caches SWAPI resources such as planets by URL.
 
-        conn = get_db()
+    Homeworlds embedded in existing CACHE entries are moved to the RESOURCES table
+    and replaced by their URL.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute(
+        """CREATE TABLE RESOURCES
+                 (URL           TEXT PRIMARY KEY,
+                 RESPONSE       TEXT NOT NULL,
+                 TIMESTAMP      DATETIME NOT NULL
+                 );"""
+    )
+    rows = conn.execute(
+        """SELECT ID, RESPONSE, TIMESTAMP FROM CACHE
+            WHERE json_valid(RESPONSE) AND json_type(RESPONSE, '$.homeworld') = 'object';"""
+    ).fetchall()
+    for query_id, response, timestamp in rows:
+        response = loads(response)
+        homeworld = response["homeworld"]
         conn.execute(
-            "INSERT INTO CACHE (QUERY, RESPONSE, TIMESTAMP) VALUES (?, ?, ?);",
-            (query, response, timestamp),
+            f"{INSERT_RESOURCE} WHERE excluded.TIMESTAMP > RESOURCES.TIMESTAMP;",
+            (homeworld["url"], dumps(homeworld), timestamp),
+        )
+        response["homeworld"] = homeworld["url"]
+        conn.execute(
+            "UPDATE CACHE SET RESPONSE = ? WHERE ID = ?;", (dumps(response), query_id)
         )
-        conn.commit()
-        conn.close()
-    except (sqlite3.Error, sqlite3.Warning) as e:
-        raise Exception(e)
 
 
-def update_cache(query_id: int, response: str, hits: int, timestamp: str) -> None:
-    """Updates a cache entry in the CACHE table.
+def create_mirror_tables(conn: sqlite3.Connection) -> None:
+    """Creates the MIRROR table, a local copy of whole SWAPI collections, and the
+    SYNC_STATE table, which records when each collection was last synced.
 
     Args:
-        query_id (int): The ID of the cache entry to update.
-        response (str): The new response to the search query.
-        timestamp (str): The new timestamp of the cache entry.
+        conn (sqlite3.Connection): The connection to migrate.
 
     Returns:
         None.
     """
-    try:
-        conn = get_db()
+    conn.execute(
+        """CREATE TABLE MIRROR
+                 (URL           TEXT PRIMARY KEY,
+                 KIND           TEXT NOT NULL,
+                 ID             INTEGER NOT NULL,
+                 NAME_KEY       TEXT NOT NULL,
+                 EDITED         TEXT,
+                 RESPONSE       TEXT NOT NULL,
+                 TIMESTAMP      DATETIME NOT NULL
+                 );"""
+    )
+    conn.execute("CREATE INDEX MIRROR_NAME ON MIRROR (KIND, NAME_KEY);")
+    conn.execute(
+        """CREATE TABLE SYNC_STATE
+                 (KIND          TEXT PRIMARY KEY,
+                 COUNT          INTEGER NOT NULL,
+                 TIMESTAMP      DATETIME NOT NULL
+                 );"""
+    )
+
+
+def add_eviction_columns(conn: sqlite3.Connection) -> None:
+    """Prepares the CACHE table for eviction.
+
+    Adds the FETCHED column, the time the response was fetched, which the TTL is
+    measured from, while TIMESTAMP keeps recording the last hit. Adds the indexes
+    the TTL and the LFU and LRU policies scan, and the CACHE_STATS table, whose
+    single row keeps the number of entries and their size up to date through
+    triggers, so budgets are checked without scanning the CACHE table.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute("ALTER TABLE CACHE ADD COLUMN FETCHED DATETIME;")
+    conn.execute("UPDATE CACHE SET FETCHED = TIMESTAMP;")
+    conn.execute("CREATE INDEX CACHE_FETCHED ON CACHE (FETCHED);")
+    conn.execute("CREATE INDEX CACHE_LRU ON CACHE (TIMESTAMP);")
+    conn.execute("CREATE INDEX CACHE_LFU ON CACHE (HITS, TIMESTAMP);")
+    create_cache_stats(conn)
+
+
+def create_cache_stats(conn: sqlite3.Connection) -> None:
+    """Creates the CACHE_STATS table, counting the current CACHE entries, and the
+    triggers that keep it up to date.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute(
+        """CREATE TABLE CACHE_STATS
+                 (ID            INTEGER PRIMARY KEY CHECK (ID = 1),
+                 ROWS           INTEGER NOT NULL,
+                 BYTES          INTEGER NOT NULL
+                 );"""
+    )
+    conn.execute(
+        """INSERT INTO CACHE_STATS (ID, ROWS, BYTES)
+            SELECT 1, COUNT(*), COALESCE(SUM(LENGTH(CAST(RESPONSE AS BLOB))), 0) FROM CACHE;"""
+    )
+    conn.execute(
+        """CREATE TRIGGER CACHE_STATS_INSERT AFTER INSERT ON CACHE
+            BEGIN
+                UPDATE CACHE_STATS SET ROWS = ROWS + 1,
+                    BYTES = BYTES + LENGTH(CAST(new.RESPONSE AS BLOB));
+            END;"""
+    )
+    conn.execute(
+        """CREATE TRIGGER CACHE_STATS_UPDATE AFTER UPDATE OF RESPONSE ON CACHE
+            BEGIN
+                UPDATE CACHE_STATS SET BYTES = BYTES
+                    + LENGTH(CAST(new.RESPONSE AS BLOB)) - LENGTH(CAST(old.RESPONSE AS BLOB));
+            END;"""
+    )
+    conn.execute(
+        """CREATE TRIGGER CACHE_STATS_DELETE AFTER DELETE ON CACHE
+            BEGIN
+                UPDATE CACHE_STATS SET ROWS = ROWS - 1,
+                    BYTES = BYTES - LENGTH(CAST(old.RESPONSE AS BLOB));
+            END;"""
+    )
+
+
+def create_analytics_tables(conn: sqlite3.Connection) -> None:
+    """Creates the SEARCH_EVENTS log and the STATS_* rollup tables the plot reads.
+
+    Every search appends one row to SEARCH_EVENTS and a trigger adds it to the
+    per-day, per-hour, per-query, per-character and per-result counters, so the
+    rollups stay small and up to date without aggregating the history. The
+    rollups are backfilled from the hits and timestamps of the existing CACHE
+    entries.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute(
+        """CREATE TABLE SEARCH_EVENTS
+                 (ID            INTEGER PRIMARY KEY AUTOINCREMENT,
+                 TIMESTAMP      DATETIME NOT NULL,
+                 QUERY          TEXT NOT NULL,
+                 NAME           TEXT,
+                 RESULT         TEXT NOT NULL
+                 );"""
+    )
+    conn.execute("CREATE INDEX SEARCH_EVENTS_TIMESTAMP ON SEARCH_EVENTS (TIMESTAMP);")
+    rollups = {
+        "STATS_DAILY": ("DAY", "date(new.TIMESTAMP)"),
+        "STATS_HOURLY": ("HOUR", "strftime('%H', new.TIMESTAMP)"),
+        "STATS_QUERIES": ("QUERY", "new.QUERY"),
+        "STATS_CHARACTERS": ("NAME", "new.NAME"),
+        "STATS_RESULTS": ("RESULT", "new.RESULT"),
+    }
+    counters = []
+    for table, (column, value) in rollups.items():
         conn.execute(
-            "UPDATE CACHE SET RESPONSE = ?, TIMESTAMP = ?, HITS =? WHERE ID = ?;",
-            (response, timestamp, hits, query_id),
+            f"""CREATE TABLE {table}
+                     ({column:<14}TEXT PRIMARY KEY,
+                     SEARCHES       INTEGER NOT NULL
+                     );"""
         )
-        conn.commit()
-        conn.close()
-    except (sqlite3.Error, sqlite3.Warning) as e:
-        raise Exception(e)
+        conn.execute(f"CREATE INDEX {table}_SEARCHES ON {table} (SEARCHES);")
+        counters.append(
+            f"""INSERT INTO {table} ({column}, SEARCHES) SELECT {value}, 1 WHERE {value} IS NOT NULL
+                    ON CONFLICT ({column}) DO UPDATE SET SEARCHES = SEARCHES + 1;"""
+        )
+    conn.execute(
+        f"""CREATE TRIGGER SEARCH_EVENTS_ROLLUP AFTER INSERT ON SEARCH_EVENTS
+            BEGIN
+                {" ".join(counters)}
+            END;"""
+    )
+
+    conn.execute(
+        """INSERT INTO STATS_DAILY (DAY, SEARCHES)
+            SELECT date(TIMESTAMP), SUM(HITS) FROM CACHE GROUP BY date(TIMESTAMP);"""
+    )
+    conn.execute(
+        """INSERT INTO STATS_HOURLY (HOUR, SEARCHES)
+            SELECT strftime('%H', TIMESTAMP), SUM(HITS) FROM CACHE GROUP BY strftime('%H', TIMESTAMP);"""
+    )
+    conn.execute(
+        """INSERT INTO STATS_QUERIES (QUERY, SEARCHES)
+            SELECT QUERY_KEY, SUM(HITS) FROM CACHE GROUP BY QUERY_KEY;"""
+    )
+    conn.execute(
+        """INSERT INTO STATS_CHARACTERS (NAME, SEARCHES)
+            SELECT json_extract(RESPONSE, '$.name') AS NAME, SUM(HITS) FROM CACHE
+            WHERE json_valid(RESPONSE) AND json_type(RESPONSE, '$.name') = 'text' GROUP BY NAME;"""
+    )
+    conn.execute(
+        """INSERT INTO STATS_RESULTS (RESULT, SEARCHES)
+            SELECT CASE WHEN RESPONSE = '[]' THEN 'not_found' ELSE 'found' END AS RESULT, SUM(HITS)
+            FROM CACHE GROUP BY RESULT;"""
+    )
 
 
-def update_hits_cache(query_id: int, hits: int, timestamp: str) -> None:
+def add_negative_column(conn: sqlite3.Connection) -> None:
+    """Adds the NEGATIVE column to CACHE, which marks the searches without results.
+
+    Negative entries expire after NEGATIVE_CACHE_TTL seconds instead of CACHE_TTL
+    and are capped at NEGATIVE_CACHE_MAX_ROWS entries.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
     """
-    Update the HITS and TIMESTAMP columns in the CACHE table for the given query ID.
+    conn.execute("ALTER TABLE CACHE ADD COLUMN NEGATIVE INT NOT NULL DEFAULT 0;")
+    conn.execute("UPDATE CACHE SET NEGATIVE = 1 WHERE RESPONSE = '[]';")
+    conn.execute("CREATE INDEX CACHE_NEGATIVE ON CACHE (NEGATIVE, FETCHED);")
+
+
+def create_leases_table(conn: sqlite3.Connection) -> None:
+    """Creates the LEASES table, which lets concurrent processes fetch each missed
+    search only once.
 
     Args:
-        query_id (int): The ID of the query to update.
-        hits (int): The new number of hits for the query.
-        timestamp (str): The new timestamp for the query in the format "YYYY-MM-DD HH:MM:SS".
+        conn (sqlite3.Connection): The connection to migrate.
 
     Returns:
         None.
     """
-    try:
-        conn = get_db()
+    conn.execute(
+        """CREATE TABLE LEASES
+                 (KEY           TEXT PRIMARY KEY,
+                 OWNER          TEXT NOT NULL,
+                 EXPIRES        DATETIME NOT NULL
+                 );"""
+    )
+
+
+def compact_responses(conn: sqlite3.Connection) -> None:
+    """Rewrites the cached responses in the compact storage format.
+
+    Characters and planets keep only the fields that are displayed or needed to
+    refresh them, and long responses are compressed, so RESPONSE may hold a BLOB.
+    The character name moves to a NAME column, which the CACHE_NAMES triggers
+    index instead of parsing RESPONSE.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute("ALTER TABLE CACHE ADD COLUMN NAME TEXT;")
+    conn.execute("DROP TRIGGER CACHE_NAMES_INSERT;")
+    conn.execute("DROP TRIGGER CACHE_NAMES_UPDATE;")
+    create_name_triggers(conn)
+    conn.execute("DELETE FROM CACHE_NAMES;")
+
+    rows = conn.execute("SELECT ID, RESPONSE FROM CACHE;").fetchall()
+    for query_id, response in rows:
+        response = encode_character(decode_response(response))
         conn.execute(
-            "UPDATE CACHE SET HITS = ?, TIMESTAMP = ? WHERE ID = ?;",
-            (hits, timestamp, query_id),
+            "UPDATE CACHE SET RESPONSE = ?, NAME = ? WHERE ID = ?;",
+            (response, response_name(response), query_id),
         )
-        conn.commit()
-        conn.close()
+    rows = conn.execute("SELECT URL, RESPONSE FROM RESOURCES;").fetchall()
+    conn.executemany(
+        "UPDATE RESOURCES SET RESPONSE = ? WHERE URL = ?;",
+        [(encode_planet(decode_response(response)), url) for url, response in rows],
+    )
+
+
+def create_name_triggers(conn: sqlite3.Connection) -> None:
+    """Creates the triggers that index the NAME column of new and updated CACHE
+    entries in CACHE_NAMES.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute(
+        """CREATE TRIGGER CACHE_NAMES_INSERT AFTER INSERT ON CACHE WHEN new.NAME IS NOT NULL
+            BEGIN INSERT INTO CACHE_NAMES (rowid, NAME) VALUES (new.ID, new.NAME); END;"""
+    )
+    conn.execute(
+        """CREATE TRIGGER CACHE_NAMES_UPDATE AFTER UPDATE OF NAME ON CACHE
+            BEGIN
+                DELETE FROM CACHE_NAMES WHERE rowid = old.ID;
+                INSERT INTO CACHE_NAMES (rowid, NAME) SELECT new.ID, new.NAME WHERE new.NAME IS NOT NULL;
+            END;"""
+    )
+
+
+def add_validator_columns(conn: sqlite3.Connection) -> None:
+    """Adds the ETAG and LAST_MODIFIED validators of the SWAPI responses to the
+    CACHE and RESOURCES tables, which refreshes send back in conditional requests.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    for table in ("CACHE", "RESOURCES"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN ETAG TEXT;")
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN LAST_MODIFIED TEXT;")
+
+
+# Key prefix of the --all searches in the search event log, and in the CACHE table
+# before they moved to the SEARCH_ALL table
+ALL_QUERY_PREFIX = "all:"
+
+
+def remove_all_entries(conn: sqlite3.Connection) -> None:
+    """Removes the --all searches from the CACHE table, so that single character
+    lookups never return a list of characters.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute("DELETE FROM CACHE WHERE QUERY_KEY LIKE ?;", (f"{ALL_QUERY_PREFIX}%",))
+
+
+def create_search_all_table(conn: sqlite3.Connection) -> None:
+    """Creates the SEARCH_ALL table, which caches the list of matches of each --all
+    search apart from the single characters of the CACHE table, and moves the
+    --all searches of the CACHE table to it.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute(
+        """CREATE TABLE SEARCH_ALL
+                 (QUERY_KEY     TEXT PRIMARY KEY,
+                 QUERY          TEXT NOT NULL,
+                 RESPONSE       TEXT NOT NULL,
+                 FETCHED        DATETIME NOT NULL
+                 );"""
+    )
+    conn.execute("CREATE INDEX SEARCH_ALL_FETCHED ON SEARCH_ALL (FETCHED);")
+    conn.execute(
+        """INSERT INTO SEARCH_ALL (QUERY_KEY, QUERY, RESPONSE, FETCHED)
+            SELECT trim(substr(QUERY_KEY, ?1)), trim(substr(QUERY, ?1)), RESPONSE, FETCHED
+            FROM CACHE WHERE QUERY_KEY LIKE ?2 ON CONFLICT DO NOTHING;""",
+        (len(ALL_QUERY_PREFIX) + 1, f"{ALL_QUERY_PREFIX}%"),
+    )
+    remove_all_entries(conn)
+
+
+# Schema migrations, applied in order. PRAGMA user_version stores how many have run.
+MIGRATIONS = [
+    add_query_key,
+    create_name_index,
+    create_resources_table,
+    create_mirror_tables,
+    add_eviction_columns,
+    create_analytics_tables,
+    add_negative_column,
+    create_leases_table,
+    compact_responses,
+    add_validator_columns,
+    create_search_all_table,
+]
+
+
+def create_shard_tables(conn: sqlite3.Connection) -> None:
+    """Creates the tables of a shard file of the sharded cache backend, in the schema
+    the migrations above give the shared database: the CACHE table with its indexes,
+    CACHE_NAMES and CACHE_STATS, and the LEASES on the queries of the shard.
+
+    Args:
+        conn (sqlite3.Connection): The connection to migrate.
+
+    Returns:
+        None.
+    """
+    conn.execute(
+        """CREATE TABLE CACHE
+                 (ID            INTEGER PRIMARY KEY AUTOINCREMENT,
+                 QUERY          TEXT NOT NULL,
+                 RESPONSE       TEXT NOT NULL,
+                 TIMESTAMP      DATETIME NOT NULL,
+                 HITS           INT NOT NULL DEFAULT 1,
+                 QUERY_KEY      TEXT,
+                 FETCHED        DATETIME,
+                 NEGATIVE       INT NOT NULL DEFAULT 0,
+                 NAME           TEXT,
+                 ETAG           TEXT,
+                 LAST_MODIFIED  TEXT
+                 );"""
+    )
+    conn.execute("CREATE UNIQUE INDEX CACHE_QUERY_KEY ON CACHE (QUERY_KEY);")
+    conn.execute("CREATE INDEX CACHE_FETCHED ON CACHE (FETCHED);")
+    conn.execute("CREATE INDEX CACHE_LRU ON CACHE (TIMESTAMP);")
+    conn.execute("CREATE INDEX CACHE_LFU ON CACHE (HITS, TIMESTAMP);")
+    conn.execute("CREATE INDEX CACHE_NEGATIVE ON CACHE (NEGATIVE, FETCHED);")
+    conn.execute(
+        f"CREATE VIRTUAL TABLE CACHE_NAMES USING fts5(NAME, tokenize='{NAME_TOKENIZER}');"
+    )
+    create_name_triggers(conn)
+    conn.execute(
+        """CREATE TRIGGER CACHE_NAMES_DELETE AFTER DELETE ON CACHE
+            BEGIN DELETE FROM CACHE_NAMES WHERE rowid = old.ID; END;"""
+    )
+    create_cache_stats(conn)
+    create_leases_table(conn)
+
+
+# Schema migrations of the shard files, which only hold cache entries. A migration of
+# the CACHE table is added to both lists.
+SHARD_MIGRATIONS = [
+    create_shard_tables,
+    remove_all_entries,
+]
+
+
+def migrate_db(
+    store: Optional[SqliteStore] = None, migrations: list = MIGRATIONS
+) -> None:
+    """Applies the pending schema migrations to the SQLite database.
+
+    Args:
+        store (SqliteStore, optional): The database. Defaults to None, the shared one.
+        migrations (list, optional): The migrations of the database. Defaults to MIGRATIONS.
+
+    Returns:
+        None.
+    """
+    try:
+        with (store or _store).transaction() as conn:
+            version = conn.execute("PRAGMA user_version;").fetchone()[0]
+            for version, migration in enumerate(
+                migrations[version:], start=version + 1
+            ):
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {version};")
     except (sqlite3.Error, sqlite3.Warning) as e:
         raise Exception(e)
 
 
-def get_cache(query: str) -> tuple:
-    """Retrieves the cache entry matching the given search query.
+INSERT_CACHE = """INSERT INTO CACHE (QUERY, QUERY_KEY, RESPONSE, TIMESTAMP, FETCHED, NEGATIVE, NAME)
+    VALUES (?1, ?2, ?3, ?4, ?4, ?3 = '[]', ?5)
+    ON CONFLICT (QUERY_KEY) DO UPDATE SET
+        RESPONSE = excluded.RESPONSE, TIMESTAMP = excluded.TIMESTAMP, FETCHED = excluded.FETCHED,
+        NEGATIVE = excluded.NEGATIVE, NAME = excluded.NAME;"""
+
+
+UPDATE_CACHE = """UPDATE CACHE SET RESPONSE = ?1, TIMESTAMP = ?2, FETCHED = ?2, HITS = ?3, NEGATIVE = ?1 = '[]',
+    NAME = ?5 WHERE ID = ?4;"""
+
+
+INSERT_RESOURCE = """INSERT INTO RESOURCES (URL, RESPONSE, TIMESTAMP) VALUES (?, ?, ?)
+    ON CONFLICT (URL) DO UPDATE SET RESPONSE = excluded.RESPONSE, TIMESTAMP = excluded.TIMESTAMP"""
+
+
+@timed("db.insert_cache")
+def insert_cache(query: str, response: Union[str, bytes], timestamp: str) -> int:
+    """Inserts a cache entry into the cache backend, see get_backend.
+
+    If an entry with the same normalized query already exists, its response and
+    timestamp are replaced instead. The lease on the query, if any, is released
+    and up to CACHE_EVICTION_BATCH entries are evicted in the same transaction
+    when the cache exceeds its limits.
 
     Args:
         query (str): The search query.
+        response (str | bytes): The stored response to the search query, see encode_character.
+        timestamp (str): The timestamp of the cache entry.
 
     Returns:
-        tuple: A tuple containing the ID, response, and timestamp of the cache entry.
-            If no cache entry is found, returns (None, None, None).
+        int: The ID of the cache entry.
     """
     try:
-        conn = get_db()
-        cursor = conn.execute(
-            f"""SELECT ID, RESPONSE, HITS, TIMESTAMP FROM CACHE WHERE QUERY LIKE '%{query}%' OR RESPONSE LIKE '%{query}%';"""
-        )
-        response = cursor.fetchone()
-        conn.close()
+        return get_backend().insert(query, response, timestamp)
     except (sqlite3.Error, sqlite3.Warning) as e:
         raise Exception(e)
-    return response if response else (None, None, 0, None)
 
 
-def clean_cache() -> None:
-    """Deletes all entries in the CACHE table.
+@timed("db.update_cache")
+def update_cache(
+    query_id: int, response: Union[str, bytes], hits: int, timestamp: str
+) -> None:
+    """Updates a cache entry in the cache backend.
+
+    Args:
+        query_id (int): The ID of the cache entry to update.
+        response (str | bytes): The new stored response to the search query.
+        timestamp (str): The new timestamp of the cache entry.
 
     Returns:
         None.
     """
     try:
-        conn = get_db()
-        cursor = conn.execute("DELETE  FROM CACHE;")
-        conn.commit()
-        conn.close()
-        print("removed cache")
+        get_backend().update(query_id, response, hits, timestamp)
     except (sqlite3.Error, sqlite3.Warning) as e:
         raise Exception(e)
 
 
-def init_db() -> None:
-    """Initializes the SQLite database by creating the CACHE table if it does not exist.
+def write_revalidated_resources(conn: sqlite3.Connection, resources: list) -> None:
+    """Writes revalidated resources, only extending the fetch time of the unchanged ones.
+
+    Args:
+        conn (sqlite3.Connection): The connection of the open transaction.
+        resources (list): (url, response, timestamp, etag, last_modified) tuples,
+            with a None response for resources that have not changed.
 
     Returns:
         None.
     """
-    if not file_exists(DATABASE):
-        try:
-            with open(DATABASE, "w") as f:
-                pass
-        except Exception as e:
-            raise Exception(e)
-        create_cache_table()
+    conn.executemany(
+        f"{INSERT_RESOURCE};",
+        [(url, response, ts) for url, response, ts, *_ in resources if response],
+    )
+    conn.executemany(
+        "UPDATE RESOURCES SET TIMESTAMP = ?, ETAG = ?, LAST_MODIFIED = ? WHERE URL = ?;",
+        [(ts, *validators, url) for url, _, ts, *validators in resources],
+    )
+
+
+@timed("db.refresh_cache")
+def refresh_cache(
+    query_id: int,
+    response: Optional[Union[str, bytes]],
+    timestamp: str,
+    resources: list = (),
+    validators: tuple = (None, None),
+) -> None:
+    """Replaces the response of a cache entry with a refetched one, along with
+    the resources fetched with it, in one transaction.
+
+    An unchanged response is not rewritten, its fetch time is extended. The hits
+    and the last hit time of the entry are kept.
+
+    Args:
+        query_id (int): The ID of the cache entry to refresh.
+        response (str | bytes): The refetched stored response, or None if it has not changed.
+        timestamp (str): The time the response was fetched or revalidated.
+        resources (list): (url, response, timestamp, etag, last_modified) tuples of
+            revalidated resources, with a None response for unchanged ones.
+        validators (tuple): The ETag and Last-Modified validators of the response.
+
+    Returns:
+        None.
+    """
+    try:
+        with transaction() if resources else nullcontext() as conn:
+            get_backend().refresh(query_id, response, timestamp, validators)
+            if resources:
+                write_revalidated_resources(conn, resources)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.refresh_resource_cache")
+def refresh_resource_cache(resources: list) -> None:
+    """Writes revalidated resources in one transaction.
+
+    Args:
+        resources (list): (url, response, timestamp, etag, last_modified) tuples,
+            with a None response for resources that have not changed.
+
+    Returns:
+        None.
+    """
+    try:
+        with transaction() as conn:
+            write_revalidated_resources(conn, resources)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+def get_validators(query_id: int) -> tuple:
+    """Retrieves the validators of a cache entry.
+
+    Args:
+        query_id (int): The ID of the cache entry.
+
+    Returns:
+        tuple: The ETag and Last-Modified validators, None when SWAPI sent none.
+    """
+    try:
+        return get_backend().validators(query_id)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+def get_resource_validators(url: str) -> tuple:
+    """Retrieves a cached SWAPI resource by its URL, whatever its age, with its validators.
+
+    Args:
+        url (str): The URL of the resource.
+
+    Returns:
+        tuple: The stored response, or None if the resource is not cached, and its
+            ETag and Last-Modified validators.
+    """
+    try:
+        with connection() as conn:
+            resource = conn.execute(
+                "SELECT RESPONSE, ETAG, LAST_MODIFIED FROM RESOURCES WHERE URL = ?;",
+                (url,),
+            ).fetchone()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    return resource or (None, None, None)
+
+
+@timed("db.add_hits_cache")
+def add_hits_cache(hits: list) -> None:
+    """
+    Adds buffered hits to the HITS column and moves the TIMESTAMP column forward
+    for a group of cache entries, in one transaction.
+
+    Args:
+        hits (list): (count, timestamp, query_id) tuples with the number of new hits
+            of each cache entry and the time of its latest hit.
+
+    Returns:
+        None.
+    """
+    try:
+        get_backend().add_hits(hits)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.add_query_hits_cache")
+def add_query_hits_cache(hits: list) -> None:
+    """
+    Adds buffered hits to the cache entries the given search queries find, see
+    add_hits_cache. Queries without a live cache entry are skipped.
+
+    Args:
+        hits (list): (count, timestamp, query) tuples with the number of new hits
+            of each search query and the time of its latest hit.
+
+    Returns:
+        None.
+    """
+    try:
+        backend = get_backend()
+        entries = backend.lookup_many([query for _, _, query in hits])
+        hits = [
+            (count, timestamp, entries[query][0])
+            for count, timestamp, query in hits
+            if entries[query] is not None
+        ]
+        if hits:
+            backend.add_hits(hits)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.add_search_events")
+def add_search_events(events: list) -> None:
+    """
+    Appends a group of searches to the SEARCH_EVENTS log, which updates the STATS_*
+    rollups, and prunes events older than SEARCH_EVENTS_TTL, in one transaction.
+
+    Args:
+        events (list): (timestamp, query, name, result) tuples of the searches, where
+            name is the name of the found character, or None, and result is
+            "found" or "not_found".
+
+    Returns:
+        None.
+    """
+    try:
+        with transaction() as conn:
+            conn.executemany(
+                "INSERT INTO SEARCH_EVENTS (TIMESTAMP, QUERY, NAME, RESULT) VALUES (?, ?, ?, ?);",
+                [
+                    (timestamp, normalize_query(query), name, result)
+                    for timestamp, query, name, result in events
+                ],
+            )
+            conn.execute(
+                """DELETE FROM SEARCH_EVENTS WHERE ID IN (
+                    SELECT ID FROM SEARCH_EVENTS WHERE TIMESTAMP < ? ORDER BY TIMESTAMP LIMIT ?
+                );""",
+                (oldest_allowed(SEARCH_EVENTS_TTL), CACHE_EVICTION_BATCH),
+            )
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+def oldest_allowed(max_age: Optional[float]) -> datetime:
+    """Returns the oldest timestamp an entry may have to be younger than max_age.
+
+    Args:
+        max_age (float, optional): The maximum age in seconds, None for no limit.
+
+    Returns:
+        datetime: The oldest allowed timestamp.
+    """
+    return (
+        datetime.min if max_age is None else datetime.now() - timedelta(seconds=max_age)
+    )
+
+
+def stale_after() -> tuple:
+    """Returns the fetch times that decide whether a cache entry is served.
+
+    Returns:
+        tuple: The oldest allowed fetch time of entries with results and of
+            searches without results, and the fetch time before which entries
+            with results are stale.
+    """
+    oldest = oldest_allowed(CACHE_TTL)
+    soft = oldest_allowed(CACHE_SOFT_TTL) if CACHE_SOFT_TTL is not None else oldest
+    return oldest, oldest_allowed(NEGATIVE_CACHE_TTL), soft
+
+
+def lookup_key(conn: sqlite3.Connection, key: str) -> Optional[tuple]:
+    """Looks up the cache entry of a normalized search query on the unique
+    QUERY_KEY index.
+
+    Entries fetched more than CACHE_TTL seconds ago, or NEGATIVE_CACHE_TTL seconds
+    for searches without results, are ignored. Entries with results fetched more
+    than CACHE_SOFT_TTL seconds ago are returned as stale.
+
+    Args:
+        conn (sqlite3.Connection): The connection to the SQLite database.
+        key (str): The normalized search query.
+
+    Returns:
+        tuple: The ID, response, hits and timestamp of the cache entry and whether
+            it is stale, or None.
+    """
+    oldest, negative, soft = stale_after()
+    return conn.execute(
+        """SELECT ID, RESPONSE, HITS, TIMESTAMP, NEGATIVE = 0 AND FETCHED < ? FROM CACHE
+            WHERE QUERY_KEY = ? AND FETCHED >= (CASE WHEN NEGATIVE THEN ? ELSE ? END);""",
+        (soft, key, negative, oldest),
+    ).fetchone()
+
+
+def lookup_name(conn: sqlite3.Connection, query: str) -> Optional[tuple]:
+    """Looks up the first cache entry whose character name contains the search
+    query, using the CACHE_NAMES full-text index.
+
+    With the trigram tokenizer, queries of at least three characters are matched
+    as a quoted phrase, which the index answers from the trigrams of the query.
+    Shorter queries have no trigram, and older SQLite versions have no trigram
+    tokenizer, so these are matched with LIKE, which scans every cached name.
+
+    Args:
+        conn (sqlite3.Connection): The connection to the SQLite database.
+        query (str): The search query.
+
+    Returns:
+        tuple: The ID, response, hits and timestamp of the cache entry and whether
+            it is stale, or None.
+    """
+    oldest, _, soft = stale_after()
+    query = query.strip()
+    if NAME_TOKENIZER == "trigram" and len(query) >= 3:
+        condition = "CACHE_NAMES.NAME MATCH ?"
+        pattern = '"{}"'.format(query.replace('"', '""'))
+    else:
+        condition = "CACHE_NAMES.NAME LIKE ? ESCAPE '\\'"
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = f"%{escaped}%"
+    return conn.execute(
+        f"""SELECT ID, RESPONSE, HITS, TIMESTAMP, FETCHED < ? FROM CACHE_NAMES JOIN CACHE ON ID = CACHE_NAMES.rowid
+            WHERE {condition} AND FETCHED >= ? ORDER BY CACHE_NAMES.rowid LIMIT 1;""",
+        (soft, pattern, oldest),
+    ).fetchone()
+
+
+def lookup_cache(conn: sqlite3.Connection, query: str) -> Optional[tuple]:
+    """Looks up the cache entry of a search query.
+
+    The normalized query is first matched exactly, see lookup_key. Otherwise the
+    first entry whose character name contains the query is returned, see
+    lookup_name.
+
+    Args:
+        conn (sqlite3.Connection): The connection to the SQLite database.
+        query (str): The search query.
+
+    Returns:
+        tuple: The ID, response, hits and timestamp of the cache entry and whether
+            it is stale, or None.
+    """
+    return lookup_key(conn, normalize_query(query)) or lookup_name(conn, query)
+
+
+@timed("db.get_cache")
+def get_cache(query: str) -> tuple:
+    """Retrieves the cache entry matching the given search query.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        tuple: A tuple containing the ID, response, hits and timestamp of the cache entry
+            and whether it is stale. If no cache entry is found, returns
+            (None, None, 0, None, False).
+    """
+    try:
+        response = get_backend().lookup(query)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    increment("cache.hits" if response else "cache.misses")
+    return response if response else (None, None, 0, None, False)
+
+
+def peek_cache(query: str) -> Optional[tuple]:
+    """Looks up the cache entry matching the given search query like get_cache,
+    without counting a cache hit or miss, for polling the cache.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        tuple: The ID, response, hits and timestamp of the cache entry and whether
+            it is stale, or None.
+    """
+    try:
+        return get_backend().lookup(query)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.get_many_cache")
+def get_many_cache(queries: list) -> dict:
+    """Retrieves the cache entries matching each of the given search queries.
+
+    All lookups run back to back on the shared connection.
+
+    Args:
+        queries (list): The search queries.
+
+    Returns:
+        dict: A mapping of each query to a tuple containing the ID, response, hits
+            and timestamp of its cache entry and whether it is stale, or
+            (None, None, 0, None, False) if no cache entry is found.
+    """
+    try:
+        responses = get_backend().lookup_many(queries)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    entries = {}
+    for query, response in responses.items():
+        increment("cache.hits" if response else "cache.misses")
+        entries[query] = response if response else (None, None, 0, None, False)
+    return entries
+
+
+@timed("db.write_cache_batch")
+def write_cache_batch(
+    inserts: list = (), updates: list = (), resources: list = ()
+) -> None:
+    """Writes a group of cache changes to the cache backend and the RESOURCES table.
+
+    The leases on the inserted queries are released and up to CACHE_EVICTION_BATCH
+    entries are evicted in the same transaction when the cache exceeds its limits.
+
+    Args:
+        inserts (list): (query, response, timestamp) tuples of new cache entries.
+            Existing entries with the same normalized query are replaced.
+        updates (list): (response, timestamp, hits, query_id) tuples of updated cache entries.
+        resources (list): (url, response, timestamp) tuples of fetched resources.
+
+    Returns:
+        None.
+    """
+    try:
+        with transaction() if resources else nullcontext() as conn:
+            get_backend().write(inserts, updates)
+            if resources:
+                conn.executemany(f"{INSERT_RESOURCE};", resources)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+def evict_cache(
+    conn: sqlite3.Connection, limit: Optional[int] = None, share: float = 1.0
+) -> int:
+    """Evicts cache entries that are expired or over the cache budget.
+
+    Entries fetched more than CACHE_TTL seconds ago, searches without results
+    fetched more than NEGATIVE_CACHE_TTL seconds ago and the oldest searches
+    without results beyond NEGATIVE_CACHE_MAX_ROWS are removed first. Then, while
+    the cache holds more than CACHE_MAX_ROWS entries or CACHE_MAX_BYTES bytes of
+    responses, entries are removed in the order of CACHE_EVICTION_POLICY: the
+    least frequently hit first for "lfu", the least recently hit first for "lru".
+
+    Args:
+        conn (sqlite3.Connection): The connection to the SQLite database, inside a transaction.
+        limit (int, optional): The maximum number of entries to remove, so that
+            eviction runs incrementally on writes. Defaults to None, no limit.
+        share (float, optional): The share of the budgets this database holds, when
+            the cache is spread over several files. Defaults to 1.0.
+
+    Returns:
+        int: The number of evicted entries.
+    """
+    order = EVICTION_ORDER[CACHE_EVICTION_POLICY]
+    max_rows, max_bytes, max_negative = (
+        ceil(budget * share) if budget is not None else None
+        for budget in (CACHE_MAX_ROWS, CACHE_MAX_BYTES, NEGATIVE_CACHE_MAX_ROWS)
+    )
+    remaining = -1 if limit is None else limit
+    evicted = conn.execute(
+        "DELETE FROM CACHE WHERE ID IN (SELECT ID FROM CACHE WHERE FETCHED < ? ORDER BY FETCHED LIMIT ?);",
+        (oldest_allowed(CACHE_TTL), remaining),
+    ).rowcount
+    if limit is None or evicted < limit:
+        remaining = -1 if limit is None else limit - evicted
+        evicted += conn.execute(
+            """DELETE FROM CACHE WHERE ID IN (SELECT ID FROM CACHE WHERE NEGATIVE = 1 AND FETCHED < ?
+                ORDER BY FETCHED LIMIT ?);""",
+            (oldest_allowed(NEGATIVE_CACHE_TTL), remaining),
+        ).rowcount
+    if max_negative is not None and (limit is None or evicted < limit):
+        negatives = conn.execute(
+            "SELECT COUNT(*) FROM CACHE WHERE NEGATIVE = 1;"
+        ).fetchone()[0]
+        excess = negatives - max_negative
+        if excess > 0:
+            count = excess if limit is None else min(excess, limit - evicted)
+            evicted += conn.execute(
+                """DELETE FROM CACHE WHERE ID IN (SELECT ID FROM CACHE WHERE NEGATIVE = 1
+                    ORDER BY FETCHED LIMIT ?);""",
+                (count,),
+            ).rowcount
+
+    while limit is None or evicted < limit:
+        rows, size = conn.execute("SELECT ROWS, BYTES FROM CACHE_STATS;").fetchone()
+        over_rows = rows - max_rows if max_rows is not None else 0
+        over_bytes = size - max_bytes if max_bytes is not None else 0
+        excess = max(over_rows, ceil(over_bytes * rows / size) if over_bytes > 0 else 0)
+        if excess <= 0:
+            break
+        count = excess if limit is None else min(excess, limit - evicted)
+        evicted += conn.execute(
+            f"DELETE FROM CACHE WHERE ID IN (SELECT ID FROM CACHE ORDER BY {order} LIMIT ?);",
+            (count,),
+        ).rowcount
+    return evicted
+
+
+@timed("db.evict")
+def evict() -> int:
+    """Evicts every cache entry that is expired or over the cache budget.
+
+    Returns:
+        int: The number of evicted entries.
+    """
+    try:
+        return get_backend().evict()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.cache_stats")
+def cache_stats() -> dict:
+    """Retrieves statistics about the cache backend and the eviction policy.
+
+    Returns:
+        dict: The number of entries and of searches without results, their size
+            in bytes, the number of expired entries, the oldest and newest fetch
+            and hit times, the database file size, None for the memory backend,
+            and the backend and eviction settings.
+    """
+    try:
+        stats = get_backend().stats()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    return {
+        **stats,
+        "backend": CACHE_BACKEND,
+        "policy": CACHE_EVICTION_POLICY,
+        "ttl": CACHE_TTL,
+        "max_entries": CACHE_MAX_ROWS,
+        "max_bytes": CACHE_MAX_BYTES,
+        "negative_ttl": NEGATIVE_CACHE_TTL,
+        "max_negative_entries": NEGATIVE_CACHE_MAX_ROWS,
+    }
+
+
+@timed("db.acquire_lease")
+def acquire_lease(key: str, owner: str, duration: float) -> bool:
+    """Acquires the lease on a key, unless another owner holds an unexpired lease on it.
+
+    Args:
+        key (str): The key to lease, such as a normalized search query.
+        owner (str): A unique identifier of the caller.
+        duration (float): The number of seconds after which the lease expires.
+
+    Returns:
+        bool: Whether the lease was acquired.
+    """
+    try:
+        return get_backend().acquire_lease(key, owner, duration)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.release_lease")
+def release_lease(key: str, owner: str) -> None:
+    """Releases a lease, if it is still held by the given owner.
+
+    Args:
+        key (str): The leased key.
+        owner (str): The identifier the lease was acquired with.
+
+    Returns:
+        None.
+    """
+    try:
+        get_backend().release_lease(key, owner)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.get_resource_cache")
+def get_resource_cache(
+    url: str, max_age: Optional[float] = None
+) -> Optional[Union[str, bytes]]:
+    """Retrieves a cached SWAPI resource by its URL.
+
+    Args:
+        url (str): The URL of the resource.
+        max_age (float, optional): The maximum age of the cached resource in seconds.
+            Defaults to None, which accepts resources of any age.
+
+    Returns:
+        str | bytes: The stored response of the resource, or None if it is not cached or too old.
+    """
+    oldest = oldest_allowed(max_age)
+    try:
+        with connection() as conn:
+            response = conn.execute(
+                "SELECT RESPONSE FROM RESOURCES WHERE URL = ? AND TIMESTAMP >= ?;",
+                (url, oldest),
+            ).fetchone()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    return response[0] if response else None
+
+
+def get_search_all_cache(query: str) -> Optional[tuple]:
+    """Retrieves the cached matches of an --all search, fetched less than CACHE_TTL
+    seconds ago.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        tuple: The stored list of characters and its fetch time, or None.
+    """
+    try:
+        with connection() as conn:
+            response = conn.execute(
+                "SELECT RESPONSE, FETCHED FROM SEARCH_ALL WHERE QUERY_KEY = ? AND FETCHED >= ?;",
+                (normalize_query(query), oldest_allowed(CACHE_TTL)),
+            ).fetchone()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    increment("cache.hits" if response else "cache.misses")
+    return response
+
+
+def insert_search_all_cache(
+    query: str, response: Union[str, bytes], timestamp: str
+) -> None:
+    """Inserts or replaces the matches of an --all search in the SEARCH_ALL table,
+    and removes the searches fetched more than CACHE_TTL seconds ago.
+
+    Args:
+        query (str): The search query.
+        response (str | bytes): The stored list of characters, see encode_character.
+        timestamp (str): The fetch time of the matches.
+
+    Returns:
+        None.
+    """
+    try:
+        with transaction() as conn:
+            conn.execute(
+                """INSERT INTO SEARCH_ALL (QUERY_KEY, QUERY, RESPONSE, FETCHED) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (QUERY_KEY) DO UPDATE SET
+                        QUERY = excluded.QUERY, RESPONSE = excluded.RESPONSE, FETCHED = excluded.FETCHED;""",
+                (normalize_query(query), query, response, timestamp),
+            )
+            conn.execute(
+                "DELETE FROM SEARCH_ALL WHERE FETCHED < ?;",
+                (oldest_allowed(CACHE_TTL),),
+            )
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.insert_resource_cache")
+def insert_resource_cache(
+    url: str, response: Union[str, bytes], timestamp: str
+) -> None:
+    """Inserts or replaces a SWAPI resource in the RESOURCES table.
+
+    Args:
+        url (str): The URL of the resource.
+        response (str | bytes): The stored response of the resource, see encode_resource.
+        timestamp (str): The timestamp of the cached resource.
+
+    Returns:
+        None.
+    """
+    try:
+        with transaction() as conn:
+            conn.execute(f"{INSERT_RESOURCE};", (url, response, timestamp))
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+def get_sync_state(kind: str) -> Optional[tuple]:
+    """Retrieves when a SWAPI collection was last synced to the MIRROR table.
+
+    Args:
+        kind (str): The collection, such as "people" or "planets".
+
+    Returns:
+        tuple: The number of mirrored records and the timestamp of the last sync,
+            or None if the collection was never synced.
+    """
+    try:
+        with connection() as conn:
+            return conn.execute(
+                "SELECT COUNT, TIMESTAMP FROM SYNC_STATE WHERE KIND = ?;", (kind,)
+            ).fetchone()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+def use_mirror(kind: str, offline: bool = False) -> bool:
+    """Tells whether records of a SWAPI collection are read from the MIRROR table.
+
+    Args:
+        kind (str): The collection, such as "people" or "planets".
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+
+    Returns:
+        bool: Whether the collection was synced, less than MIRROR_TTL seconds ago
+            unless offline is set.
+    """
+    state = get_sync_state(kind)
+    return state is not None and (
+        offline or str(state[1]) >= str(oldest_allowed(MIRROR_TTL))
+    )
+
+
+def get_mirror_edited(kind: str) -> dict:
+    """Retrieves the edited timestamp of every mirrored record of a SWAPI collection.
+
+    Args:
+        kind (str): The collection, such as "people" or "planets".
+
+    Returns:
+        dict: A mapping of each record URL to its edited timestamp.
+    """
+    try:
+        with connection() as conn:
+            return dict(
+                conn.execute("SELECT URL, EDITED FROM MIRROR WHERE KIND = ?;", (kind,))
+            )
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.write_mirror")
+def write_mirror(kind: str, records: list, timestamp: str) -> None:
+    """Inserts or replaces records of a SWAPI collection in the MIRROR table, in one transaction.
+
+    Args:
+        kind (str): The collection, such as "people" or "planets".
+        records (list): The (url, id, name, edited, response) tuples of the records.
+        timestamp (str): The timestamp of the sync.
+
+    Returns:
+        None.
+    """
+    try:
+        with transaction() as conn:
+            conn.executemany(
+                """INSERT OR REPLACE INTO MIRROR (URL, KIND, ID, NAME_KEY, EDITED, RESPONSE, TIMESTAMP)
+                    VALUES (?, ?, ?, ?, ?, ?, ?);""",
+                [
+                    (url, kind, _id, normalize_query(name), edited, response, timestamp)
+                    for url, _id, name, edited, response in records
+                ],
+            )
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.finish_sync")
+def finish_sync(kind: str, removed: list, timestamp: str) -> None:
+    """Removes records that no longer exist upstream and records a completed sync.
+
+    Args:
+        kind (str): The collection, such as "people" or "planets".
+        removed (list): The URLs of the records to remove.
+        timestamp (str): The timestamp of the sync.
+
+    Returns:
+        None.
+    """
+    try:
+        with transaction() as conn:
+            conn.executemany(
+                "DELETE FROM MIRROR WHERE URL = ?;", [(url,) for url in removed]
+            )
+            conn.execute(
+                """INSERT OR REPLACE INTO SYNC_STATE (KIND, COUNT, TIMESTAMP)
+                    VALUES (?, (SELECT COUNT(*) FROM MIRROR WHERE KIND = ?), ?);""",
+                (kind, kind, timestamp),
+            )
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.search_mirror")
+def search_mirror(kind: str, query: str) -> Optional[str]:
+    """Searches the mirrored records of a SWAPI collection by name.
+
+    A record whose name equals the normalized query is looked up on the name
+    index first, otherwise the record with the lowest SWAPI ID whose name
+    contains the query is returned, like the SWAPI search does.
+
+    Args:
+        kind (str): The collection, such as "people" or "planets".
+        query (str): The search query.
+
+    Returns:
+        str: The response of the matching record, or None if no record matches.
+    """
+    key = normalize_query(query)
+    try:
+        with connection() as conn:
+            response = conn.execute(
+                "SELECT RESPONSE FROM MIRROR WHERE KIND = ? AND NAME_KEY = ? ORDER BY ID LIMIT 1;",
+                (kind, key),
+            ).fetchone()
+            if response is None:
+                response = conn.execute(
+                    """SELECT RESPONSE FROM MIRROR WHERE KIND = ? AND instr(NAME_KEY, ?) > 0
+                        ORDER BY ID LIMIT 1;""",
+                    (kind, key),
+                ).fetchone()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    return response[0] if response else None
+
+
+@timed("db.search_mirror_all")
+def search_mirror_all(kind: str, query: str) -> list:
+    """Searches the mirrored records of a SWAPI collection for every name containing the query.
+
+    Args:
+        kind (str): The collection, such as "people" or "planets".
+        query (str): The search query.
+
+    Returns:
+        list: The responses of the matching records, ordered by SWAPI ID.
+    """
+    try:
+        with connection() as conn:
+            responses = conn.execute(
+                "SELECT RESPONSE FROM MIRROR WHERE KIND = ? AND instr(NAME_KEY, ?) > 0 ORDER BY ID;",
+                (kind, normalize_query(query)),
+            ).fetchall()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    return [response for response, in responses]
+
+
+@timed("db.get_mirror")
+def get_mirror(url: str) -> Optional[str]:
+    """Retrieves a mirrored SWAPI record by its URL.
+
+    Args:
+        url (str): The URL of the record.
+
+    Returns:
+        str: The response of the record, or None if it is not mirrored.
+    """
+    try:
+        with connection() as conn:
+            response = conn.execute(
+                "SELECT RESPONSE FROM MIRROR WHERE URL = ?;", (url,)
+            ).fetchone()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    return response[0] if response else None
+
+
+def popular_queries(limit: int) -> list:
+    """Retrieves the most searched queries from the STATS_QUERIES rollup, which
+    counts every hit and keeps its counts when the cache is cleaned. The --all
+    searches are left out, as they are not single character lookups.
+
+    Args:
+        limit (int): The maximum number of queries.
+
+    Returns:
+        list: The normalized queries, the most searched first.
+    """
+    try:
+        with connection() as conn:
+            rows = conn.execute(
+                """SELECT QUERY FROM STATS_QUERIES WHERE QUERY NOT LIKE ?
+                    ORDER BY SEARCHES DESC, QUERY LIMIT ?;""",
+                (f"{ALL_QUERY_PREFIX}%", limit),
+            ).fetchall()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    return [query for query, in rows]
+
+
+def search_events_sequence() -> int:
+    """Returns the ID of the last search event.
+
+    Event IDs only grow, even when old events are pruned, and the STATS_* rollups
+    only change when an event is added, so the ID tells whether they changed.
+
+    Returns:
+        int: The ID, or 0 before the first search event.
+    """
+    try:
+        with connection() as conn:
+            sequence = conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'SEARCH_EVENTS';"
+            ).fetchone()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+    return sequence[0] if sequence else 0
+
+
+def iter_cache_entries(batch_size: int = 1000) -> Iterator[tuple]:
+    """Yields every entry of the cache backend, reading batch_size entries at a time.
+
+    Args:
+        batch_size (int, optional): The number of entries read per query. Defaults to 1000.
+
+    Yields:
+        tuple: The ID, query, stored response, hits, last hit time and fetch time
+            of an entry.
+    """
+    try:
+        yield from get_backend().entries(batch_size)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+def iter_resources(batch_size: int = 1000) -> Iterator[tuple]:
+    """Yields every resource of the RESOURCES table, reading batch_size resources at a time.
+
+    Args:
+        batch_size (int, optional): The number of resources read per query. Defaults to 1000.
+
+    Yields:
+        tuple: The URL, stored response and fetch time of a resource.
+    """
+    last = ""
+    while True:
+        try:
+            with connection() as conn:
+                rows = conn.execute(
+                    "SELECT URL, RESPONSE, TIMESTAMP FROM RESOURCES WHERE URL > ? ORDER BY URL LIMIT ?;",
+                    (last, batch_size),
+                ).fetchall()
+        except (sqlite3.Error, sqlite3.Warning) as e:
+            raise Exception(e)
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield from rows
+
+
+def iter_mirror(kind: str, batch_size: int = 1000) -> Iterator[tuple]:
+    """Yields every mirrored record of a SWAPI collection, reading batch_size records at a time.
+
+    Args:
+        kind (str): The collection, such as "people" or "planets".
+        batch_size (int, optional): The number of records read per query. Defaults to 1000.
+
+    Yields:
+        tuple: The URL, response and sync time of a record, ordered by SWAPI ID.
+    """
+    last = 0
+    while True:
+        try:
+            with connection() as conn:
+                rows = conn.execute(
+                    """SELECT ID, URL, RESPONSE, TIMESTAMP FROM MIRROR
+                        WHERE KIND = ? AND ID > ? ORDER BY ID LIMIT ?;""",
+                    (kind, last, batch_size),
+                ).fetchall()
+        except (sqlite3.Error, sqlite3.Warning) as e:
+            raise Exception(e)
+        if not rows:
+            return
+        last = rows[-1][0]
+        for row in rows:
+            yield row[1:]
+
+
+MERGE_CACHE = """INSERT INTO CACHE (QUERY, QUERY_KEY, RESPONSE, HITS, TIMESTAMP, FETCHED, NEGATIVE, NAME)
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?3 = '[]', ?7)
+    ON CONFLICT (QUERY_KEY) DO UPDATE SET
+        RESPONSE = CASE WHEN excluded.FETCHED > FETCHED THEN excluded.RESPONSE ELSE RESPONSE END,
+        NEGATIVE = CASE WHEN excluded.FETCHED > FETCHED THEN excluded.NEGATIVE ELSE NEGATIVE END,
+        NAME = CASE WHEN excluded.FETCHED > FETCHED THEN excluded.NAME ELSE NAME END,
+        HITS = MAX(HITS, excluded.HITS), TIMESTAMP = MAX(TIMESTAMP, excluded.TIMESTAMP),
+        FETCHED = MAX(FETCHED, excluded.FETCHED);"""
+
+
+@timed("db.merge_cache_batch")
+def merge_cache_batch(entries: list = (), resources: list = ()) -> None:
+    """Merges a group of exported cache entries and resources in one transaction.
+
+    Entries are matched on their normalized query. The more recently fetched
+    response wins, and the hits and last hit time are the highest of both, so
+    importing the same entries twice changes nothing. Up to CACHE_EVICTION_BATCH
+    entries are evicted in the same transaction when the cache exceeds its limits.
+
+    Args:
+        entries (list): (query, response, hits, timestamp, fetched) tuples of cache entries.
+        resources (list): (url, response, timestamp) tuples of resources.
+
+    Returns:
+        None.
+    """
+    try:
+        with transaction() if resources else nullcontext() as conn:
+            get_backend().merge(entries)
+            if resources:
+                conn.executemany(
+                    f"{INSERT_RESOURCE} WHERE excluded.TIMESTAMP > RESOURCES.TIMESTAMP;",
+                    resources,
+                )
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+@timed("db.clean_cache")
+def clean_cache() -> None:
+    """Deletes all entries of the cache backend and the cached --all searches.
+
+    Returns:
+        None.
+    """
+    try:
+        get_backend().clean()
+        with transaction() as conn:
+            conn.execute("DELETE FROM SEARCH_ALL;")
+        print("removed cache")
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        raise Exception(e)
+
+
+def init_store(store: SqliteStore) -> None:
+    """Initializes a SQLite database by creating the CACHE table if it does not exist
+    and applying the pending schema migrations.
+
+    Args:
+        store (SqliteStore): The database.
+
+    Returns:
+        None.
+    """
+    if not file_exists(store.path):
+        try:
+            with open(store.path, "w") as f:
+                pass
+        except Exception as e:
+            raise Exception(e)
+        create_cache_table(store)
+    migrate_db(store)
+
+
+@timed("db.init_db")
+def init_db() -> None:
+    """Initializes the shared SQLite database, see init_store.
+
+    Returns:
+        None.
+    """
+    init_store(_store)
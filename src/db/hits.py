@@ -0,0 +1,221 @@
+import atexit
+from datetime import datetime
+from threading import Lock, Timer
+from typing import Optional
+
+from src.config import HITS_FLUSH_INTERVAL, HITS_FLUSH_SIZE
+from src.db.db import (
+    add_hits_cache,
+    add_query_hits_cache,
+    add_search_events,
+    transaction,
+)
+
+
+class HitBuffer:
+    """
+    Accumulates cache hits and search events in memory and writes them to the
+    CACHE and SEARCH_EVENTS tables in one transaction, so that a search does not
+    wait for a disk sync.
+
+    Pending hits are flushed once HITS_FLUSH_SIZE entries have been hit or
+    searches have been recorded, by a background timer at most HITS_FLUSH_INTERVAL
+    seconds after the first pending hit, and at process exit. A crash loses at
+    most that window of hits.
+    """
+
+    def __init__(
+        self,
+        flush_size: int = HITS_FLUSH_SIZE,
+        flush_interval: float = HITS_FLUSH_INTERVAL,
+    ):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._pending = {}
+        self._queries = {}
+        self._events = []
+        self._timer = None
+        self._registered = False
+
+    def record(self, query_id: int, timestamp: datetime) -> None:
+        """
+        Records a hit of a cache entry.
+
+        Args:
+            query_id (int): The ID of the cache entry.
+            timestamp (datetime): The time of the hit.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            count, latest = self._pending.get(query_id, (0, timestamp))
+            self._pending[query_id] = (count + 1, max(latest, timestamp))
+            due = self._schedule()
+        if due:
+            self.flush()
+
+    def record_query(self, query: str, timestamp: datetime) -> None:
+        """
+        Records a hit of the cache entry a search query finds, which is looked up
+        when the hits are flushed.
+
+        Args:
+            query (str): The search query.
+            timestamp (datetime): The time of the hit.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            count, latest = self._queries.get(query, (0, timestamp))
+            self._queries[query] = (count + 1, max(latest, timestamp))
+            due = self._schedule()
+        if due:
+            self.flush()
+
+    def record_search(
+        self,
+        query: str,
+        name: Optional[str],
+        timestamp: datetime,
+        found: Optional[bool] = None,
+    ) -> None:
+        """
+        Records a search in the search event log.
+
+        Args:
+            query (str): The search query.
+            name (str): The name of the character found, or None if none was.
+            timestamp (datetime): The time of the search.
+            found (bool, optional): Whether any character was found. Defaults to
+                whether a name is given.
+
+        Returns:
+            None.
+        """
+        found = name is not None if found is None else found
+        with self._lock:
+            result = "found" if found else "not_found"
+            self._events.append((timestamp, query, name, result))
+            due = self._schedule()
+        if due:
+            self.flush()
+
+    def _schedule(self) -> bool:
+        """
+        Makes sure the pending writes are flushed by the timer and at exit. Must be
+        called with the lock held.
+
+        Returns:
+            bool: Whether the buffer is full and must be flushed now.
+        """
+        pending = len(self._pending) + len(self._queries) + len(self._events)
+        due = pending >= self.flush_size
+        if not self._registered:
+            atexit.register(self.flush)
+            self._registered = True
+        if not due and self._timer is None:
+            self._timer = Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+        return due
+
+    def flush(self) -> None:
+        """
+        Writes the pending hits and search events in one transaction.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            queries, self._queries = self._queries, {}
+            events, self._events = self._events, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending and not queries and not events:
+            return
+        with transaction():
+            if pending:
+                add_hits_cache(
+                    [
+                        (count, latest, query_id)
+                        for query_id, (count, latest) in pending.items()
+                    ]
+                )
+            if queries:
+                add_query_hits_cache(
+                    [
+                        (count, latest, query)
+                        for query, (count, latest) in queries.items()
+                    ]
+                )
+            if events:
+                add_search_events(events)
+
+
+_buffer = HitBuffer()
+
+
+def record_hit(query_id: int, timestamp: datetime) -> None:
+    """
+    Records a hit of a cache entry in the process-wide hit buffer.
+
+    Args:
+        query_id (int): The ID of the cache entry.
+        timestamp (datetime): The time of the hit.
+
+    Returns:
+        None.
+    """
+    _buffer.record(query_id, timestamp)
+
+
+def record_query_hit(query: str, timestamp: datetime) -> None:
+    """
+    Records a hit of the cache entry a search query finds in the process-wide hit
+    buffer, for searches answered without looking up the cache.
+
+    Args:
+        query (str): The search query.
+        timestamp (datetime): The time of the hit.
+
+    Returns:
+        None.
+    """
+    _buffer.record_query(query, timestamp)
+
+
+def record_search(
+    query: str,
+    name: Optional[str],
+    timestamp: datetime,
+    found: Optional[bool] = None,
+) -> None:
+    """
+    Records a search in the process-wide hit buffer, for the analytics rollups.
+
+    Args:
+        query (str): The search query.
+        name (str): The name of the character found, or None if none was.
+        timestamp (datetime): The time of the search.
+        found (bool, optional): Whether any character was found. Defaults to
+            whether a name is given.
+
+    Returns:
+        None.
+    """
+    _buffer.record_search(query, name, timestamp, found)
+
+
+def flush_hits() -> None:
+    """
+    Writes the hits and search events pending in the process-wide hit buffer.
+
+    Returns:
+        None.
+    """
+    _buffer.flush()
@@ -0,0 +1,277 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Optional
+
+from src.config import BATCH_WORKERS, BATCH_WRITE_SIZE, EXPAND_WORKERS
+from src.db.db import get_many_cache, normalize_query, write_cache_batch
+from src.db.hits import record_hit, record_search
+from src.libs.refresh import schedule_refresh
+from src.libs.swapi import (
+    OfflineError,
+    fetch_related,
+    handle_homeland_response,
+    print_character_response,
+    print_related_resources,
+    read_resource,
+    related_urls,
+    search_character,
+)
+from src.utils.storage_utils import (
+    decode_response,
+    encode_character,
+    encode_planet,
+    encode_resource,
+)
+from src.utils.swapi_utils import swapi_request
+
+
+class SharedFetch:
+    """
+    Runs each fetch at most once per key and shares its result with every
+    concurrent caller asking for the same key.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._futures = {}
+
+    def get(self, key: str, fetch: Callable[[str], dict]) -> dict:
+        """
+        Returns the result of fetch(key), calling it only for the first caller.
+
+        Args:
+            key (str): The key of the resource to fetch.
+            fetch (Callable[[str], dict]): The function that fetches the resource.
+
+        Returns:
+            dict: The fetched resource.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(fetch(key))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+
+def dedupe_queries(queries: list) -> list:
+    """
+    Removes empty and repeated queries, keeping the first occurrence of each.
+
+    Queries are compared by their normalized cache key.
+
+    Args:
+        queries (list): The search queries.
+
+    Returns:
+        list: The unique queries in input order.
+    """
+    unique = {}
+    for query in queries:
+        query = query.strip()
+        key = normalize_query(query)
+        if key and key not in unique:
+            unique[key] = query
+    return list(unique.values())
+
+
+def fetch_resource(url: str, offline: bool = False) -> tuple:
+    """
+    Reads a resource from the local database, fetching it from SWAPI when it is
+    not available locally.
+
+    Args:
+        url (str): The URL of the resource.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+
+    Returns:
+        tuple: The resource and whether it was fetched from SWAPI.
+
+    Raises:
+        OfflineError: If offline is set and the resource is not available locally.
+    """
+    response = read_resource(url, offline)
+    if response:
+        return response, False
+    if offline:
+        raise OfflineError(f"{url} is not available offline")
+    return swapi_request(url=url), True
+
+
+def resolve_query(
+    query: str,
+    entry: tuple,
+    world: bool,
+    homeworlds: SharedFetch,
+    offline: bool = False,
+    expand: tuple = (),
+    related: Optional[SharedFetch] = None,
+    expander: Optional[ThreadPoolExecutor] = None,
+) -> dict:
+    """
+    Resolves a single query of a batch, fetching the character on a cache miss,
+    queueing a refresh of a stale entry, and its homeworld and related resources
+    when requested.
+
+    Args:
+        query (str): The search query.
+        entry (tuple): The (ID, response, hits, timestamp, stale) cache entry of the query.
+        world (bool): Whether to retrieve homeworld information.
+        homeworlds (SharedFetch): The homeworld lookups shared by the batch.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+        expand (tuple, optional): The related resources to resolve, among
+            RELATED_FIELDS. Defaults to ().
+        related (SharedFetch, optional): The related resource lookups shared by the batch.
+        expander (ThreadPoolExecutor, optional): The pool resolving related resources.
+
+    Returns:
+        dict: The character response, its homeworld, its related resources and
+            the cache entry details.
+    """
+    query_id, response, hits, timestamp, stale = entry
+    response = decode_response(response) if response is not None else None
+    save = response is None
+    if save:
+        # SWAPI results are cached right away, mirror results by the grouped writes
+        response, query_id = search_character(query, offline)
+        save = query_id is None
+    elif stale and not offline:
+        schedule_refresh(query_id, response)
+
+    homeworld, fetched = None, False
+    if response and world:
+        homeworld, fetched = homeworlds.get(
+            response["homeworld"], lambda url: fetch_resource(url, offline)
+        )
+
+    resources = {}
+    if response and expand:
+        urls = related_urls([response], expand)
+        lookups = expander.map(
+            lambda url: related.get(url, lambda url: fetch_related(url, offline)),
+            urls,
+        )
+        resources = dict(zip(urls, lookups))
+
+    return {
+        "query": query,
+        "response": response,
+        "homeworld": homeworld,
+        "homeworld_fetched": fetched,
+        "resources": resources,
+        "save": save,
+        "query_id": query_id,
+        "hits": hits,
+        "timestamp": timestamp,
+    }
+
+
+def batch_search(
+    queries: list,
+    world: bool = False,
+    workers: Optional[int] = None,
+    offline: bool = False,
+    expand: tuple = (),
+) -> None:
+    """
+    Searches for many Star Wars characters at once.
+
+    Cache hits are looked up in bulk, misses and homeworlds are fetched
+    concurrently by a bounded pool of workers, each homeworld at most once per
+    batch, related resources by a second pool of EXPAND_WORKERS, each URL at
+    most once per batch, results are printed in input order as soon as they are
+    available, with the error of a failed query in its place. Characters fetched
+    from SWAPI are cached as soon as they arrive, which releases their lease, and
+    the other cache writes are grouped into transactions of BATCH_WRITE_SIZE
+    entries, while hits and search events go through the hit buffer.
+
+    Args:
+        queries (list): The search queries.
+        world (bool, optional): Whether to retrieve homeworld information. Defaults to False.
+        workers (int, optional): The number of concurrent workers. Defaults to BATCH_WORKERS.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+        expand (tuple, optional): The related resources to include, among
+            RELATED_FIELDS. Defaults to ().
+
+    Returns:
+        None.
+    """
+    queries = dedupe_queries(queries)
+    entries = get_many_cache(queries)
+    homeworlds, related = SharedFetch(), SharedFetch()
+    inserts, resources = [], []
+    saved_resources = set()
+
+    def flush():
+        write_cache_batch(inserts, resources=resources)
+        inserts.clear()
+        resources.clear()
+
+    with ThreadPoolExecutor(
+        max_workers=workers or BATCH_WORKERS
+    ) as executor, ThreadPoolExecutor(max_workers=EXPAND_WORKERS) as expander:
+        futures = [
+            executor.submit(
+                resolve_query,
+                query,
+                entries[query],
+                world,
+                homeworlds,
+                offline,
+                expand,
+                related,
+                expander,
+            )
+            for query in queries
+        ]
+        for query, future in zip(queries, futures):
+            print(f"Query: {query}")
+            print("-" * len(f"Query: {query}"))
+            try:
+                result = future.result()
+            except Exception as e:
+                # A failed query is reported without stopping the rest of the batch
+                print(f"Error: {e}", end="\n\n")
+                continue
+
+            response = result["response"]
+            now = datetime.now()
+            if result["save"]:
+                inserts.append((query, encode_character(response), now))
+            elif result["timestamp"] is not None:
+                record_hit(result["query_id"], now)
+            record_search(query, response["name"] if response else None, now)
+            homeworld = result["homeworld"]
+            if result["homeworld_fetched"] and homeworld["url"] not in saved_resources:
+                saved_resources.add(homeworld["url"])
+                resources.append((homeworld["url"], encode_planet(homeworld), now))
+            for url, (resource, fetched) in result["resources"].items():
+                if fetched and url not in saved_resources:
+                    saved_resources.add(url)
+                    resources.append((url, encode_resource(url, resource), now))
+
+            if response:
+                print_character_response(response)
+                if world:
+                    handle_homeland_response(homeworld)
+                if expand:
+                    resolved = {
+                        url: resource
+                        for url, (resource, _) in result["resources"].items()
+                    }
+                    print_related_resources(response, expand, resolved)
+                if result["timestamp"] is not None:
+                    print(f"cached: {result['timestamp']}")
+            else:
+                print("The force is not strong within you")
+            print()
+
+            if len(inserts) + len(resources) >= BATCH_WRITE_SIZE:
+                flush()
+    flush()
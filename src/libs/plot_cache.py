@@ -0,0 +1,141 @@
+import os
+from glob import glob
+from json import dumps, loads
+from os.path import abspath, dirname, exists, join
+
+from src.config import PLOT_CACHE
+from src.db import db
+from src.db.db import search_events_sequence
+from src.db.hits import flush_hits
+
+# Bumped when the plot layout changes, so that older plots and panels are redrawn.
+PLOT_VERSION = 1
+
+# This module does not import the plotting libraries, so that an up to date plot
+# is detected without paying for them.
+
+
+def plot_cache_dir() -> str:
+    """
+    Returns the directory of the rendered panels and plot fingerprints, creating it.
+
+    Returns:
+        str: The path of the directory, next to the database.
+    """
+    path = join(dirname(db.DATABASE), PLOT_CACHE)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def data_fingerprint() -> str:
+    """
+    Returns the fingerprint of the data the plot shows, after writing the pending
+    searches: the ID of the last search event, which changes with every search.
+
+    Returns:
+        str: The fingerprint.
+    """
+    flush_hits()
+    return f"{PLOT_VERSION}:{search_events_sequence()}"
+
+
+def load_plot_state() -> dict:
+    """
+    Reads the fingerprints of the rendered plots.
+
+    Returns:
+        dict: The fingerprint, modification time and size of each plot file, by path.
+    """
+    try:
+        with open(join(plot_cache_dir(), "plots.json")) as f:
+            return loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def file_state(output_path: str, fingerprint: str) -> dict:
+    """
+    Returns the state of a plot file rendered from data with the given fingerprint.
+
+    Args:
+        output_path (str): The path of the plot.
+        fingerprint (str): The data fingerprint.
+
+    Returns:
+        dict: The fingerprint, modification time and size of the file.
+    """
+    stat = os.stat(output_path)
+    return {
+        "fingerprint": fingerprint,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+    }
+
+
+def plot_is_current(output_path: str) -> bool:
+    """
+    Tells whether a plot file was rendered from the current data and is unchanged since.
+
+    Args:
+        output_path (str): The path of the plot.
+
+    Returns:
+        bool: Whether the plot is up to date.
+    """
+    state = load_plot_state().get(abspath(output_path))
+    if state is None or not exists(output_path):
+        return False
+    return state == file_state(output_path, data_fingerprint())
+
+
+def save_plot_state(output_path: str, fingerprint: str) -> None:
+    """
+    Records the data fingerprint of a rendered plot file.
+
+    Args:
+        output_path (str): The path of the plot.
+        fingerprint (str): The fingerprint of the data it was rendered from.
+
+    Returns:
+        None.
+    """
+    state = load_plot_state()
+    state[abspath(output_path)] = file_state(output_path, fingerprint)
+    path = join(plot_cache_dir(), "plots.json")
+    with open(f"{path}.tmp", "w") as f:
+        f.write(dumps(state))
+    os.replace(f"{path}.tmp", path)
+
+
+def panel_file(name: str, digest: str) -> str:
+    """
+    Returns the path of a rendered panel.
+
+    Args:
+        name (str): The name of the panel, such as "daily".
+        digest (str): The hash of the data the panel shows.
+
+    Returns:
+        str: The path of the panel image.
+    """
+    return join(plot_cache_dir(), f"{name}-{PLOT_VERSION}-{digest}.png")
+
+
+def prune_panels(name: str, keep: str) -> None:
+    """
+    Deletes the older renders of a panel.
+
+    Args:
+        name (str): The name of the panel.
+        keep (str): The path of the render to keep.
+
+    Returns:
+        None.
+    """
+    for path in glob(join(plot_cache_dir(), f"{name}-*.png")):
+        if path != keep:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Pruned by a concurrent plot
+                pass
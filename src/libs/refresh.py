@@ -0,0 +1,202 @@
+import atexit
+import time
+from datetime import datetime
+from json import loads
+from queue import Queue
+from threading import Lock, Thread
+from typing import Optional
+
+from src.config import REFRESH_EXIT_WAIT, REFRESH_WORKERS
+from src.db.db import (
+    get_mirror,
+    get_resource_validators,
+    get_validators,
+    refresh_cache,
+    use_mirror,
+)
+from src.libs.sync import record_kind
+from src.utils.metrics_utils import increment
+from src.utils.storage_utils import (
+    CHARACTER_FIELDS,
+    decode_response,
+    encode_character,
+    encode_resource,
+    project,
+    project_resource,
+)
+from src.utils.swapi_utils import swapi_revalidate
+
+_lock = Lock()
+_queue = Queue()
+_workers = []
+_pending = set()
+
+
+def fetch_record(
+    url: str, etag: Optional[str] = None, last_modified: Optional[str] = None
+) -> tuple:
+    """
+    Fetches a Star Wars API record by its URL, from the local mirror when it is
+    mirrored and its collection was synced less than MIRROR_TTL seconds ago, and
+    otherwise from SWAPI, with a conditional request when the cached record has
+    validators.
+
+    Args:
+        url (str): The URL of the record.
+        etag (str, optional): The ETag of the cached record.
+        last_modified (str, optional): The Last-Modified time of the cached record.
+
+    Returns:
+        tuple: The record, or None if SWAPI answered that it was not modified, and
+            its ETag and Last-Modified validators.
+    """
+    response = get_mirror(url) if use_mirror(record_kind(url)) else None
+    if response:
+        return loads(response), etag, last_modified
+    return swapi_revalidate(url, etag, last_modified)
+
+
+def revalidate_resource(url: str) -> tuple:
+    """
+    Refetches a cached resource, such as a planet, unless SWAPI answers that it
+    has not changed. A refetched resource whose stored fields are the same as the
+    cached ones counts as unchanged too, so that it is not rewritten. A resource
+    that is not cached yet is simply fetched.
+
+    Only the refetches of resources cached with an ETag or Last-Modified validator
+    are counted as refresh.changed or refresh.unchanged.
+
+    Args:
+        url (str): The URL of the resource.
+
+    Returns:
+        tuple: The resource, and the (url, response, timestamp, etag, last_modified)
+            tuple to write with refresh_cache, with a None response if unchanged.
+    """
+    cached, etag, last_modified = get_resource_validators(url)
+    if cached is None:
+        response, etag, last_modified = fetch_record(url)
+        response = project_resource(url, response)
+        encoded = encode_resource(url, response)
+        return response, (url, encoded, datetime.now(), etag, last_modified)
+    conditional = bool(etag or last_modified)
+    response, etag, last_modified = fetch_record(url, etag, last_modified)
+    cached = decode_response(cached)
+    if response is not None:
+        response = project_resource(url, response)
+    if response is None or response == cached:
+        if conditional:
+            increment("refresh.unchanged")
+        return cached, (url, None, datetime.now(), etag, last_modified)
+    if conditional:
+        increment("refresh.changed")
+    encoded = encode_resource(url, response)
+    return response, (url, encoded, datetime.now(), etag, last_modified)
+
+
+def refresh_character(query_id: int, character: dict) -> bool:
+    """
+    Revalidates a cached character and its homeworld and stores them in the cache.
+
+    Unchanged records, either not modified according to SWAPI or refetched with
+    the same stored fields, only have their fetch time extended.
+
+    Args:
+        query_id (int): The ID of the cache entry of the character.
+        character (dict): The stale cached character.
+
+    Returns:
+        bool: Whether the entry was refreshed, False if SWAPI could not be reached.
+    """
+    try:
+        response, *validators = fetch_record(
+            character["url"], *get_validators(query_id)
+        )
+        if response is not None:
+            response = project(response, CHARACTER_FIELDS)
+        if response is None or response == character:
+            increment("refresh.unchanged")
+            response, encoded = character, None
+        else:
+            increment("refresh.changed")
+            encoded = encode_character(response)
+        _, resource = revalidate_resource(response["homeworld"])
+        refresh_cache(query_id, encoded, datetime.now(), [resource], tuple(validators))
+        return True
+    except ValueError:
+        # SWAPI is unreachable, the stale entry is served until CACHE_TTL
+        return False
+    finally:
+        with _lock:
+            _pending.discard(query_id)
+
+
+def refresh_worker() -> None:
+    """
+    Runs the queued refreshes, in a daemon thread that does not keep the process
+    alive. A refresh that raises, for instance on a locked database or a malformed
+    record, is counted as refresh.failed and the worker goes on with the next one.
+
+    Returns:
+        None.
+    """
+    while True:
+        query_id, character = _queue.get()
+        try:
+            refresh_character(query_id, character)
+        except Exception:
+            # The stale entry is served until CACHE_TTL or refreshed by a later search
+            increment("refresh.failed")
+        finally:
+            _queue.task_done()
+
+
+def wait_for_refreshes(timeout: float = REFRESH_EXIT_WAIT) -> bool:
+    """
+    Waits for the queued refreshes to complete, for at most timeout seconds.
+
+    Args:
+        timeout (float, optional): The maximum number of seconds to wait.
+            Defaults to REFRESH_EXIT_WAIT.
+
+    Returns:
+        bool: Whether every queued refresh completed.
+    """
+    deadline = time.monotonic() + timeout
+    with _queue.all_tasks_done:
+        while _queue.unfinished_tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _queue.all_tasks_done.wait(remaining)
+    return True
+
+
+def schedule_refresh(query_id: int, character: dict) -> None:
+    """
+    Queues a background refresh of a stale cache entry, unless one is already
+    queued, so the search is answered from the cache without waiting for it.
+
+    At exit, the process waits up to REFRESH_EXIT_WAIT seconds for the queued
+    refreshes, so a one-shot search refreshes its stale entry after printing it
+    without hanging on an unreachable SWAPI. Refreshes still running then are
+    abandoned and their stale entries are refreshed by a later search.
+
+    Args:
+        query_id (int): The ID of the cache entry of the character.
+        character (dict): The stale cached character.
+
+    Returns:
+        None.
+    """
+    with _lock:
+        if query_id in _pending:
+            return
+        _pending.add(query_id)
+        if not _workers:
+            for _ in range(REFRESH_WORKERS):
+                worker = Thread(target=refresh_worker, name="refresh", daemon=True)
+                worker.start()
+                _workers.append(worker)
+            atexit.register(wait_for_refreshes)
+    _queue.put((query_id, character))
@@ -0,0 +1,345 @@
+import asyncio
+import signal
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from json import dumps
+from threading import Event, Thread
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from src.config import (
+    SERVE_HOST,
+    SERVE_L1_SIZE,
+    SERVE_L1_TTL,
+    SERVE_PORT,
+    SERVE_WORKERS,
+)
+from src.db.db import normalize_query
+from src.db.hits import record_hit, record_search
+from src.libs.swapi import OfflineError, lookup_character
+from src.libs.warm import warm_popular
+from src.utils.metrics_utils import increment, snapshot
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+class L1Cache:
+    """
+    A bounded in-memory LRU cache in front of the SQLite cache, whose entries
+    expire after a fixed number of seconds.
+    """
+
+    def __init__(self, size: int = SERVE_L1_SIZE, ttl: float = SERVE_L1_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[dict]:
+        """
+        Returns a cached result and marks it as the most recently used.
+
+        Args:
+            key (tuple): The key of the result.
+
+        Returns:
+            dict: The result, or None if it is not cached or has expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: tuple, result: dict) -> None:
+        """
+        Caches a result, evicting the least recently used one when full.
+
+        Args:
+            key (tuple): The key of the result.
+            result (dict): The result.
+
+        Returns:
+            None.
+        """
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+class SearchServer:
+    """
+    Serves character searches as JSON over HTTP from a single asyncio event loop.
+
+    Results are served from the L1 cache when possible. Otherwise the search runs
+    on a pool of worker threads through the SQLite cache, the local mirror and
+    SWAPI, and concurrent requests for the same search share one lookup. The hits
+    and searches answered without a lookup are recorded by a thread of their own,
+    since a full hit buffer writes to SQLite and must not block the event loop.
+    """
+
+    def __init__(self, workers: int = SERVE_WORKERS, l1: Optional[L1Cache] = None):
+        self.l1 = l1 if l1 is not None else L1Cache()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.recorder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="record")
+        self._inflight = {}
+
+    async def search(self, query: str, world: bool, offline: bool) -> dict:
+        """
+        Searches for a character, coalescing concurrent identical searches.
+
+        Every request is recorded in the search event log, including the ones
+        served from the L1 cache or by another request's lookup.
+
+        Args:
+            query (str): The search query.
+            world (bool): Whether to include the character's homeworld.
+            offline (bool): Whether SWAPI must not be reached.
+
+        Returns:
+            dict: The search result, as returned by lookup_character.
+        """
+        key = (normalize_query(query), world, offline)
+        result = self.l1.get(key)
+        if result is not None:
+            self.recorder.submit(self.record, query, result, hit=True)
+            return result
+
+        task = self._inflight.get(key)
+        owner = task is None
+        if owner:
+            loop = asyncio.get_running_loop()
+            task = asyncio.ensure_future(
+                loop.run_in_executor(
+                    self.executor, lookup_character, query, world, offline
+                )
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        result = await asyncio.shield(task)
+        if owner:
+            self.l1.put(key, result)
+        else:
+            self.recorder.submit(self.record, query, result)
+        return result
+
+    @staticmethod
+    def record(query: str, result: dict, hit: bool = False) -> None:
+        """
+        Records a search that was answered without calling lookup_character.
+
+        Args:
+            query (str): The search query.
+            result (dict): The search result.
+            hit (bool, optional): Whether the search hit the cache entry of the
+                result, for the searches served from the L1 cache. Defaults to False.
+
+        Returns:
+            None.
+        """
+        now = datetime.now()
+        if hit and result["id"] is not None:
+            record_hit(result["id"], now)
+        character = result["character"]
+        record_search(query, character["name"] if character else None, now)
+
+    async def route(self, target: str) -> tuple:
+        """
+        Answers a request.
+
+        Args:
+            target (str): The request target, such as "/search?q=luke&world=1".
+
+        Returns:
+            tuple: The HTTP status and the JSON-serializable body of the response.
+        """
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == "/health":
+            return HTTPStatus.OK, {"status": "ok"}
+        if url.path == "/metrics":
+            return HTTPStatus.OK, snapshot()
+        if url.path != "/search":
+            return HTTPStatus.NOT_FOUND, {"error": "Not found"}
+
+        query = params.get("q", "").strip()
+        if not query:
+            return HTTPStatus.BAD_REQUEST, {"error": "Query parameter cannot be empty"}
+        world = params.get("world", "").lower() in TRUE_VALUES
+        offline = params.get("offline", "").lower() in TRUE_VALUES
+        try:
+            result = await self.search(query, world, offline)
+        except OfflineError as e:
+            # Not an upstream failure, SWAPI was not asked
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}
+        except ValueError as e:
+            return HTTPStatus.BAD_GATEWAY, {"error": str(e)}
+        except Exception:
+            # Such as a database error, the connection stays usable
+            increment("serve.errors")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"}
+        return HTTPStatus.OK, {
+            "query": query,
+            "character": result["character"],
+            "homeworld": result["homeworld"],
+            "cached": str(result["cached"]) if result["cached"] else None,
+        }
+
+    async def respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        body: object,
+        keep_alive: bool,
+    ) -> None:
+        """
+        Writes a JSON response to a client connection.
+
+        Args:
+            writer (asyncio.StreamWriter): The stream of the responses.
+            status (HTTPStatus): The HTTP status of the response.
+            body (object): The JSON-serializable body of the response.
+            keep_alive (bool): Whether the connection stays open for more requests.
+
+        Returns:
+            None.
+        """
+        payload = dumps(body).encode()
+        writer.write(
+            (
+                f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                "\r\n"
+            ).encode()
+            + payload
+        )
+        await writer.drain()
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Handles the HTTP/1.1 requests of a client connection, keeping it alive
+        until the client closes it or asks to.
+
+        Args:
+            reader (asyncio.StreamReader): The stream of the client requests.
+            writer (asyncio.StreamWriter): The stream of the responses.
+
+        Returns:
+            None.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+                if headers.get("content-length"):
+                    await reader.readexactly(int(headers["content-length"]))
+
+                request = request_line.decode("latin-1").split()
+                if len(request) != 3:
+                    # The request cannot be answered in kind, nor the connection reused
+                    await self.respond(
+                        writer,
+                        HTTPStatus.BAD_REQUEST,
+                        {"error": "Malformed request line"},
+                        False,
+                    )
+                    break
+                method, target, version = request
+                if method != "GET":
+                    status, body = HTTPStatus.METHOD_NOT_ALLOWED, {
+                        "error": "Method not allowed"
+                    }
+                else:
+                    status, body = await self.route(target)
+
+                keep_alive = (
+                    headers.get("connection") != "close"
+                    and version.upper() == "HTTP/1.1"
+                )
+                await self.respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        """
+        Listens for HTTP connections until the task is cancelled, which SIGINT
+        and SIGTERM do, so that the process exits through its exit handlers.
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on.
+
+        Returns:
+            None.
+        """
+        loop = asyncio.get_running_loop()
+        serving = asyncio.current_task()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, serving.cancel)
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def serve(
+    host: Optional[str] = None, port: Optional[int] = None, warm: bool = False
+) -> None:
+    """
+    Runs the HTTP search server until it is interrupted.
+
+    With warm, the most searched queries are fetched into the cache in the
+    background while the server already answers, see warm_popular.
+
+    Endpoints:
+        GET /search?q=<query>[&world=1][&offline=1]
+        GET /health
+        GET /metrics
+
+    Args:
+        host (str, optional): The address to listen on. Defaults to SERVE_HOST.
+        port (int, optional): The port to listen on. Defaults to SERVE_PORT.
+        warm (bool, optional): Whether to warm the cache at startup. Defaults to False.
+
+    Returns:
+        None.
+    """
+    server = SearchServer()
+    stop = Event()
+    warmer = Thread(target=warm_popular, args=(stop,), name="warm")
+    if warm:
+        warmer.start()
+    try:
+        asyncio.run(server.serve(host or SERVE_HOST, port or SERVE_PORT))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("Server stopped")
+    finally:
+        # Warming stops after its current fetches, which are still written
+        stop.set()
+        if warm:
+            warmer.join()
+        server.executor.shutdown()
+        server.recorder.shutdown()
@@ -0,0 +1,271 @@
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+from hashlib import blake2b
+from json import dumps, loads
+from os.path import dirname, join
+from typing import Iterator, Optional
+
+from src.config import CACHE_TTL, RESOURCE_TTL, SNAPSHOT, TRANSFER_BATCH_SIZE
+from src.db import db
+from src.db.db import (
+    get_mirror,
+    get_resource_cache,
+    iter_cache_entries,
+    iter_mirror,
+    normalize_query,
+)
+from src.utils.metrics_utils import increment, timed
+from src.utils.storage_utils import (
+    CHARACTER_FIELDS,
+    PLANET_FIELDS,
+    decode_response,
+    project,
+)
+
+# A snapshot is a header, the packed JSON records, then the index: one entry
+# per name or query, sorted by the hash of its normalized key, pointing at the
+# record. Several keys may point at the same record.
+MAGIC = b"SWAPSNAP"
+FORMAT_VERSION = 3
+HEADER = struct.Struct("<8sIQQd")  # magic, version, keys, index offset, build time
+INDEX_ENTRY = struct.Struct("<QQI")  # key hash, record offset, record length
+
+_snapshot = None
+
+
+def snapshot_path() -> str:
+    """
+    Returns the path of the snapshot, next to the database unless SNAPSHOT is absolute.
+
+    Returns:
+        str: The path of the snapshot.
+    """
+    return join(dirname(db.DATABASE), SNAPSHOT)
+
+
+def key_hash(key: str) -> int:
+    """
+    Hashes a normalized query into its 64-bit index key.
+
+    Args:
+        key (str): The normalized query.
+
+    Returns:
+        int: The hash.
+    """
+    return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+def cache_records() -> Iterator[tuple]:
+    """
+    Yields the characters of the cache, keyed by their queries and their names,
+    with their homeworlds when these are cached.
+
+    Expired entries and searches without results are skipped.
+
+    Yields:
+        tuple: The keys, the character, its homeworld or None and its fetch time.
+    """
+    oldest = db.oldest_allowed(CACHE_TTL)
+    for _id, query, response, hits, timestamp, fetched in iter_cache_entries(
+        TRANSFER_BATCH_SIZE
+    ):
+        character = decode_response(response)
+        if not isinstance(character, dict) or str(fetched) < str(oldest):
+            continue
+        homeworld = get_resource_cache(character["homeworld"], RESOURCE_TTL)
+        yield (
+            {normalize_query(query), normalize_query(character["name"])},
+            character,
+            decode_response(homeworld) if homeworld else None,
+            str(fetched),
+        )
+
+
+def mirror_records() -> Iterator[tuple]:
+    """
+    Yields the characters of the local mirror, keyed by their names, with their
+    mirrored homeworlds.
+
+    Yields:
+        tuple: The keys, the character, its homeworld or None and its sync time.
+    """
+    for url, response, timestamp in iter_mirror("people", TRANSFER_BATCH_SIZE):
+        character = loads(response)
+        homeworld = get_mirror(character["homeworld"])
+        yield (
+            {normalize_query(character["name"])},
+            project(character, CHARACTER_FIELDS),
+            project(loads(homeworld), PLANET_FIELDS) if homeworld else None,
+            str(timestamp),
+        )
+
+
+@timed("snapshot.build")
+def build_snapshot(path: Optional[str] = None, source: str = "cache") -> int:
+    """
+    Compiles the cache, or the local mirror, into a read-only snapshot.
+
+    The records are written to a temporary file, followed by the sorted index,
+    and the file then replaces the snapshot at once, so that running searches
+    keep reading the previous one.
+
+    Args:
+        path (str, optional): The path of the snapshot. Defaults to snapshot_path().
+        source (str, optional): "cache" or "mirror". Defaults to "cache".
+
+    Returns:
+        int: The number of keys in the snapshot.
+
+    Raises:
+        ValueError: If the source is unknown.
+    """
+    sources = {"cache": cache_records, "mirror": mirror_records}
+    if source not in sources:
+        raise ValueError(
+            f"Unknown snapshot source {source}, use one of {list(sources)}"
+        )
+    path = path or snapshot_path()
+    temporary = f"{path}.tmp"
+    index, records = {}, {}
+    with open(temporary, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        for keys, character, homeworld, fetched in sources[source]():
+            keys = keys - index.keys()
+            if not keys:
+                continue
+            # A character found by several queries is stored once
+            if character["url"] not in records:
+                record = {
+                    "keys": [],
+                    "character": character,
+                    "homeworld": homeworld,
+                    "fetched": fetched,
+                }
+                records[character["url"]] = record
+            records[character["url"]]["keys"].extend(keys)
+            index.update((key, character["url"]) for key in keys)
+        offsets = {}
+        for url, record in records.items():
+            data = dumps(record, separators=(",", ":")).encode()
+            offsets[url] = (f.tell(), len(data))
+            f.write(data)
+        index_offset = f.tell()
+        for hashed, url in sorted((key_hash(key), url) for key, url in index.items()):
+            f.write(INDEX_ENTRY.pack(hashed, *offsets[url]))
+        f.seek(0)
+        f.write(
+            HEADER.pack(MAGIC, FORMAT_VERSION, len(index), index_offset, time.time())
+        )
+    os.replace(temporary, path)
+    return len(index)
+
+
+class Snapshot:
+    """
+    A read-only snapshot mapped into memory. A lookup hashes the query and
+    binary searches the index, then parses only the matching record.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.keys, self.index, built = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a SWAPER snapshot")
+        self.built = datetime.fromtimestamp(built)
+
+    def get(self, query: str) -> Optional[dict]:
+        """
+        Looks up a query in the snapshot.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            dict: The record, with the character, its homeworld or None and its
+                fetch time, or None if the query is not in the snapshot.
+        """
+        key = normalize_query(query)
+        hashed = key_hash(key)
+        low, high = 0, self.keys
+        while low < high:
+            middle = (low + high) // 2
+            entry = INDEX_ENTRY.unpack_from(
+                self.data, self.index + middle * INDEX_ENTRY.size
+            )
+            if entry[0] < hashed:
+                low = middle + 1
+            else:
+                high = middle
+        # Entries sharing the hash are adjacent, the record holds its keys
+        while low < self.keys:
+            entry_hash, offset, length = INDEX_ENTRY.unpack_from(
+                self.data, self.index + low * INDEX_ENTRY.size
+            )
+            if entry_hash != hashed:
+                break
+            record = loads(self.data[offset : offset + length])
+            if key in record["keys"]:
+                return record
+            low += 1
+        return None
+
+
+def open_snapshot() -> Optional[Snapshot]:
+    """
+    Opens the snapshot once per process.
+
+    Returns:
+        Snapshot: The snapshot, or None if there is none or it was built more than
+            CACHE_TTL seconds ago.
+    """
+    global _snapshot
+    if _snapshot is None:
+        try:
+            _snapshot = Snapshot(snapshot_path())
+        except (OSError, ValueError, struct.error):
+            _snapshot = False
+        if _snapshot and _snapshot.built < db.oldest_allowed(CACHE_TTL):
+            _snapshot = False
+    return _snapshot or None
+
+
+def remove_snapshot() -> None:
+    """
+    Deletes the snapshot, if there is one, so that searches stop answering from a
+    cache that was cleaned or moved.
+
+    Returns:
+        None.
+    """
+    global _snapshot
+    try:
+        os.remove(snapshot_path())
+    except FileNotFoundError:
+        pass
+    _snapshot = None
+
+
+@timed("snapshot.lookup")
+def lookup_snapshot(query: str) -> Optional[dict]:
+    """
+    Looks up a search query in the snapshot, if there is one.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        dict: The record, with the character, its homeworld or None and its fetch
+            time, or None if the query is not in the snapshot or the record was
+            fetched more than CACHE_TTL seconds ago.
+    """
+    snapshot = open_snapshot()
+    record = snapshot.get(query) if snapshot else None
+    if record and record["fetched"] < str(db.oldest_allowed(CACHE_TTL)):
+        record = None
+    increment("snapshot.hits" if record else "snapshot.misses")
+    return record
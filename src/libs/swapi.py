@@ -1,9 +1,297 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from json import dumps
-from typing import Optional
+from json import loads
+from typing import Iterator, Optional
+from uuid import uuid4
 
-from src.db.db import get_cache, insert_cache, update_cache, update_hits_cache
-from src.utils.swapi_utils import swapi_request, swapi_search
+from src.config import (
+    EXPAND_WORKERS,
+    LEASE_POLL_INTERVAL,
+    LEASE_TTL,
+    LEASE_WAIT,
+    RESOURCE_TTL,
+)
+from src.db.db import (
+    ALL_QUERY_PREFIX,
+    acquire_lease,
+    get_cache,
+    get_mirror,
+    get_resource_cache,
+    get_search_all_cache,
+    insert_cache,
+    insert_search_all_cache,
+    normalize_query,
+    peek_cache,
+    refresh_resource_cache,
+    release_lease,
+    search_mirror,
+    search_mirror_all,
+    use_mirror,
+    write_cache_batch,
+)
+from src.db.hits import record_hit, record_query_hit, record_search
+from src.libs.refresh import revalidate_resource, schedule_refresh
+from src.libs.sync import record_kind
+from src.utils.metrics_utils import timed
+from src.utils.storage_utils import decode_response, encode_character, encode_resource
+from src.utils.swapi_utils import swapi_request, swapi_search, swapi_search_all
+
+
+class OfflineError(ValueError):
+    """
+    Raised when SWAPI must not be reached and the local mirror cannot answer,
+    because it was never synced or does not hold the record.
+    """
+
+
+@timed("swapi.search_character")
+def search_character(query: str, offline: bool = False) -> tuple:
+    """
+    Searches for a Star Wars character that is not in the cache.
+
+    While the people collection was synced less than MIRROR_TTL seconds ago, or
+    offline, the search is answered by the local mirror, otherwise it is sent to
+    SWAPI, and cached, see search_once.
+
+    Args:
+        query (str): The search query.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+
+    Returns:
+        tuple: The character, or an empty list if no character matches, and the ID
+            of its cache entry, or None if it is left to the caller to cache.
+
+    Raises:
+        OfflineError: If offline is set and the people collection has not been synced.
+    """
+    if use_mirror("people", offline):
+        response = search_mirror("people", query)
+        return (loads(response) if response else []), None
+    if offline:
+        raise OfflineError("No local mirror, run 'python main.py sync' first")
+    return search_once(query)
+
+
+def search_once(query: str) -> tuple:
+    """
+    Searches SWAPI for a character at most once across concurrent processes.
+
+    The first process to miss the cache leases the normalized query and caches
+    the result as soon as SWAPI answers, which releases the lease, or releases it
+    if the search fails, so that batch and warm misses are not held back until
+    their grouped writes. The other processes poll the cache for that result,
+    without counting cache misses, for up to LEASE_WAIT seconds, and search
+    SWAPI themselves if the lease is released without a result, expires after
+    LEASE_TTL seconds or they waited too long. The cache is looked up once more
+    after the lease is acquired, since a holder that just finished releases it.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        tuple: The character, or an empty list if no character matches, and the ID
+            of its cache entry, or None if it is left to the caller to cache.
+    """
+    key = normalize_query(query)
+    owner = uuid4().hex
+    deadline = time.monotonic() + LEASE_WAIT
+    while not acquire_lease(key, owner, LEASE_TTL):
+        if time.monotonic() >= deadline:
+            return swapi_search(query), None
+        time.sleep(LEASE_POLL_INTERVAL)
+        entry = peek_cache(query)
+        if entry is not None:
+            return decode_response(entry[1]), entry[0]
+    # The previous holder may have cached the result since the last look
+    entry = peek_cache(query)
+    if entry is not None:
+        release_lease(key, owner)
+        return decode_response(entry[1]), entry[0]
+    try:
+        response = swapi_search(query)
+    except Exception:
+        release_lease(key, owner)
+        raise
+    return response, insert_cache(query, encode_character(response), datetime.now())
+
+
+def read_resource(url: str, offline: bool = False) -> Optional[dict]:
+    """
+    Reads a Star Wars API resource, such as a planet, from the local database.
+
+    The resource is served from the RESOURCES cache, which is shared by every
+    character, while it is younger than RESOURCE_TTL, and otherwise from the
+    local mirror, see use_mirror.
+
+    Args:
+        url (str): The URL of the resource.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+
+    Returns:
+        dict: The resource, or None if it is not available locally.
+    """
+    response = get_resource_cache(url, RESOURCE_TTL)
+    if not response and use_mirror(record_kind(url), offline):
+        response = get_mirror(url)
+    return decode_response(response) if response else None
+
+
+@timed("swapi.get_resource")
+def get_resource(url: str, offline: bool = False) -> dict:
+    """
+    Returns a Star Wars API resource, such as a planet, by its URL.
+
+    The resource is read from the local database and only fetched from SWAPI,
+    and cached, when it is not available locally. An expired cached resource is
+    revalidated with a conditional request, and kept if it has not changed.
+
+    Args:
+        url (str): The URL of the resource.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+
+    Returns:
+        dict: The resource.
+
+    Raises:
+        OfflineError: If offline is set and the resource is not available locally.
+    """
+    response = read_resource(url, offline)
+    if response:
+        return response
+    if offline:
+        raise OfflineError(f"{url} is not available offline")
+    response, resource = revalidate_resource(url)
+    refresh_resource_cache([resource])
+    return response
+
+
+def related_urls(characters: list, fields: tuple) -> list:
+    """
+    Returns the URLs of the related resources of characters, such as their films.
+
+    Args:
+        characters (list): The characters.
+        fields (tuple): The related fields to resolve, among RELATED_FIELDS.
+
+    Returns:
+        list: The URLs, without repeats, in the order of the characters.
+    """
+    return list(
+        dict.fromkeys(
+            url
+            for character in characters
+            for field in fields
+            for url in character.get(field, [])
+        )
+    )
+
+
+def fetch_related(url: str, offline: bool = False) -> tuple:
+    """
+    Reads a related resource from the local database, fetching it from SWAPI when
+    it is not available locally. A resource that cannot be fetched is skipped.
+
+    Args:
+        url (str): The URL of the resource.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+
+    Returns:
+        tuple: The resource, or None if it is not available, and whether it was
+            fetched from SWAPI.
+    """
+    response = read_resource(url, offline)
+    if response or offline:
+        return response, False
+    try:
+        return swapi_request(url=url), True
+    except ValueError:
+        return None, False
+
+
+@timed("swapi.expand_resources")
+def expand_resources(
+    characters: list,
+    fields: tuple,
+    offline: bool = False,
+    resources: Optional[dict] = None,
+) -> dict:
+    """
+    Resolves the related resources of characters, such as their films.
+
+    Every URL is resolved once, from the RESOURCES cache or the local mirror,
+    otherwise from SWAPI by up to EXPAND_WORKERS concurrent requests, and the
+    fetched resources are cached in one transaction.
+
+    Args:
+        characters (list): The characters.
+        fields (tuple): The related fields to resolve, among RELATED_FIELDS.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+        resources (dict, optional): The resources already resolved, by URL, which
+            are skipped and updated in place. Defaults to None.
+
+    Returns:
+        dict: The resolved resources by URL.
+    """
+    resources = {} if resources is None else resources
+    urls = [url for url in related_urls(characters, fields) if url not in resources]
+    if not urls:
+        return resources
+    with ThreadPoolExecutor(max_workers=min(EXPAND_WORKERS, len(urls))) as executor:
+        results = list(executor.map(lambda url: fetch_related(url, offline), urls))
+    now = datetime.now()
+    fetched = [
+        (url, encode_resource(url, response), now)
+        for url, (response, fresh) in zip(urls, results)
+        if fresh
+    ]
+    if fetched:
+        write_cache_batch(resources=fetched)
+    resources.update((url, response) for url, (response, _) in zip(urls, results))
+    return resources
+
+
+def lookup_character(query: str, world: bool = False, offline: bool = False) -> dict:
+    """
+    Searches for a Star Wars character through the cache and returns the result
+    instead of printing it.
+
+    On a cache miss the character is searched in the local mirror or SWAPI and
+    saved in the cache, on a hit the hit is recorded and a stale entry is queued
+    for a background refresh. Either way the search is recorded in the search
+    event log.
+
+    Args:
+        query (str): The search query.
+        world (bool, optional): Whether to include the character's homeworld. Defaults to False.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+
+    Returns:
+        dict: The ID of the cache entry, the character, or None if no character
+            matches, its homeworld, if requested, and the timestamp of the cache
+            entry, or None if the character was not cached.
+    """
+    query_id, response, hits, timestamp, stale = get_cache(query)
+    if response is None:
+        response, query_id = search_character(query, offline)
+        if query_id is None:
+            query_id = insert_cache(query, encode_character(response), datetime.now())
+    else:
+        response = decode_response(response)
+        record_hit(query_id, datetime.now())
+        if stale and not offline:
+            schedule_refresh(query_id, response)
+    record_search(query, response["name"] if response else None, datetime.now())
+
+    homeworld = None
+    if response and world:
+        homeworld = get_resource(response["homeworld"], offline)
+    return {
+        "id": query_id,
+        "character": response or None,
+        "homeworld": homeworld,
+        "cached": timestamp,
+    }
 
 
 def handle_character_response(
@@ -14,18 +302,24 @@ def handle_character_response(
     query_id: Optional[int] = None,
     hits: Optional[int] = 0,
     timestamp: Optional[str] = None,
+    offline: bool = False,
+    expand: tuple = (),
 ) -> None:
-
     """
     Handles the response from the Star Wars API for a given character.
 
     Args:
     query (str): The search query used to get the character.
     response (dict): The response from the Star Wars API for the character.
-    world (bool, optional): Whether to include information about the character's homeworld. Defaults to False.
+    world (bool, optional): Whether to include information about the character's homeworld,
+        which is read from the shared resource cache. Defaults to False.
     save (bool, optional): Whether to save the response in the cache. Defaults to True.
     query_id (int, optional): The ID of the cache entry to update. Defaults to None.
-    timestamp (str, optional): The timestamp of the cache entry to update. Defaults to None.
+    timestamp (str, optional): The timestamp of the cache entry to update, None if the
+        response was cached by the search itself, which is then not a hit. Defaults to None.
+    offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+    expand (tuple, optional): The related resources to include, among RELATED_FIELDS,
+        such as ("films",). Defaults to ().
 
     Returns:
     None.
@@ -33,38 +327,189 @@ def handle_character_response(
     Raises:
     None.
     """
+    record_search(query, response["name"] if response else None, datetime.now())
     if response:
-        print(f"Name: {response['name']}")
-        print(f"Height: {response['height']}")
-        print(f"Mass: {response['mass']}")
-        print(f"Bith: {response['birth_year']}")
+        print_character_response(response)
 
         if world:
-            if save:
-                homeland_reponse = swapi_request(url=response["homeworld"])
-            else:
-                should_update = "rotation_period" not in response["homeworld"]
-                if should_update:
-                    homeland_reponse = swapi_request(url=response["homeworld"])
-                    response["homeworld"] = homeland_reponse
-                    update_cache(query_id, dumps(response), hits + 1, datetime.now())
-                else:
-                    homeland_reponse = response["homeworld"]
-
+            homeland_reponse = get_resource(response["homeworld"], offline)
             handle_homeland_response(homeland_reponse)
-            response["homeworld"] = homeland_reponse
+
+        if expand:
+            resources = expand_resources([response], expand, offline)
+            print_related_resources(response, expand, resources)
 
         if save:
-            insert_cache(query, dumps(response), datetime.now())
-        else:
-            update_hits_cache(query_id, hits + 1, datetime.now())
+            insert_cache(query, encode_character(response), datetime.now())
+        elif timestamp is not None:
+            record_hit(query_id, datetime.now())
             print(f"cached: {timestamp}")
     else:
         if save:
-            insert_cache(query, dumps(response), datetime.now())
-        else:
-            update_hits_cache(query_id, hits + 1, datetime.now())
+            insert_cache(query, encode_character([]), datetime.now())
+        elif timestamp is not None:
+            record_hit(query_id, datetime.now())
+        print("The force is not strong within you")
+
+
+def handle_snapshot_response(
+    query: str,
+    record: dict,
+    world: bool = False,
+    offline: bool = False,
+    expand: tuple = (),
+) -> None:
+    """
+    Handles a character found in the read-only snapshot.
+
+    Args:
+        query (str): The search query used to get the character.
+        record (dict): The snapshot record, with the character, its homeworld or
+            None and its fetch time.
+        world (bool, optional): Whether to include information about the character's
+            homeworld, which is fetched when the snapshot lacks it. Defaults to False.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+        expand (tuple, optional): The related resources to include, among
+            RELATED_FIELDS. Defaults to ().
+
+    Returns:
+        None.
+    """
+    character = record["character"]
+    now = datetime.now()
+    # The cache entry is looked up by its query when the hit is flushed, as the
+    # cache may have been migrated since the snapshot was built
+    record_query_hit(query, now)
+    record_search(query, character["name"], now)
+    print_character_response(character)
+    if world:
+        homeworld = record["homeworld"] or get_resource(character["homeworld"], offline)
+        handle_homeland_response(homeworld)
+    if expand:
+        resources = expand_resources([character], expand, offline)
+        print_related_resources(character, expand, resources)
+    print(f"cached: {record['fetched']}")
+
+
+@timed("swapi.search_all_characters")
+def search_all_characters(query: str, offline: bool = False) -> Iterator[list]:
+    """
+    Searches for every Star Wars character whose name matches the query.
+
+    While the people collection was synced less than MIRROR_TTL seconds ago, or
+    offline, the search is answered by the local mirror, otherwise every result page is fetched from SWAPI, the
+    remaining pages concurrently.
+
+    Args:
+        query (str): The search query.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+
+    Yields:
+        list: The matching characters, page by page.
+
+    Raises:
+        OfflineError: If offline is set and the people collection has not been synced.
+    """
+    if use_mirror("people", offline):
+        yield [loads(response) for response in search_mirror_all("people", query)]
+        return
+    if offline:
+        raise OfflineError("No local mirror, run 'python main.py sync' first")
+    yield from swapi_search_all(query)
+
+
+def search_all(
+    query: str, world: bool = False, offline: bool = False, expand: tuple = ()
+) -> None:
+    """
+    Prints every Star Wars character whose name matches the query.
+
+    The full list of matches is cached as one entry of the SEARCH_ALL table,
+    apart from the single characters of the cache. On a cache miss the
+    characters are printed as each result page arrives, then the list is saved.
+    The related resources of each page are resolved together, each URL once.
+
+    Args:
+        query (str): The search query.
+        world (bool, optional): Whether to include the characters' homeworlds. Defaults to False.
+        offline (bool, optional): Whether SWAPI must not be reached. Defaults to False.
+        expand (tuple, optional): The related resources to include, among
+            RELATED_FIELDS. Defaults to ().
+
+    Returns:
+        None.
+    """
+    entry = get_search_all_cache(query)
+    cached = entry is not None
+    pages = (
+        [decode_response(entry[0])] if cached else search_all_characters(query, offline)
+    )
+
+    characters, resources = [], {}
+    for page in pages:
+        if expand:
+            expand_resources(page, expand, offline, resources)
+        for character in page:
+            print_character_response(character)
+            if world:
+                handle_homeland_response(get_resource(character["homeworld"], offline))
+            if expand:
+                print_related_resources(character, expand, resources)
+            print()
+        characters.extend(page)
+
+    now = datetime.now()
+    if not cached:
+        insert_search_all_cache(query, encode_character(characters), now)
+    record_search(f"{ALL_QUERY_PREFIX}{query}", None, now, found=bool(characters))
+    if not characters:
         print("The force is not strong within you")
+    print(f"{len(characters)} characters found")
+    if cached:
+        print(f"cached: {entry[1]}")
+
+
+def print_character_response(response: dict) -> None:
+    """
+    Prints information about a Star Wars character response obtained from the Star Wars API (SWAPI).
+
+    Args:
+        response (dict): A dictionary containing the response data from SWAPI for a character.
+
+    Returns:
+        None.
+    """
+    print(f"Name: {response['name']}")
+    print(f"Height: {response['height']}")
+    print(f"Mass: {response['mass']}")
+    print(f"Bith: {response['birth_year']}")
+
+
+def print_related_resources(character: dict, fields: tuple, resources: dict) -> None:
+    """
+    Prints the related resources of a character, such as the titles of its films.
+
+    Args:
+        character (dict): The character.
+        fields (tuple): The related fields to print, among RELATED_FIELDS.
+        resources (dict): The resolved resources by URL, see expand_resources.
+            Unresolved resources are printed as their URL.
+
+    Returns:
+        None.
+    """
+    for field in fields:
+        if field not in character:
+            # Cached before related resources were stored, until its next refresh
+            print(f"{field.capitalize()}: unknown")
+            continue
+        labels = [
+            resources[url].get("title") or resources[url].get("name")
+            if resources.get(url)
+            else url
+            for url in character[field]
+        ]
+        print(f"{field.capitalize()}: {', '.join(labels) or 'none'}")
 
 
 def handle_homeland_response(response: dict) -> None:
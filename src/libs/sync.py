@@ -0,0 +1,92 @@
+from datetime import datetime
+from json import dumps
+from typing import Optional
+
+from src.config import SWAPI_URL
+from src.db.db import finish_sync, get_mirror_edited, write_mirror
+from src.utils.swapi_utils import swapi_pages
+
+SYNC_COLLECTIONS = ("people", "planets")
+
+
+def record_id(url: str) -> int:
+    """
+    Returns the SWAPI ID of a record from its URL.
+
+    Args:
+        url (str): The URL of the record, such as "https://swapi.dev/api/people/1/".
+
+    Returns:
+        int: The ID of the record.
+    """
+    return int(url.rstrip("/").rsplit("/", 1)[-1])
+
+
+def record_kind(url: str) -> str:
+    """
+    Returns the SWAPI collection of a record from its URL.
+
+    Args:
+        url (str): The URL of the record, such as "https://swapi.dev/api/people/1/".
+
+    Returns:
+        str: The collection, such as "people".
+    """
+    return url.rstrip("/").rsplit("/", 2)[-2]
+
+
+def sync_collection(kind: str, workers: Optional[int] = None) -> tuple:
+    """
+    Mirrors a whole SWAPI collection to the local database.
+
+    The pages of the collection are fetched concurrently and only the records
+    whose edited timestamp differs from the mirrored one are written, one
+    transaction per page. Records that no longer exist upstream are removed.
+
+    Args:
+        kind (str): The collection, such as "people" or "planets".
+        workers (int, optional): The number of concurrent page fetches.
+
+    Returns:
+        tuple: The number of records, updated records and removed records.
+    """
+    known = get_mirror_edited(kind)
+    seen = set()
+    updated = 0
+    timestamp = datetime.now()
+    for results in swapi_pages(f"{SWAPI_URL}/{kind}/", workers=workers):
+        seen.update(record["url"] for record in results)
+        changed = [
+            (
+                record["url"],
+                record_id(record["url"]),
+                record["name"],
+                record["edited"],
+                dumps(record),
+            )
+            for record in results
+            if known.get(record["url"]) != record["edited"]
+        ]
+        if changed:
+            write_mirror(kind, changed, timestamp)
+            updated += len(changed)
+
+    removed = [url for url in known if url not in seen]
+    finish_sync(kind, removed, timestamp)
+    return len(seen), updated, len(removed)
+
+
+def sync(workers: Optional[int] = None) -> None:
+    """
+    Mirrors the SWAPI people and planets collections to the local database, so
+    searches can be served without reaching SWAPI.
+
+    Args:
+        workers (int, optional): The number of concurrent page fetches.
+
+    Returns:
+        None.
+    """
+    for kind in SYNC_COLLECTIONS:
+        total, updated, removed = sync_collection(kind, workers)
+        print(f"{kind}: {total} records, {updated} updated, {removed} removed")
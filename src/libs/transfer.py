@@ -0,0 +1,149 @@
+import gzip
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from json import dumps, loads
+from typing import IO, Iterator
+
+from src.config import TRANSFER_BATCH_SIZE
+from src.db.db import (
+    ALL_QUERY_PREFIX,
+    iter_cache_entries,
+    iter_resources,
+    merge_cache_batch,
+)
+from src.utils.storage_utils import decode_response, encode_response
+
+# The version of the export format, written in the header line of every export.
+FORMAT_VERSION = 1
+
+
+@contextmanager
+def open_stream(path: str, mode: str) -> Iterator[IO[str]]:
+    """
+    Opens an export file as text, gzip compressed when its name ends with ".gz".
+    "-" is stdin or stdout.
+
+    Args:
+        path (str): The path of the file.
+        mode (str): "r" to read or "w" to write.
+
+    Yields:
+        IO[str]: The text stream.
+    """
+    if path == "-":
+        yield sys.stdin if mode == "r" else sys.stdout
+    elif path.endswith(".gz"):
+        with gzip.open(path, f"{mode}t", encoding="utf-8") as f:
+            yield f
+    else:
+        with open(path, mode, encoding="utf-8") as f:
+            yield f
+
+
+def export_cache(path: str) -> tuple:
+    """
+    Writes the cache entries and resources to a JSON lines file, streaming them
+    from the database in batches of TRANSFER_BATCH_SIZE.
+
+    The first line is a header, every other line is a "cache" entry with its
+    query, response, hits and timestamps, or a "resource" such as a planet.
+
+    Args:
+        path (str): The path of the export, gzip compressed if it ends with ".gz".
+
+    Returns:
+        tuple: The number of exported cache entries and resources.
+    """
+    entries = resources = 0
+    with open_stream(path, "w") as f:
+        header = {
+            "type": "header",
+            "version": FORMAT_VERSION,
+            "exported": datetime.now().isoformat(),
+        }
+        f.write(dumps(header, separators=(",", ":")) + "\n")
+        for _, query, response, hits, timestamp, fetched in iter_cache_entries(
+            TRANSFER_BATCH_SIZE
+        ):
+            entry = {
+                "type": "cache",
+                "query": query,
+                "response": decode_response(response),
+                "hits": hits,
+                "timestamp": timestamp,
+                "fetched": fetched,
+            }
+            f.write(dumps(entry, separators=(",", ":")) + "\n")
+            entries += 1
+        for url, response, timestamp in iter_resources(TRANSFER_BATCH_SIZE):
+            resource = {
+                "type": "resource",
+                "url": url,
+                "response": decode_response(response),
+                "timestamp": timestamp,
+            }
+            f.write(dumps(resource, separators=(",", ":")) + "\n")
+            resources += 1
+    return entries, resources
+
+
+def import_cache(path: str) -> tuple:
+    """
+    Merges an export into the cache, in transactions of TRANSFER_BATCH_SIZE lines.
+
+    Entries are merged on their normalized query, keeping the more recently
+    fetched response and the highest hits, so an import can be repeated.
+
+    Args:
+        path (str): The path of the export, gzip compressed if it ends with ".gz".
+
+    Returns:
+        tuple: The number of imported cache entries and resources.
+
+    Raises:
+        ValueError: If the file is not a SWAPER cache export.
+    """
+    entries, resources = [], []
+    counts = [0, 0]
+
+    def flush():
+        merge_cache_batch(entries, resources)
+        counts[0] += len(entries)
+        counts[1] += len(resources)
+        entries.clear()
+        resources.clear()
+
+    with open_stream(path, "r") as f:
+        header = loads(f.readline() or "{}")
+        if header.get("type") != "header" or header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a SWAPER cache export")
+        for line in f:
+            if not line.strip():
+                continue
+            record = loads(line)
+            # Older exports hold the 'search --all' searches, cached apart since
+            if record["type"] == "cache" and not record["query"].startswith(
+                ALL_QUERY_PREFIX
+            ):
+                entries.append(
+                    (
+                        record["query"],
+                        encode_response(record["response"]),
+                        record["hits"],
+                        record["timestamp"],
+                        record["fetched"],
+                    )
+                )
+            elif record["type"] == "resource":
+                resources.append(
+                    (
+                        record["url"],
+                        encode_response(record["response"]),
+                        record["timestamp"],
+                    )
+                )
+            if len(entries) + len(resources) >= TRANSFER_BATCH_SIZE:
+                flush()
+    flush()
+    return tuple(counts)
@@ -1,15 +1,33 @@
 import sqlite3
+import time
+from hashlib import blake2b
+from os.path import exists
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-
-from src.db.db import get_db
+from matplotlib import colormaps
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import Colormap
+from matplotlib.figure import Figure
+from PIL import Image
+
+from src.db.db import connection
+from src.libs.plot_cache import (
+    data_fingerprint,
+    panel_file,
+    prune_panels,
+    save_plot_state,
+)
+from src.utils.metrics_utils import increment, record_span, span
+
+# The size of a panel in pixels, the plot is a grid of two columns of panels
+PANEL_WIDTH, PANEL_HEIGHT, PANEL_DPI = 600, 400, 100
 
 
 def get_responses_data(conn: sqlite3.Connection) -> pd.DataFrame:
     """
-    Retrieves data from the CACHE table in the given SQLite database connection
+    Retrieves data from the STATS_RESULTS rollup in the given SQLite database connection
     and returns a pandas dataframe containing the number of queries and the type
     of response for each query result.
 
@@ -24,7 +42,7 @@ def get_responses_data(conn: sqlite3.Connection) -> pd.DataFrame:
     """
     try:
         return pd.read_sql_query(
-            "SELECT SUM(HITS) AS NumQueries, CASE WHEN RESPONSE <> '[]' THEN 'No Response' ELSE 'Response' END AS QueryResult FROM CACHE GROUP BY QueryResult",
+            "SELECT SEARCHES AS NumQueries, CASE WHEN RESULT = 'found' THEN 'Response' ELSE 'No Response' END AS QueryResult FROM STATS_RESULTS",
             conn,
         )
     except Exception as e:
@@ -33,7 +51,7 @@ def get_responses_data(conn: sqlite3.Connection) -> pd.DataFrame:
 
 def get_searches_data(conn: sqlite3.Connection) -> pd.DataFrame:
     """
-    Retrieves data from the CACHE table in the given SQLite database connection
+    Retrieves data from the STATS_DAILY rollup in the given SQLite database connection
     and returns a pandas dataframe containing the number of searches per day.
 
     Args:
@@ -47,7 +65,7 @@ def get_searches_data(conn: sqlite3.Connection) -> pd.DataFrame:
     """
     try:
         return pd.read_sql_query(
-            "SELECT DATE(timestamp) as date, COUNT(*) as num_searches FROM CACHE GROUP BY DATE(timestamp)",
+            "SELECT DAY as date, SEARCHES as num_searches FROM STATS_DAILY ORDER BY DAY",
             conn,
         )
     except Exception as e:
@@ -56,7 +74,7 @@ def get_searches_data(conn: sqlite3.Connection) -> pd.DataFrame:
 
 def get_most_popular_queries(conn: sqlite3.Connection) -> pd.DataFrame:
     """
-    Retrieves data from the CACHE table in the given SQLite database connection
+    Retrieves data from the STATS_QUERIES rollup in the given SQLite database connection
     and returns a pandas dataframe containing the top 10 most popular queries.
 
     Args:
@@ -70,7 +88,7 @@ def get_most_popular_queries(conn: sqlite3.Connection) -> pd.DataFrame:
     """
     try:
         return pd.read_sql_query(
-            "SELECT QUERY, HITS FROM CACHE GROUP BY QUERY ORDER BY HITS DESC LIMIT 10",
+            "SELECT QUERY, SEARCHES AS HITS FROM STATS_QUERIES ORDER BY SEARCHES DESC LIMIT 10",
             conn,
         )
     except Exception as e:
@@ -79,7 +97,7 @@ def get_most_popular_queries(conn: sqlite3.Connection) -> pd.DataFrame:
 
 def get_most_popular_characters(conn: sqlite3.Connection) -> pd.DataFrame:
     """
-    Retrieves data from the CACHE table in the given SQLite database connection
+    Retrieves data from the STATS_CHARACTERS rollup in the given SQLite database connection
     and returns a pandas dataframe containing the top 10 most popular character names
     from the responses.
 
@@ -94,7 +112,7 @@ def get_most_popular_characters(conn: sqlite3.Connection) -> pd.DataFrame:
     """
     try:
         return pd.read_sql_query(
-            "SELECT json_extract(RESPONSE, '$.name') AS name, HITS FROM CACHE WHERE RESPONSE <> '[]' GROUP BY name ORDER BY HITS DESC LIMIT 10",
+            "SELECT NAME AS name, SEARCHES AS HITS FROM STATS_CHARACTERS ORDER BY SEARCHES DESC LIMIT 10",
             conn,
         )
     except Exception as e:
@@ -103,7 +121,7 @@ def get_most_popular_characters(conn: sqlite3.Connection) -> pd.DataFrame:
 
 def get_time_of_day_data(conn: sqlite3.Connection) -> pd.DataFrame:
     """
-    Retrieves data from the CACHE table in the given SQLite database connection
+    Retrieves data from the STATS_HOURLY rollup in the given SQLite database connection
     and returns a pandas dataframe containing the number of searches made per hour.
 
     Args:
@@ -117,80 +135,185 @@ def get_time_of_day_data(conn: sqlite3.Connection) -> pd.DataFrame:
     """
     try:
         return pd.read_sql_query(
-            "SELECT strftime('%H', TIMESTAMP) AS hour, COUNT(*) AS num_searches FROM CACHE GROUP BY hour",
+            "SELECT HOUR AS hour, SEARCHES AS num_searches FROM STATS_HOURLY ORDER BY HOUR",
             conn,
         )
     except Exception as e:
         raise Exception("An error occurred while executing the SQL query: ", e)
 
 
+def draw_searches_per_day(ax: Axes, df: pd.DataFrame, cmap: Colormap) -> None:
+    """
+    Draws the searches made per day as a bar chart.
+
+    Args:
+        ax (Axes): The axes of the panel.
+        df (pd.DataFrame): The data of get_searches_data.
+        cmap (Colormap): The colormap of the bars.
+
+    Returns:
+        None
+    """
+    colors = cmap(np.linspace(0, 1, len(df)))
+    ax.bar(df["date"], df["num_searches"], color=colors)
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Number of searches")
+    ax.set_title("Searches made per day")
+
+
+def draw_query_results(ax: Axes, df: pd.DataFrame, cmap: Colormap) -> None:
+    """
+    Draws the share of searches with and without results as a pie chart.
+
+    Args:
+        ax (Axes): The axes of the panel.
+        df (pd.DataFrame): The data of get_responses_data.
+        cmap (Colormap): The colormap of the slices.
+
+    Returns:
+        None
+    """
+    colors = cmap(np.linspace(0, 1, len(df)))
+    ax.pie(df["NumQueries"], labels=df["QueryResult"], autopct="%1.1f%%", colors=colors)
+    ax.set_title("Query Results")
+
+
+def draw_searches_per_hour(ax: Axes, df: pd.DataFrame, cmap: Colormap) -> None:
+    """
+    Draws the searches made by hour of day as a bar chart.
+
+    Args:
+        ax (Axes): The axes of the panel.
+        df (pd.DataFrame): The data of get_time_of_day_data.
+        cmap (Colormap): The colormap of the bars.
+
+    Returns:
+        None
+    """
+    colors = cmap(np.linspace(0, 1, len(df)))
+    ax.bar(df["hour"], df["num_searches"], color=colors)
+    ax.set_xlabel("Hour of day")
+    ax.set_ylabel("Number of searches")
+    ax.set_title("Searches made by hour of day")
+
+
+def draw_popular_queries(ax: Axes, df: pd.DataFrame, cmap: Colormap) -> None:
+    """
+    Draws the most popular searched queries as a bar chart.
+
+    Args:
+        ax (Axes): The axes of the panel.
+        df (pd.DataFrame): The data of get_most_popular_queries.
+        cmap (Colormap): The colormap of the bars.
+
+    Returns:
+        None
+    """
+    colors = cmap(np.linspace(0, 1, len(df)))
+    x_ticks = np.arange(len(df))
+    ax.bar(x_ticks, df["HITS"], color=colors)
+    ax.set_xticks(x_ticks)
+    ax.set_xticklabels(df["QUERY"], rotation=45, ha="right")
+    ax.set_ylabel("Number of searches")
+    ax.set_title("Most popular searched queries")
+
+
+def draw_popular_characters(ax: Axes, df: pd.DataFrame, cmap: Colormap) -> None:
+    """
+    Draws the most popular character's names from the responses as a bar chart.
+
+    Args:
+        ax (Axes): The axes of the panel.
+        df (pd.DataFrame): The data of get_most_popular_characters.
+        cmap (Colormap): The colormap of the bars.
+
+    Returns:
+        None
+    """
+    x_ticks = np.arange(len(df))
+    colors = cmap(np.linspace(0, 1, len(df)))
+    ax.bar(x_ticks, df["HITS"], color=colors)
+    ax.set_xticks(x_ticks)
+    ax.set_xticklabels(df["name"], rotation=45, ha="right")
+    ax.set_ylabel("Number of occurrences")
+    ax.set_title("Most common character names in responses")
+
+
+# The panels of the plot: the name, query and drawing of each panel, its row and
+# column in the grid, and how many columns it spans.
+PANELS = (
+    ("daily", get_searches_data, draw_searches_per_day, 0, 0, 1),
+    ("results", get_responses_data, draw_query_results, 0, 1, 1),
+    ("hourly", get_time_of_day_data, draw_searches_per_hour, 1, 0, 2),
+    ("queries", get_most_popular_queries, draw_popular_queries, 2, 0, 1),
+    ("characters", get_most_popular_characters, draw_popular_characters, 2, 1, 1),
+)
+
+
+def render_panel(name: str, df: pd.DataFrame, draw, columns: int) -> str:
+    """
+    Renders a panel to its own image with the non-interactive Agg backend, unless
+    the same data was rendered before.
+
+    Args:
+        name (str): The name of the panel.
+        df (pd.DataFrame): The data of the panel.
+        draw (Callable): The function drawing the panel.
+        columns (int): The number of grid columns the panel spans.
+
+    Returns:
+        str: The path of the panel image.
+    """
+    digest = blake2b(df.to_json().encode(), digest_size=16).hexdigest()
+    path = panel_file(name, digest)
+    if exists(path):
+        increment("plot.panels_cached")
+        return path
+    fig = Figure(
+        figsize=(PANEL_WIDTH * columns / PANEL_DPI, PANEL_HEIGHT / PANEL_DPI),
+        dpi=PANEL_DPI,
+        layout="constrained",
+    )
+    FigureCanvasAgg(fig)
+    draw(fig.add_subplot(), df, colormaps["plasma"])
+    fig.savefig(path)
+    prune_panels(name, path)
+    increment("plot.panels_rendered")
+    return path
+
+
 def visualize(output_path: str) -> None:
     """
     Retrieve data from SQLite database and creates multiple visualizations using matplotlib.
 
+    Each panel is rendered on its own and kept, keyed by the hash of its data,
+    so only the panels whose data changed are redrawn, then the panels are
+    assembled into the plot. The data fingerprint of the plot is recorded, see
+    plot_is_current.
+
     Args:
         output_path (str): Path to output the plot.
 
     Returns:
         None
     """
-    # Get data from SQLite database
-    with get_db() as conn:
-        responses_df = get_responses_data(conn)
-        searches_df = get_searches_data(conn)
-        df_query = get_most_popular_queries(conn)
-        df_name = get_most_popular_characters(conn)
-        time_df = get_time_of_day_data(conn)
-
-    fig, axs = plt.subplots(3, 2, figsize=(12, 12))
-    axs[1, 0].axis("off")
-    axs[1, 1].axis("off")
-    axs[1, :] = plt.subplot(312)
-
-    cmap = plt.get_cmap("plasma")
-
-    # Searches made per day
-    colors = cmap(np.linspace(0, 1, len(searches_df)))
-    axs[0][0].bar(searches_df["date"], searches_df["num_searches"], color=colors)
-    axs[0][0].set_xlabel("Date")
-    axs[0][0].set_ylabel("Number of searches")
-    axs[0][0].set_title("Searches made per day")
-
-    # The query results statistics
-    colors = cmap(np.linspace(0, 1, len(responses_df)))
-    axs[0][1].pie(
-        responses_df["NumQueries"],
-        labels=responses_df["QueryResult"],
-        autopct="%1.1f%%",
-        colors=colors,
-    )
-    axs[0][1].set_title("Query Results")
-
-    # Searches made by hour of day
-    colors = cmap(np.linspace(0, 1, len(time_df)))
-    axs[1][0].bar(time_df["hour"], time_df["num_searches"], color=colors)
-    axs[1][0].set_xlabel("Hour of day")
-    axs[1][0].set_ylabel("Number of searches")
-    axs[1][0].set_title("Searches made by hour of day")
-
-    # The most popular searched queries
-    colors = cmap(np.linspace(0, 1, len(df_query)))
-    x_ticks = np.arange(len(df_query))
-    axs[2][0].bar(x_ticks, df_query["HITS"], color=colors)
-    axs[2][0].set_xticks(x_ticks)
-    axs[2][0].set_xticklabels(df_query["QUERY"], rotation=45, ha="right")
-    axs[2][0].set_ylabel("Number of searches")
-    axs[2][0].set_title("Most popular searched queries")
-
-    # The most popular character's name from the response
-    x_ticks = np.arange(len(df_name))
-    colors = cmap(np.linspace(0, 1, len(df_name)))
-    axs[2][1].bar(x_ticks, df_name["HITS"], color=colors)
-    axs[2][1].set_xticks(x_ticks)
-    axs[2][1].set_xticklabels(df_name["name"], rotation=45, ha="right")
-    axs[2][1].set_ylabel("Number of occurrences")
-    axs[2][1].set_title("Most common character names in responses")
-
-    plt.subplots_adjust(hspace=0.7, wspace=0.5)
-
-    plt.savefig(output_path, bbox_inches="tight", pad_inches=0.2)
+    # Get data from the pre-aggregated rollups, written by the pending searches
+    fingerprint = data_fingerprint()
+    with span("plot.query"), connection() as conn:
+        data = {name: query(conn) for name, query, *_ in PANELS}
+
+    start = time.perf_counter()
+    panels = [
+        (render_panel(name, data[name], draw, columns), row, column)
+        for name, _, draw, row, column, columns in PANELS
+    ]
+    record_span("plot.render", time.perf_counter() - start)
+
+    with span("plot.save"):
+        rows = max(row for _, row, _ in panels) + 1
+        plot = Image.new("RGB", (2 * PANEL_WIDTH, rows * PANEL_HEIGHT), "white")
+        for path, row, column in panels:
+            with Image.open(path) as panel:
+                plot.paste(panel, (column * PANEL_WIDTH, row * PANEL_HEIGHT))
+        plot.save(output_path)
+    save_plot_state(output_path, fingerprint)
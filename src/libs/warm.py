@@ -0,0 +1,173 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from json import loads
+from threading import Event, Lock
+from typing import Optional
+
+from src.config import BATCH_WRITE_SIZE, WARM_RATE, WARM_TOP, WARM_WORKERS
+from src.db.db import (
+    ALL_QUERY_PREFIX,
+    get_many_cache,
+    popular_queries,
+    write_cache_batch,
+)
+from src.libs.batch import SharedFetch, dedupe_queries, resolve_query
+from src.libs.refresh import refresh_character
+from src.libs.transfer import FORMAT_VERSION, open_stream
+from src.utils.metrics_utils import increment, timed
+from src.utils.storage_utils import decode_response, encode_character, encode_planet
+
+
+class RateLimiter:
+    """
+    Spaces out the calls to wait() of every thread so that at most rate of them
+    return per second.
+    """
+
+    def __init__(self, rate: Optional[float]):
+        self._lock = Lock()
+        self._interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+
+    def wait(self) -> None:
+        """
+        Blocks until the caller may start, in the order the callers arrived.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self._interval
+        time.sleep(start - now)
+
+
+def history_queries(path: str, limit: int = WARM_TOP) -> list:
+    """
+    Reads the most hit queries of a cache export, see export_cache.
+
+    Args:
+        path (str): The path of the export, gzip compressed if it ends with ".gz".
+        limit (int, optional): The maximum number of queries. Defaults to WARM_TOP.
+
+    Returns:
+        list: The queries, the most hit first.
+
+    Raises:
+        ValueError: If the file is not a SWAPER cache export.
+    """
+    hits = {}
+    with open_stream(path, "r") as f:
+        header = loads(f.readline() or "{}")
+        if header.get("type") != "header" or header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a SWAPER cache export")
+        for line in f:
+            if not line.strip():
+                continue
+            record = loads(line)
+            # Older exports hold the lists of characters of 'search --all' searches
+            if record["type"] == "cache" and not record["query"].startswith(
+                ALL_QUERY_PREFIX
+            ):
+                hits[record["query"]] = record["hits"]
+    return sorted(hits, key=hits.get, reverse=True)[:limit]
+
+
+@timed("warm.cache")
+def warm_cache(
+    queries: list,
+    workers: Optional[int] = None,
+    rate: Optional[float] = WARM_RATE,
+    stop: Optional[Event] = None,
+) -> tuple:
+    """
+    Prefetches the characters and homeworlds of search queries into the cache.
+
+    Queries with a fresh cache entry are skipped and stale ones are refreshed
+    with their homeworld by the workers, before warming returns. The others are
+    fetched concurrently by a pool of workers, starting at most rate queries per
+    second, each homeworld at most once. Characters are cached as soon as SWAPI
+    answers and homeworlds are written in transactions of BATCH_WRITE_SIZE
+    entries. Warming does not count as hits or searches.
+
+    Args:
+        queries (list): The search queries.
+        workers (int, optional): The number of concurrent fetches. Defaults to WARM_WORKERS.
+        rate (float, optional): The maximum number of queries fetched per second,
+            None for no limit. Defaults to WARM_RATE.
+        stop (Event, optional): Stops warming when set, the fetched queries are
+            still written.
+
+    Returns:
+        tuple: The number of warmed queries, of queries that were already cached
+            and of queries that failed.
+    """
+    queries = dedupe_queries(queries)
+    entries = get_many_cache(queries)
+    pending = [
+        query for query in queries if entries[query][1] is None or entries[query][4]
+    ]
+    limiter, homeworlds = RateLimiter(rate), SharedFetch()
+    inserts, resources = [], []
+    saved_resources = set()
+    warmed = failed = 0
+
+    def warm(query):
+        if stop is not None and stop.is_set():
+            return None
+        limiter.wait()
+        if stop is not None and stop.is_set():
+            return None
+        query_id, response, *_ = entries[query]
+        if response is not None:
+            if not refresh_character(query_id, decode_response(response)):
+                raise ValueError(f"Could not refresh {query}")
+            return {"save": False, "homeworld": None, "homeworld_fetched": False}
+        return resolve_query(query, entries[query], True, homeworlds)
+
+    with ThreadPoolExecutor(max_workers=workers or WARM_WORKERS) as executor:
+        futures = [executor.submit(warm, query) for query in pending]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception:
+                # A failed query is counted without stopping the rest of the warming
+                failed += 1
+                continue
+            if result is None:
+                continue
+            warmed += 1
+            now = datetime.now()
+            if result["save"]:
+                inserts.append(
+                    (result["query"], encode_character(result["response"]), now)
+                )
+            homeworld = result["homeworld"]
+            if result["homeworld_fetched"] and homeworld["url"] not in saved_resources:
+                saved_resources.add(homeworld["url"])
+                resources.append((homeworld["url"], encode_planet(homeworld), now))
+            if len(inserts) + len(resources) >= BATCH_WRITE_SIZE:
+                write_cache_batch(inserts, resources=resources)
+                inserts.clear()
+                resources.clear()
+    write_cache_batch(inserts, resources=resources)
+    increment("warm.queries", warmed)
+    increment("warm.failed", failed)
+    return warmed, len(queries) - len(pending), failed
+
+
+def warm_popular(stop: Optional[Event] = None) -> None:
+    """
+    Warms the cache with the WARM_TOP most searched queries and prints the outcome,
+    for 'serve --warm', which runs it in the background.
+
+    Args:
+        stop (Event, optional): Stops warming when set.
+
+    Returns:
+        None.
+    """
+    warmed, cached, failed = warm_cache(popular_queries(WARM_TOP), stop=stop)
+    print(f"warmed {warmed} queries, {cached} already cached, {failed} failed")
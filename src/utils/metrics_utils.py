@@ -0,0 +1,155 @@
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from json import dumps
+from threading import Lock
+from typing import Callable, Iterator, Optional
+
+# Cumulative per-process metrics: the count and total seconds of each timed
+# stage, and named counters such as cache hits or upstream bytes.
+_lock = Lock()
+_spans = {}
+_counters = {}
+_started = time.perf_counter()
+
+
+def record_span(name: str, seconds: float) -> None:
+    """
+    Adds a duration to the totals of a stage.
+
+    Args:
+        name (str): The name of the stage, such as "db.get_cache".
+        seconds (float): The duration in seconds.
+
+    Returns:
+        None.
+    """
+    with _lock:
+        count, total = _spans.get(name, (0, 0.0))
+        _spans[name] = (count + 1, total + seconds)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Times the enclosed block as a stage.
+
+    Args:
+        name (str): The name of the stage.
+
+    Yields:
+        None.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorates a function so that every call is timed as a stage.
+
+    Args:
+        name (str): The name of the stage.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_span(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def increment(name: str, amount: int = 1) -> None:
+    """
+    Adds to a counter.
+
+    Args:
+        name (str): The name of the counter, such as "cache.hits".
+        amount (int, optional): The amount to add. Defaults to 1.
+
+    Returns:
+        None.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def snapshot() -> dict:
+    """
+    Returns the cumulative metrics of the process.
+
+    Returns:
+        dict: The uptime in seconds, the count and total milliseconds of each
+            stage, the counters and the cache hit ratio, or None before the
+            first cache lookup.
+    """
+    with _lock:
+        spans = {
+            name: {"count": count, "total_ms": total * 1000}
+            for name, (count, total) in _spans.items()
+        }
+        counters = dict(_counters)
+    lookups = counters.get("cache.hits", 0) + counters.get("cache.misses", 0)
+    return {
+        "uptime_seconds": time.perf_counter() - _started,
+        "spans": spans,
+        "counters": counters,
+        "cache_hit_ratio": counters.get("cache.hits", 0) / lookups if lookups else None,
+    }
+
+
+def print_profile() -> None:
+    """
+    Prints the time spent in each stage, the slowest first, and the counters to stderr.
+
+    Returns:
+        None.
+    """
+    metrics = snapshot()
+    out = sys.stderr
+    print(f"\nProfile ({metrics['uptime_seconds'] * 1000:.1f} ms total)", file=out)
+    print(f"{'stage':<28}{'calls':>8}{'total ms':>12}{'mean ms':>12}", file=out)
+    stages = sorted(
+        metrics["spans"].items(), key=lambda item: item[1]["total_ms"], reverse=True
+    )
+    for name, stage in stages:
+        mean = stage["total_ms"] / stage["count"]
+        print(
+            f"{name:<28}{stage['count']:>8}{stage['total_ms']:>12.2f}{mean:>12.3f}",
+            file=out,
+        )
+    for name, value in sorted(metrics["counters"].items()):
+        print(f"{name:<28}{value:>8}", file=out)
+    if metrics["cache_hit_ratio"] is not None:
+        print(f"{'cache hit ratio':<28}{metrics['cache_hit_ratio']:>8.2f}", file=out)
+
+
+def write_metrics(path: str, command: Optional[list] = None) -> None:
+    """
+    Appends the metrics of the process to a file as one JSON line.
+
+    Args:
+        path (str): The path of the JSON lines file.
+        command (list, optional): The command line arguments, stored with the metrics.
+
+    Returns:
+        None.
+    """
+    record = {"timestamp": datetime.now().isoformat(), "command": command}
+    with open(path, "a") as f:
+        f.write(dumps({**record, **snapshot()}) + "\n")
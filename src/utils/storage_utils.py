@@ -0,0 +1,165 @@
+import zlib
+from json import dumps, loads
+from typing import Optional, Union
+
+from src.config import CACHE_COMPRESS, CACHE_COMPRESS_MIN_BYTES
+
+# The fields of the SWAPI records that are displayed, and the ones needed to
+# refresh a record and to find its homeworld and related resources. The other
+# fields are not stored.
+RELATED_FIELDS = ("films", "species", "vehicles", "starships")
+CHARACTER_FIELDS = (
+    "name",
+    "height",
+    "mass",
+    "birth_year",
+    "homeworld",
+    *RELATED_FIELDS,
+    "url",
+    "edited",
+)
+PLANET_FIELDS = (
+    "name",
+    "population",
+    "orbital_period",
+    "rotation_period",
+    "url",
+    "edited",
+)
+FILM_FIELDS = ("title", "episode_id", "director", "release_date", "url", "edited")
+SPECIES_FIELDS = ("name", "classification", "language", "url", "edited")
+VEHICLE_FIELDS = ("name", "model", "vehicle_class", "url", "edited")
+STARSHIP_FIELDS = ("name", "model", "starship_class", "url", "edited")
+# The stored fields of the resources of each SWAPI collection
+RESOURCE_FIELDS = {
+    "planets": PLANET_FIELDS,
+    "films": FILM_FIELDS,
+    "species": SPECIES_FIELDS,
+    "vehicles": VEHICLE_FIELDS,
+    "starships": STARSHIP_FIELDS,
+}
+
+
+def project(record: dict, fields: tuple) -> dict:
+    """
+    Keeps only the given fields of a SWAPI record.
+
+    Args:
+        record (dict): The SWAPI record.
+        fields (tuple): The fields to keep.
+
+    Returns:
+        dict: The record with the fields it has among the given ones.
+    """
+    return {field: record[field] for field in fields if field in record}
+
+
+def encode_response(response: Union[dict, list]) -> Union[str, bytes]:
+    """
+    Serializes a response as compact JSON, compressed with zlib when CACHE_COMPRESS
+    is set, the JSON is at least CACHE_COMPRESS_MIN_BYTES long and compression
+    makes it smaller.
+
+    Args:
+        response (dict | list): The response to store.
+
+    Returns:
+        str | bytes: The JSON text, or the compressed JSON.
+    """
+    text = dumps(response, separators=(",", ":"))
+    if CACHE_COMPRESS and len(text) >= CACHE_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(text.encode())
+        if len(compressed) < len(text):
+            return compressed
+    return text
+
+
+def encode_character(response: Union[dict, list]) -> Union[str, bytes]:
+    """
+    Serializes a character, or a list of characters, keeping only CHARACTER_FIELDS.
+
+    Args:
+        response (dict | list): The character, or a list of characters, empty if
+            no character was found.
+
+    Returns:
+        str | bytes: The stored response.
+    """
+    if isinstance(response, list):
+        return encode_response(
+            [project(character, CHARACTER_FIELDS) for character in response]
+        )
+    return encode_response(project(response, CHARACTER_FIELDS))
+
+
+def encode_planet(response: dict) -> Union[str, bytes]:
+    """
+    Serializes a planet, keeping only PLANET_FIELDS.
+
+    Args:
+        response (dict): The planet.
+
+    Returns:
+        str | bytes: The stored response.
+    """
+    return encode_response(project(response, PLANET_FIELDS))
+
+
+def project_resource(url: str, response: dict) -> dict:
+    """
+    Keeps only the RESOURCE_FIELDS of the collection of a resource.
+
+    Args:
+        url (str): The URL of the resource, such as "https://swapi.dev/api/films/1/".
+        response (dict): The resource.
+
+    Returns:
+        dict: The stored fields of the resource, every field if the collection is unknown.
+    """
+    kind = url.rstrip("/").rsplit("/", 2)[-2]
+    fields = RESOURCE_FIELDS.get(kind)
+    return project(response, fields) if fields else response
+
+
+def encode_resource(url: str, response: dict) -> Union[str, bytes]:
+    """
+    Serializes a resource, keeping only the RESOURCE_FIELDS of its collection.
+
+    Args:
+        url (str): The URL of the resource, such as "https://swapi.dev/api/films/1/".
+        response (dict): The resource.
+
+    Returns:
+        str | bytes: The stored response.
+    """
+    return encode_response(project_resource(url, response))
+
+
+def decode_response(data: Union[str, bytes]) -> Union[dict, list]:
+    """
+    Deserializes a stored response, whether it is JSON text or compressed JSON.
+
+    Args:
+        data (str | bytes): The stored response.
+
+    Returns:
+        dict | list: The response.
+    """
+    if isinstance(data, bytes):
+        data = zlib.decompress(data).decode()
+    return loads(data)
+
+
+def response_name(data: Union[str, bytes]) -> Optional[str]:
+    """
+    Returns the name of the record in a stored response, which the name index uses.
+
+    Args:
+        data (str | bytes): The stored response.
+
+    Returns:
+        str: The name, or None if the response is not a single named record.
+    """
+    response = decode_response(data)
+    name = response.get("name") if isinstance(response, dict) else None
+    return name if isinstance(name, str) else None
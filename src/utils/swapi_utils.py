@@ -1,19 +1,89 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from threading import Lock
+from typing import Iterator, Optional
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import (
+    HTTP_BACKOFF_FACTOR,
+    HTTP_BACKOFF_MAX,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_POOL_SIZE,
+    HTTP_READ_TIMEOUT,
+    PAGE_WORKERS,
+    SWAPI_URL,
+)
+from src.utils.metrics_utils import increment, span
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the HTTP session shared by every SWAPI request of the process.
+
+    The session keeps up to HTTP_POOL_SIZE keep-alive connections per host, so
+    consecutive and concurrent requests reuse open TCP/TLS connections.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+                pool_block=True,
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Returns the number of seconds to wait before retrying a failed request.
+
+    The delay honours the Retry-After header when the server sends one in
+    seconds, otherwise it is a full-jitter exponential backoff capped at
+    HTTP_BACKOFF_MAX.
 
+    Parameters:
+        attempt (int): The number of the failed attempt, starting from 0.
+        retry_after (str, optional): The Retry-After header of the response.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_FACTOR * 2**attempt))
 
-def swapi_request(url: str) -> dict:
+
+def swapi_request(url: str, params: Optional[dict] = None) -> dict:
     """
     Sends a GET request to the specified URL and returns the response as a dictionary.
 
     Parameters:
         url (str): The URL to send the GET request to.
+        params (dict, optional): The query string parameters of the request.
 
     Returns:
         dict: The response as a dictionary.
 
     Raises:
-        requests.exceptions.HTTPError: If the GET request returns a non-2xx status code.
-        SystemExit: If there is an error with the HTTP request.
+        ValueError: If the request failed after the retries, or with a non-2xx status code.
 
     Example:
         To get information about a character from the Star Wars API:
@@ -22,18 +92,92 @@ def swapi_request(url: str) -> dict:
         >>> print(response)
         [{'name': 'Luke Skywalker', 'height': '172', 'mass': '77', 'hair_color': 'blond', ...}]
     """
-    try:
-        response = requests.get(url=url)
-        response.raise_for_status()
+    return swapi_get(url, params).json()
+
+
+def swapi_get(
+    url: str, params: Optional[dict] = None, headers: Optional[dict] = None
+) -> requests.Response:
+    """
+    Sends a GET request to the specified URL and returns the HTTP response.
+
+    The request goes through the shared keep-alive session, with connect and
+    read timeouts, and is retried up to HTTP_MAX_RETRIES times with jittered
+    exponential backoff on timeouts, connection errors and 429/5xx responses.
+
+    Parameters:
+        url (str): The URL to send the GET request to.
+        params (dict, optional): The query string parameters of the request.
+        headers (dict, optional): The headers of the request.
+
+    Returns:
+        requests.Response: The successful, or not modified, response.
+
+    Raises:
+        ValueError: If the request failed after the retries, or with a non-2xx/304 status code.
+    """
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        retry = attempt < HTTP_MAX_RETRIES
+        increment("http.requests")
+        try:
+            with span("http.request"):
+                response = get_session().get(
+                    url=url,
+                    params=params,
+                    headers=headers,
+                    timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                )
+            increment("http.bytes", len(response.content))
+            if retry and response.status_code in RETRY_STATUS_CODES:
+                increment("http.retries")
+                time.sleep(backoff_delay(attempt, response.headers.get("Retry-After")))
+                continue
+            response.raise_for_status()
+
+        except requests.exceptions.Timeout as e:
+            if not retry:
+                raise ValueError("Timeout occurred while making a request:", e)
+        except requests.exceptions.ConnectionError as e:
+            if not retry:
+                raise ValueError("Connection error occurred while making a request:", e)
+        except requests.exceptions.RequestException as e:
+            raise ValueError("Error occurred while making a request:", e)
+        else:
+            return response
+
+        increment("http.retries")
+        time.sleep(backoff_delay(attempt))
 
-    except requests.exceptions.Timeout as e:
-        raise ValueError("Timeout occurred while making a request:", e)
-    except requests.exceptions.ConnectionError as e:
-        raise ValueError("Connection error occurred while making a request:", e)
-    except requests.exceptions.RequestException as e:
-        raise ValueError("Error occurred while making a request:", e)
 
-    return response.json()
+def swapi_revalidate(
+    url: str, etag: Optional[str] = None, last_modified: Optional[str] = None
+) -> tuple:
+    """
+    Sends a conditional GET request for a record, which SWAPI answers with an
+    empty 304 response when the record has not changed since it was cached.
+
+    Parameters:
+        url (str): The URL of the record.
+        etag (str, optional): The ETag of the cached record, sent as If-None-Match.
+        last_modified (str, optional): The Last-Modified time of the cached record,
+            sent as If-Modified-Since.
+
+    Returns:
+        tuple: The record, or None if it was not modified, and its ETag and
+            Last-Modified validators, the given ones if the response has none.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    response = swapi_get(url, headers=headers)
+    etag = response.headers.get("ETag", etag)
+    last_modified = response.headers.get("Last-Modified", last_modified)
+    if response.status_code == 304:
+        increment("http.not_modified")
+        return None, etag, last_modified
+    return response.json(), etag, last_modified
 
 
 def swapi_search(search_query: str) -> dict:
@@ -44,11 +188,11 @@ def swapi_search(search_query: str) -> dict:
         search_query (str): The name of the character to search for.
 
     Returns:
-        dict: The information about the character as a dictionary.
+        dict: The information about the character as a dictionary, or an empty list
+            if no character is found.
 
     Raises:
-        requests.exceptions.HTTPError: If the GET request returns a non-2xx status code.
-        SystemExit: If there is an error with the HTTP request, or if no character is found.
+        ValueError: If the request failed after the retries, or with a non-2xx status code.
 
     Example:
         To search for information about Luke Skywalker:
@@ -57,6 +201,64 @@ def swapi_search(search_query: str) -> dict:
         >>> print(response)
         {'name': 'Luke Skywalker', 'height': '172', 'mass': '77', 'hair_color': 'blond', ...}
     """
-    url = f"https://swapi.dev/api/people/?search={search_query}"
-    response = swapi_request(url=url)
+    url = f"{SWAPI_URL}/people/"
+    response = swapi_request(url=url, params={"search": search_query})
     return response["results"][0] if response["count"] else []
+
+
+def swapi_search_all(search_query: str) -> Iterator[list]:
+    """
+    Searches the Star Wars API for every character whose name matches the query.
+
+    Parameters:
+        search_query (str): The name of the characters to search for.
+
+    Yields:
+        list: The matching characters of each result page, in order.
+
+    Example:
+        To list every Skywalker:
+        >>> for characters in swapi_search_all("sky"):
+        ...     print([character["name"] for character in characters])
+    """
+    yield from swapi_pages(f"{SWAPI_URL}/people/", {"search": search_query})
+
+
+def swapi_pages(
+    url: str, params: Optional[dict] = None, workers: Optional[int] = None
+) -> Iterator[list]:
+    """
+    Fetches every page of a paginated SWAPI collection and yields their results in order.
+
+    The first page is fetched on its own to learn the total count and the page
+    size, then the remaining pages are fetched concurrently by up to PAGE_WORKERS
+    workers. Each page is yielded as soon as it and the pages before it have
+    arrived.
+
+    Parameters:
+        url (str): The URL of the collection.
+        params (dict, optional): The query string parameters, such as the search query.
+        workers (int, optional): The number of concurrent page fetches. Defaults to PAGE_WORKERS.
+
+    Yields:
+        list: The results of each page.
+
+    Example:
+        To list every planet:
+        >>> for planets in swapi_pages("https://swapi.dev/api/planets/"):
+        ...     print([planet["name"] for planet in planets])
+    """
+    params = dict(params or {})
+    first = swapi_request(url=url, params=params)
+    yield first["results"]
+    if not first.get("next") or not first["results"]:
+        return
+
+    pages = ceil(first["count"] / len(first["results"]))
+    with ThreadPoolExecutor(max_workers=workers or PAGE_WORKERS) as executor:
+        futures = [
+            executor.submit(swapi_request, url, {**params, "page": page})
+            for page in range(2, pages + 1)
+        ]
+        for future in futures:
+            yield future.result()["results"]
@@ -0,0 +1,21 @@
+import pytest
+
+from src.db import db
+from src.db.hits import flush_hits
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Points SWAPER at a new database file in a temporary directory.
+
+    Yields:
+        module: The src.db.db module, connected to the new database.
+    """
+    flush_hits()
+    db.close_db()
+    monkeypatch.setattr(db, "DATABASE", str(tmp_path / "swapi.db"))
+    db.init_db()
+    yield db
+    flush_hits()
+    db.close_db()
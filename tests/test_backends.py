@@ -0,0 +1,102 @@
+from datetime import datetime
+
+import pytest
+
+from src.db import db
+from src.db.backends import BACKENDS, MemoryBackend, create_backend, migrate_cache
+from src.db.db import SqliteStore
+from tests.test_db import character
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, database):
+    backend = create_backend(request.param, database._store)
+    yield backend
+    if request.param != "sqlite":
+        backend.close()
+
+
+def test_backend_round_trip(backend):
+    now = datetime.now()
+    luke = backend.insert("Luke", character("Luke Skywalker"), now)
+    leia = backend.insert("leia", character("Leia Organa"), now)
+    assert backend.insert("LUKE ", character("Luke Skywalker"), now) == luke
+
+    assert backend.lookup("luke")[0] == luke
+    assert backend.lookup("organa")[0] == leia
+    assert backend.lookup("han") is None
+    backend.add_hits([(2, now, luke)])
+    assert backend.lookup("luke")[2] == 3
+    assert {entry[0]: entry[1] for entry in backend.entries(1)} == {
+        luke: "Luke",
+        leia: "leia",
+    }
+
+    assert backend.acquire_lease("han", "first", 60)
+    assert not backend.acquire_lease("han", "second", 60)
+    backend.release_lease("han", "first")
+    assert backend.acquire_lease("han", "second", 60)
+
+    backend.clean()
+    assert backend.lookup("luke") is None and backend.stats()["entries"] == 0
+
+
+def tables(store: SqliteStore) -> set:
+    with store.connection() as conn:
+        return {
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table';"
+            )
+        }
+
+
+def test_shards_only_hold_the_cache(database):
+    backend = create_backend("sharded", database._store)
+    try:
+        shard = backend.shards[0].store
+        assert "RESOURCES" not in tables(shard) and "LEASES" in tables(shard)
+        assert tables(shard) <= tables(database._store)
+        with shard.connection() as conn, database.connection() as shared:
+            columns = "PRAGMA table_info(CACHE);"
+            assert (
+                conn.execute(columns).fetchall() == shared.execute(columns).fetchall()
+            )
+    finally:
+        backend.close()
+
+
+@pytest.mark.parametrize("name", ["sqlite", "memory"])
+def test_eviction_batch_is_read_from_db(database, monkeypatch, name):
+    backend = create_backend(name, database._store)
+    now = datetime.now()
+    for query in ("luke", "leia", "han"):
+        backend.insert(query, character(query.title()), now)
+    monkeypatch.setattr(db, "CACHE_MAX_ROWS", 1)
+    monkeypatch.setattr(db, "CACHE_EVICTION_BATCH", 1)
+    backend.insert("r2", character("R2-D2"), now)
+    assert backend.stats()["entries"] == 3
+
+
+def test_migration_closes_both_backends(database, monkeypatch):
+    database.insert_cache("luke", character("Luke Skywalker"), datetime.now())
+    closed = []
+
+    def open_backend(name):
+        backend = create_backend(name, database._store)
+        close = backend.close
+        backend.close = lambda: closed.append(name) or close()
+        return backend
+
+    monkeypatch.setattr(db, "open_backend", open_backend)
+    assert migrate_cache("sqlite", "memory", 10) == 1
+    assert closed == ["memory", "sqlite"]
+
+    def fail(self, entries):
+        raise RuntimeError("disk full")
+
+    closed.clear()
+    monkeypatch.setattr(MemoryBackend, "merge", fail)
+    with pytest.raises(RuntimeError):
+        migrate_cache("sqlite", "memory", 10)
+    assert closed == ["memory", "sqlite"]
@@ -0,0 +1,44 @@
+from collections import Counter
+
+from src.libs import batch
+from src.utils.storage_utils import decode_response
+from tests.test_db import character
+
+
+def test_dedupe_queries_keeps_first_occurrence():
+    queries = ["Luke", " luke ", "", "  ", "Leia", "LUKE", "leia"]
+    assert batch.dedupe_queries(queries) == ["Luke", "Leia"]
+
+
+def test_batch_search_isolates_failed_queries(database, monkeypatch, capsys):
+    calls = Counter()
+
+    def search_character(query, offline=False):
+        calls[query] += 1
+        if query == "boom":
+            raise RuntimeError("connection reset")
+        if query == "bad":
+            raise ValueError("SWAPI answered 500")
+        if query == "nobody":
+            return [], None
+        return decode_response(character(query.title())), None
+
+    monkeypatch.setattr(batch, "search_character", search_character)
+    batch.batch_search(["luke", "boom", " LUKE", "nobody", "bad", "leia"])
+
+    lines = capsys.readouterr().out.splitlines()
+    assert [line for line in lines if line.startswith(("Query:", "Error:"))] == [
+        "Query: luke",
+        "Query: boom",
+        "Error: connection reset",
+        "Query: nobody",
+        "Query: bad",
+        "Error: SWAPI answered 500",
+        "Query: leia",
+    ]
+    assert "Name: Leia" in lines
+    assert calls == {"luke": 1, "boom": 1, "nobody": 1, "bad": 1, "leia": 1}
+    # The queries around the failures are still cached
+    assert decode_response(database.get_cache("leia")[1])["name"] == "Leia"
+    assert decode_response(database.get_cache("nobody")[1]) == []
+    assert database.get_cache("boom")[1] is None
@@ -0,0 +1,333 @@
+from datetime import datetime, timedelta
+from json import dumps
+from threading import Event, Thread
+
+import pytest
+
+from src.db import db
+from src.db.hits import flush_hits
+from src.libs import refresh
+from src.libs.swapi import get_resource
+from src.utils.storage_utils import (
+    CHARACTER_FIELDS,
+    PLANET_FIELDS,
+    decode_response,
+    encode_character,
+    project,
+)
+
+
+def character(name: str) -> str:
+    return encode_character(
+        {
+            "name": name,
+            "height": "172",
+            "mass": "77",
+            "birth_year": "19BBY",
+            "homeworld": "https://swapi.dev/api/planets/1/",
+            "url": f"https://swapi.dev/api/people/{name}/",
+            "edited": "2014-12-20T21:17:56.891000Z",
+        }
+    )
+
+
+@pytest.fixture
+def names(database):
+    now = datetime.now()
+    database.write_cache_batch(
+        [
+            ("luke", character("Luke Skywalker"), now),
+            ("r2", character("R2-D2"), now),
+            ("50%", character("Fifty_Percent"), now),
+        ]
+    )
+    return database
+
+
+@pytest.mark.skipif(
+    db.NAME_TOKENIZER != "trigram", reason="needs the trigram tokenizer"
+)
+def test_name_lookup_uses_trigram_index(names):
+    statements = []
+    with names.connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            row = names.lookup_name(conn, "skywalk")
+        finally:
+            conn.set_trace_callback(None)
+        # FTS5 runs statements of its own, keep the lookup
+        (lookup,) = [sql for sql in statements if sql.startswith("SELECT ID")]
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {lookup}").fetchall()
+    assert row is not None
+    # The FTS5 index is constrained by the MATCH, not scanned in full
+    assert any(
+        "VIRTUAL TABLE INDEX" in detail and ":M" in detail for *_, detail in plan
+    )
+
+
+def test_name_lookup_finds_substrings(names):
+    assert names.get_cache("SKYWALKER")[1] is not None
+    assert names.get_cache('walker"')[1] is None
+    assert names.get_cache("nobody")[1] is None
+
+
+def test_short_name_lookup(names):
+    assert names.get_cache("d2")[1] is not None
+    assert names.get_cache("e_")[1] is None
+    assert names.get_cache("y_p")[1] is not None
+
+
+def cached_queries(database) -> set:
+    with database.connection() as conn:
+        return {query for (query,) in conn.execute("SELECT QUERY FROM CACHE;")}
+
+
+def assert_stats_consistent(database) -> None:
+    with database.connection() as conn:
+        stats = conn.execute("SELECT ROWS, BYTES FROM CACHE_STATS;").fetchone()
+        actual = conn.execute(
+            """SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(RESPONSE AS BLOB))), 0)
+                FROM CACHE;"""
+        ).fetchone()
+    assert stats == actual
+
+
+@pytest.fixture
+def full(database, monkeypatch):
+    monkeypatch.setattr(db, "CACHE_MAX_ROWS", 3)
+    earlier = datetime.now() - timedelta(minutes=10)
+    database.write_cache_batch(
+        [
+            ("luke", character("Luke Skywalker"), earlier),
+            ("leia", character("Leia Organa"), earlier + timedelta(minutes=1)),
+            ("han", character("Han Solo"), earlier + timedelta(minutes=2)),
+        ]
+    )
+    # Luke is hit the most, Leia the most recently
+    luke, leia = database.get_cache("luke")[0], database.get_cache("leia")[0]
+    database.add_hits_cache(
+        [(5, earlier + timedelta(minutes=3), luke), (1, datetime.now(), leia)]
+    )
+    return database
+
+
+def test_lfu_evicts_least_hit_entries(full):
+    full.insert_cache("r2", character("R2-D2"), datetime.now())
+    assert cached_queries(full) == {"luke", "leia", "r2"}
+    assert_stats_consistent(full)
+
+
+def test_lru_evicts_least_recently_hit_entries(full, monkeypatch):
+    monkeypatch.setattr(db, "CACHE_EVICTION_POLICY", "lru")
+    monkeypatch.setattr(db, "CACHE_MAX_ROWS", 2)
+    full.insert_cache("r2", character("R2-D2"), datetime.now())
+    assert cached_queries(full) == {"leia", "r2"}
+    assert_stats_consistent(full)
+
+
+def test_eviction_is_bounded_by_the_batch(full, monkeypatch):
+    monkeypatch.setattr(db, "CACHE_MAX_ROWS", 1)
+    with full.transaction() as conn:
+        assert full.evict_cache(conn, 1) == 1
+    assert cached_queries(full) == {"luke", "leia"}
+    assert full.evict() == 1
+    assert cached_queries(full) == {"luke"}
+    assert_stats_consistent(full)
+
+
+def test_expired_entries_are_evicted(database, monkeypatch):
+    hour_ago = datetime.now() - timedelta(hours=1)
+    database.write_cache_batch(
+        [
+            ("luke", character("Luke Skywalker"), datetime.now()),
+            ("leia", character("Leia Organa"), hour_ago),
+            ("nobody", encode_character([]), hour_ago),
+        ]
+    )
+    assert len(cached_queries(database)) == 3
+    monkeypatch.setattr(db, "CACHE_TTL", 1800)
+    monkeypatch.setattr(db, "NEGATIVE_CACHE_TTL", 1800)
+    assert database.evict() == 2
+    assert cached_queries(database) == {"luke"}
+    assert_stats_consistent(database)
+
+
+def test_negative_entries_expire_on_their_own_ttl(database, monkeypatch):
+    hour_ago = datetime.now() - timedelta(hours=1)
+    database.write_cache_batch(
+        [
+            ("luke", character("Luke Skywalker"), hour_ago),
+            ("nobody", encode_character([]), hour_ago),
+            ("no one", encode_character([]), datetime.now()),
+        ]
+    )
+    monkeypatch.setattr(db, "CACHE_TTL", 7200)
+    monkeypatch.setattr(db, "NEGATIVE_CACHE_TTL", 1800)
+    # The expired negative entry is a miss before it is evicted
+    assert database.get_cache("luke")[1] is not None
+    assert database.get_cache("nobody")[1] is None
+    assert database.get_cache("no one")[1] == encode_character([])
+
+    assert database.evict() == 1
+    assert cached_queries(database) == {"luke", "no one"}
+    assert_stats_consistent(database)
+
+
+def test_negative_entries_are_capped(database, monkeypatch):
+    monkeypatch.setattr(db, "NEGATIVE_CACHE_MAX_ROWS", 2)
+    earlier = datetime.now() - timedelta(minutes=10)
+    database.write_cache_batch(
+        [("luke", character("Luke Skywalker"), earlier)]
+        + [
+            (query, encode_character([]), earlier + timedelta(minutes=minutes))
+            for minutes, query in enumerate(["nobody", "no one", "none"], 1)
+        ]
+    )
+    # The oldest negative entry makes room, the positive entry is kept
+    assert cached_queries(database) == {"luke", "no one", "none"}
+    assert_stats_consistent(database)
+
+
+def test_characters_share_one_homeworld_row(database, monkeypatch):
+    tatooine = {
+        "name": "Tatooine",
+        "population": "200000",
+        "url": "https://swapi.dev/api/planets/1/",
+    }
+    fetches = []
+
+    def fetch_record(url, *validators):
+        fetches.append(url)
+        return tatooine, None, None
+
+    monkeypatch.setattr(refresh, "fetch_record", fetch_record)
+    luke, anakin = (
+        decode_response(character(name)) for name in ("Luke", "Anakin Skywalker")
+    )
+    homeworlds = [get_resource(person["homeworld"]) for person in (luke, anakin)]
+    assert fetches == [tatooine["url"]]
+    assert homeworlds[0] == homeworlds[1] == project(tatooine, PLANET_FIELDS)
+    with database.connection() as conn:
+        assert conn.execute("SELECT URL FROM RESOURCES;").fetchall() == [
+            (tatooine["url"],)
+        ]
+
+
+def rows(database) -> list:
+    with database.connection() as conn:
+        return [name for (name,) in conn.execute("SELECT NAME FROM T ORDER BY NAME;")]
+
+
+@pytest.fixture
+def scratch(database):
+    with database.transaction() as conn:
+        conn.execute("CREATE TABLE T (NAME TEXT);")
+    return database
+
+
+def test_inner_transaction_failure_rolls_back_its_savepoint(scratch):
+    with scratch.transaction() as conn:
+        conn.execute("INSERT INTO T VALUES ('outer');")
+        with pytest.raises(RuntimeError):
+            with scratch.transaction() as inner:
+                inner.execute("INSERT INTO T VALUES ('inner');")
+                raise RuntimeError("inner failure")
+        conn.execute("INSERT INTO T VALUES ('after');")
+    assert rows(scratch) == ["after", "outer"]
+
+
+def test_outer_transaction_failure_rolls_back_everything(scratch):
+    with pytest.raises(RuntimeError):
+        with scratch.transaction() as conn:
+            conn.execute("INSERT INTO T VALUES ('outer');")
+            with scratch.transaction() as inner:
+                inner.execute("INSERT INTO T VALUES ('inner');")
+            raise RuntimeError("outer failure")
+    assert rows(scratch) == []
+    # The connection is usable again
+    with scratch.transaction() as conn:
+        conn.execute("INSERT INTO T VALUES ('next');")
+    assert rows(scratch) == ["next"]
+
+
+def test_connection_lock_is_reentrant_and_exclusive_across_threads(scratch):
+    started, seen = Event(), []
+
+    def write():
+        started.set()
+        with scratch.transaction() as conn:
+            seen.extend(name for (name,) in conn.execute("SELECT NAME FROM T;"))
+            conn.execute("INSERT INTO T VALUES ('thread');")
+
+    thread = Thread(target=write)
+    with scratch.transaction() as conn:
+        conn.execute("INSERT INTO T VALUES ('main');")
+        thread.start()
+        started.wait(5)
+        # The other thread waits for this transaction, while this one re-enters
+        with scratch.connection() as again:
+            assert again is conn
+            assert [name for (name,) in again.execute("SELECT NAME FROM T;")] == [
+                "main"
+            ]
+        thread.join(0.1)
+        assert thread.is_alive()
+    thread.join(5)
+    assert seen == ["main"]
+    assert rows(scratch) == ["main", "thread"]
+
+
+@pytest.fixture
+def baseline(tmp_path, monkeypatch):
+    """
+    Points SWAPER at a new database file holding the CACHE table as it was created
+    before any migration.
+    """
+    flush_hits()
+    db.close_db()
+    monkeypatch.setattr(db, "DATABASE", str(tmp_path / "swapi.db"))
+    db.create_cache_table()
+    yield db
+    flush_hits()
+    db.close_db()
+
+
+def test_baseline_responses_are_compacted(baseline):
+    tatooine = {
+        "name": "Tatooine",
+        "population": "200000",
+        "orbital_period": "304",
+        "rotation_period": "23",
+        "climate": "arid",
+        "residents": [f"https://swapi.dev/api/people/{i}/" for i in range(10)],
+        "url": "https://swapi.dev/api/planets/1/",
+        "edited": "2014-12-20T20:58:18.411000Z",
+    }
+    luke = {
+        **decode_response(character("Luke Skywalker")),
+        "hair_color": "blond",
+        "films": [f"https://swapi.dev/api/films/{i}/" for i in range(1, 7)],
+        "starships": [f"https://swapi.dev/api/starships/{i}/" for i in range(10)],
+        "created": "2014-12-09T13:50:51.644000Z",
+    }
+    # The responses SWAPER stored before any migration
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO CACHE (QUERY, RESPONSE, TIMESTAMP) VALUES (?, ?, ?);",
+            [
+                ("luke", dumps({**luke, "homeworld": tatooine}), datetime.now()),
+                ("nobody", "[]", datetime.now()),
+            ],
+        )
+
+    db.migrate_db()
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA user_version;").fetchone()[0] == len(db.MIGRATIONS)
+        responses = dict(conn.execute("SELECT QUERY, RESPONSE FROM CACHE;"))
+    # Long responses are compressed, and decode to the stored fields only
+    assert isinstance(responses["luke"], bytes)
+    assert decode_response(responses["luke"]) == project(luke, CHARACTER_FIELDS)
+    assert decode_response(responses["nobody"]) == []
+    assert db.get_cache("skywalker")[1] == responses["luke"]
+    homeworld = db.get_resource_cache(tatooine["url"])
+    assert decode_response(homeworld) == project(tatooine, PLANET_FIELDS)
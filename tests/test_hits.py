@@ -0,0 +1,97 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.db import hits
+from src.db.hits import HitBuffer
+from tests.test_db import character
+
+
+@pytest.fixture
+def entries(database):
+    now = datetime.now()
+    database.write_cache_batch(
+        [
+            ("luke", character("Luke Skywalker"), now),
+            ("leia", character("Leia Organa"), now),
+            ("han", character("Han Solo"), now),
+        ]
+    )
+    return {query: database.get_cache(query)[0] for query in ("luke", "leia", "han")}
+
+
+def counts(database) -> dict:
+    with database.connection() as conn:
+        return dict(conn.execute("SELECT QUERY, HITS FROM CACHE;"))
+
+
+def test_buffer_flushes_when_full(database, entries):
+    buffer = HitBuffer(flush_size=3, flush_interval=60)
+    now = datetime.now()
+    for _ in range(4):
+        buffer.record(entries["luke"], now)
+    buffer.record(entries["leia"], now)
+    # Two entries are pending, below the flush size
+    assert counts(database) == {"luke": 1, "leia": 1, "han": 1}
+
+    buffer.record(entries["han"], now)
+    assert counts(database) == {"luke": 5, "leia": 2, "han": 2}
+    buffer.record(entries["han"], now)
+    buffer.flush()
+    assert counts(database)["han"] == 3
+
+
+def test_buffer_flushes_on_timer(database, entries):
+    buffer = HitBuffer(flush_size=100, flush_interval=0.05)
+    buffer.record(entries["luke"], datetime.now())
+    deadline = time.monotonic() + 5
+    while counts(database)["luke"] == 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert counts(database)["luke"] == 2
+
+
+def test_buffer_flushes_at_exit(database, entries, monkeypatch):
+    registered = []
+    monkeypatch.setattr(hits.atexit, "register", registered.append)
+    buffer = HitBuffer(flush_size=100, flush_interval=60)
+    buffer.record(entries["leia"], datetime.now())
+    buffer.record(entries["leia"], datetime.now())
+    assert registered == [buffer.flush]
+
+    registered[0]()
+    assert counts(database)["leia"] == 3
+
+
+ROLLUPS = {
+    "STATS_DAILY": "date(TIMESTAMP)",
+    "STATS_HOURLY": "strftime('%H', TIMESTAMP)",
+    "STATS_QUERIES": "QUERY",
+    "STATS_CHARACTERS": "NAME",
+    "STATS_RESULTS": "RESULT",
+}
+
+
+def test_rollups_match_a_recount_of_the_events(database):
+    day = datetime.now().replace(hour=9, minute=30) - timedelta(days=1)
+    events = [
+        (day, "luke", "Luke Skywalker", "found"),
+        (day.replace(hour=10), " Luke", "Luke Skywalker", "found"),
+        (day + timedelta(days=1), "leia", "Leia Organa", "found"),
+        (day + timedelta(days=1, hours=12), "nobody", None, "not_found"),
+    ]
+    database.add_search_events(events[:2])
+    database.add_search_events(events[2:])
+
+    with database.connection() as conn:
+        for table, value in ROLLUPS.items():
+            rollup = dict(conn.execute(f"SELECT * FROM {table};"))
+            recount = dict(
+                conn.execute(
+                    f"""SELECT {value}, COUNT(*) FROM SEARCH_EVENTS
+                        WHERE {value} IS NOT NULL GROUP BY {value};"""
+                )
+            )
+            assert rollup == recount, table
+        queries = dict(conn.execute("SELECT * FROM STATS_QUERIES;"))
+    assert queries == {"luke": 2, "leia": 1, "nobody": 1}
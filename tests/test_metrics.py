@@ -0,0 +1,26 @@
+from datetime import datetime
+from json import loads
+
+import main
+from tests.test_db import character
+
+
+def test_search_writes_profile_and_metrics(database, monkeypatch, tmp_path, capsys):
+    database.write_cache_batch([("luke", character("Luke Skywalker"), datetime.now())])
+    path = tmp_path / "metrics.jsonl"
+    argv = ["search", "luke", "--profile", "--metrics", str(path)]
+    monkeypatch.setattr(main.sys, "argv", ["main.py", *argv])
+    main.main()
+    main.main()
+
+    out, err = capsys.readouterr()
+    assert "Name: Luke Skywalker" in out
+    assert "Profile (" in err and "db.get_cache" in err
+    assert "cache hit ratio" in err
+
+    first, second = [loads(line) for line in path.read_text().splitlines()]
+    assert second["command"] == argv
+    assert second["counters"]["cache.hits"] == first["counters"]["cache.hits"] + 1
+    spans = second["spans"]["db.get_cache"]
+    assert spans["count"] == first["spans"]["db.get_cache"]["count"] + 1
+    assert spans["total_ms"] >= first["spans"]["db.get_cache"]["total_ms"]
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+from threading import Event
+
+import main
+from src.config import CACHE_SOFT_TTL
+from src.db.hits import flush_hits, record_search
+from src.libs import refresh, swapi, warm
+from src.libs.warm import warm_cache
+from src.utils.metrics_utils import snapshot
+from src.utils.storage_utils import decode_response
+from tests.test_db import character
+
+REFRESH_COUNTERS = ("refresh.changed", "refresh.unchanged")
+
+
+def test_cli_search_refreshes_stale_entry(database, monkeypatch, capsys):
+    fetched = datetime.now() - timedelta(seconds=CACHE_SOFT_TTL + 60)
+    database.write_cache_batch([("luke", character("Luke Skywalker"), fetched)])
+    planet = {"name": "Tatooine", "url": "https://swapi.dev/api/planets/1/"}
+
+    def fetch_record(url, *validators):
+        if url == planet["url"]:
+            return planet, None, None
+        luke = decode_response(character("Luke Skywalker"))
+        return {**luke, "height": "173"}, '"v2"', None
+
+    monkeypatch.setattr(refresh, "fetch_record", fetch_record)
+    main.search_task("luke", False, False)
+    assert "Height: 172" in capsys.readouterr().out
+    assert refresh.wait_for_refreshes(5)
+
+    _, response, _, _, stale = database.get_cache("luke")
+    assert decode_response(response)["height"] == "173" and not stale
+
+
+def test_exit_wait_is_bounded(monkeypatch):
+    release = Event()
+    monkeypatch.setattr(refresh, "_pending", set())
+    monkeypatch.setattr(refresh, "refresh_character", lambda *args: release.wait())
+    refresh.schedule_refresh(-1, {"name": "Luke Skywalker"})
+    try:
+        assert not refresh.wait_for_refreshes(0.1)
+    finally:
+        release.set()
+    assert refresh.wait_for_refreshes(5)
+
+
+def refreshes() -> dict:
+    counters = snapshot()["counters"]
+    return {name: counters.get(name, 0) for name in REFRESH_COUNTERS}
+
+
+def test_only_conditional_refetches_count_as_refreshes(database, monkeypatch):
+    url = "https://swapi.dev/api/planets/1/"
+    planet = {"name": "Tatooine", "url": url, "edited": "2014-12-20T20:58:18Z"}
+    monkeypatch.setattr(
+        refresh, "fetch_record", lambda url, *validators: (planet, '"v1"', None)
+    )
+    before = refreshes()
+    response, resource = refresh.revalidate_resource(url)
+    database.refresh_resource_cache([resource])
+    assert refreshes() == before
+
+    refresh.revalidate_resource(url)
+    assert refreshes()["refresh.unchanged"] == before["refresh.unchanged"] + 1
+
+
+def test_warm_counts_failed_refreshes(database, monkeypatch):
+    fetched = datetime.now() - timedelta(seconds=CACHE_SOFT_TTL + 60)
+    database.write_cache_batch([("luke", character("Luke Skywalker"), fetched)])
+
+    def fetch_record(url, *validators):
+        raise ValueError("SWAPI is unreachable")
+
+    monkeypatch.setattr(refresh, "fetch_record", fetch_record)
+    assert warm_cache(["luke"], rate=None) == (0, 0, 1)
+    assert database.get_cache("luke")[4]
+
+
+def test_worker_survives_failed_refresh(monkeypatch):
+    refreshed = []
+
+    def refresh_character(query_id, character):
+        if query_id == -1:
+            raise RuntimeError("database is locked")
+        refreshed.append(query_id)
+
+    monkeypatch.setattr(refresh, "_pending", set())
+    monkeypatch.setattr(refresh, "refresh_character", refresh_character)
+    failed = snapshot()["counters"].get("refresh.failed", 0)
+    refresh.schedule_refresh(-1, {"name": "Luke Skywalker"})
+    assert refresh.wait_for_refreshes(5)
+    refresh.schedule_refresh(-2, {"name": "Leia Organa"})
+    assert refresh.wait_for_refreshes(5)
+
+    assert refreshed == [-2]
+    assert snapshot()["counters"]["refresh.failed"] == failed + 1
+    assert all(worker.is_alive() for worker in refresh._workers)
+
+
+def test_warm_counts_unexpected_errors_and_writes_the_rest(database, monkeypatch):
+    def resolve_query(query, *args):
+        if query == "boom":
+            raise KeyError("homeworld")
+        response = decode_response(character(query.title()))
+        return {
+            "query": query,
+            "response": response,
+            "save": True,
+            "homeworld": None,
+            "homeworld_fetched": False,
+        }
+
+    monkeypatch.setattr(warm, "resolve_query", resolve_query)
+    assert warm_cache(["boom", "leia"], rate=None) == (1, 0, 1)
+    assert decode_response(database.get_cache("leia")[1])["name"] == "Leia"
+
+
+def test_popular_queries_leave_out_all_searches(database, monkeypatch, capsys):
+    luke = decode_response(character("Luke Skywalker"))
+    monkeypatch.setattr(swapi, "search_all_characters", lambda query, offline: [[luke]])
+    for _ in range(3):
+        swapi.search_all("sky")
+    record_search("leia", "Leia", datetime.now())
+    flush_hits()
+    assert database.popular_queries(10) == ["leia"]
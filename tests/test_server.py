@@ -0,0 +1,99 @@
+import asyncio
+from threading import current_thread
+
+import pytest
+
+from src.libs import server
+
+
+def test_search_error_is_a_json_500(monkeypatch):
+    def fail(query, world, offline):
+        raise KeyError("homeworld")
+
+    monkeypatch.setattr(server, "lookup_character", fail)
+    search = server.SearchServer(workers=1)
+    try:
+        status, body = asyncio.run(search.route("/search?q=luke"))
+    finally:
+        search.executor.shutdown()
+    assert status == server.HTTPStatus.INTERNAL_SERVER_ERROR
+    assert body == {"error": "Internal server error"}
+    assert search._inflight == {}
+
+
+@pytest.mark.parametrize(
+    "error, status",
+    [
+        (server.OfflineError("No local mirror"), server.HTTPStatus.SERVICE_UNAVAILABLE),
+        (
+            ValueError("Error occurred while making a request"),
+            server.HTTPStatus.BAD_GATEWAY,
+        ),
+    ],
+)
+def test_offline_miss_is_not_a_gateway_error(monkeypatch, error, status):
+    def fail(query, world, offline):
+        raise error
+
+    monkeypatch.setattr(server, "lookup_character", fail)
+    search = server.SearchServer(workers=1)
+    try:
+        assert asyncio.run(search.route("/search?q=luke&offline=1")) == (
+            status,
+            {"error": str(error)},
+        )
+    finally:
+        search.executor.shutdown()
+
+
+def test_malformed_request_line_is_a_400():
+    async def request(raw: bytes) -> bytes:
+        search = server.SearchServer(workers=1)
+        listener = await asyncio.start_server(search.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(raw)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            search.executor.shutdown()
+
+    response = asyncio.run(request(b"GET /health\r\nHost: localhost\r\n\r\n"))
+    head, _, body = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+    assert b"Connection: close" in head
+    assert body == b'{"error": "Malformed request line"}'
+
+
+def test_l1_hits_are_recorded_off_the_event_loop(monkeypatch):
+    result = {"id": 7, "character": {"name": "Luke Skywalker"}, "homeworld": None}
+    threads = []
+    monkeypatch.setattr(
+        server, "lookup_character", lambda query, world, offline: result
+    )
+    monkeypatch.setattr(
+        server, "record_hit", lambda *args: threads.append(current_thread())
+    )
+    monkeypatch.setattr(
+        server, "record_search", lambda *args: threads.append(current_thread())
+    )
+    search = server.SearchServer(workers=1)
+
+    async def searches():
+        await search.search("luke", False, False)
+        return current_thread(), await search.search("Luke", False, False)
+
+    try:
+        loop_thread, served = asyncio.run(searches())
+    finally:
+        search.executor.shutdown()
+        search.recorder.shutdown()
+    assert served is result
+    # The hit and the search of the L1 hit
+    assert len(threads) == 2
+    assert loop_thread not in threads
@@ -0,0 +1,60 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from src.config import CACHE_TTL
+from src.db.hits import flush_hits
+from src.libs import snapshot, swapi
+from tests.test_db import character
+
+
+@pytest.fixture
+def built(database, monkeypatch):
+    now = datetime.now()
+    database.write_cache_batch(
+        [
+            ("luke", character("Luke Skywalker"), now),
+            ("leia", character("Leia Organa"), now - timedelta(seconds=CACHE_TTL / 2)),
+        ]
+    )
+    snapshot.build_snapshot()
+    monkeypatch.setattr(snapshot, "_snapshot", None)
+    return database
+
+
+def test_snapshot_hits_are_credited_by_query(built):
+    # Moving the entry, as cache --migrate does, gives it a new ID
+    with built.transaction() as conn:
+        conn.execute("DELETE FROM CACHE WHERE QUERY = 'luke';")
+    built.insert_cache("luke", character("Luke Skywalker"), datetime.now())
+    hits = built.get_cache("luke")[2]
+
+    record = snapshot.lookup_snapshot("Luke Skywalker")
+    assert record["character"]["name"] == "Luke Skywalker"
+    swapi.handle_snapshot_response("Luke Skywalker", record)
+    flush_hits()
+    assert built.get_cache("luke")[2] == hits + 1
+
+
+def test_snapshot_search_does_not_open_the_database(built, capsys):
+    built.close_db()
+    main.search_task("luke", False)
+    assert "Luke Skywalker" in capsys.readouterr().out
+    assert built._store._conn is None
+
+
+def test_clean_removes_snapshot(built, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["main.py", "cache", "--clean"])
+    main.main()
+    assert not os.path.exists(snapshot.snapshot_path())
+    assert snapshot.lookup_snapshot("luke") is None
+
+
+def test_snapshot_skips_expired_records(built, monkeypatch):
+    assert snapshot.lookup_snapshot("leia") is not None
+    monkeypatch.setattr(snapshot, "CACHE_TTL", CACHE_TTL // 4)
+    assert snapshot.lookup_snapshot("leia") is None
+    assert snapshot.lookup_snapshot("luke") is not None
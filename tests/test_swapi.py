@@ -0,0 +1,157 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from json import dumps
+from threading import Timer
+
+import pytest
+
+import main
+from src.libs import batch, swapi
+from src.utils.metrics_utils import snapshot
+from src.utils.storage_utils import decode_response, encode_character
+from tests.test_db import character
+
+
+def misses() -> int:
+    return snapshot()["counters"].get("cache.misses", 0)
+
+
+def test_search_once_waits_without_counting_misses(database, monkeypatch):
+    monkeypatch.setattr(swapi, "LEASE_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(swapi, "swapi_search", pytest.fail)
+    assert database.acquire_lease("luke", "other", 60)
+    Timer(
+        0.1,
+        database.insert_cache,
+        ("luke", character("Luke Skywalker"), datetime.now()),
+    ).start()
+
+    before = misses()
+    response, query_id = swapi.search_once("luke")
+    assert response["name"] == "Luke Skywalker"
+    assert query_id == database.get_cache("luke")[0]
+    assert misses() == before
+
+
+def test_search_once_rechecks_cache_after_acquiring_lease(database, monkeypatch):
+    monkeypatch.setattr(swapi, "LEASE_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(swapi, "swapi_search", pytest.fail)
+    assert database.acquire_lease("luke", "other", 60)
+    peeks = []
+
+    def peek_cache(query):
+        peeks.append(query)
+        if len(peeks) == 1:
+            # The holder caches the result, releasing its lease, right after this look
+            database.insert_cache(query, character("Luke Skywalker"), datetime.now())
+            return None
+        return database.peek_cache(query)
+
+    monkeypatch.setattr(swapi, "peek_cache", peek_cache)
+    response, query_id = swapi.search_once("luke")
+    assert response["name"] == "Luke Skywalker"
+    assert query_id == database.get_cache("luke")[0]
+    assert database.acquire_lease("luke", "next", 60)
+
+
+def test_search_once_caches_result_and_releases_lease(database, monkeypatch):
+    monkeypatch.setattr(swapi, "swapi_search", lambda query: [])
+    response, query_id = swapi.search_once("nobody")
+    assert response == [] and query_id == database.get_cache("nobody")[0]
+    assert database.acquire_lease("nobody", "other", 60)
+
+
+def test_search_once_releases_lease_on_failure(database, monkeypatch):
+    def fail(query):
+        raise ValueError("SWAPI is unreachable")
+
+    monkeypatch.setattr(swapi, "swapi_search", fail)
+    with pytest.raises(ValueError):
+        swapi.search_once("luke")
+    assert database.acquire_lease("luke", "other", 60)
+
+
+@pytest.mark.parametrize("synced_days_ago, mirrored", [(1, True), (30, False)])
+def test_mirror_only_answers_within_its_ttl(
+    database, monkeypatch, synced_days_ago, mirrored
+):
+    synced = datetime.now() - timedelta(days=synced_days_ago)
+    url = "https://swapi.dev/api/people/1/"
+    luke = {"name": "Luke Skywalker", "url": url, "edited": "2014-12-20T21:17:56Z"}
+    database.write_mirror(
+        "people", [(url, 1, luke["name"], luke["edited"], dumps(luke))], synced
+    )
+    database.finish_sync("people", [], synced)
+    monkeypatch.setattr(swapi, "search_once", lambda query: ("swapi", 1))
+
+    expected = luke if mirrored else "swapi"
+    assert swapi.search_character("luke")[0] == expected
+    assert swapi.search_character("luke", offline=True)[0] == luke
+
+
+def test_batch_miss_releases_lease_before_failed_homeworld(database, monkeypatch):
+    luke = decode_response(character("Luke Skywalker"))
+    monkeypatch.setattr(swapi, "swapi_search", lambda query: luke)
+
+    def swapi_request(url):
+        raise ValueError("SWAPI answered 500")
+
+    monkeypatch.setattr(batch, "swapi_request", swapi_request)
+    batch.batch_search(["luke"], world=True)
+    assert database.acquire_lease("luke", "other", 60)
+    assert decode_response(database.get_cache("luke")[1]) == luke
+
+
+def test_all_search_is_cached_apart_from_single_searches(database, monkeypatch, capsys):
+    luke = decode_response(character("Luke Skywalker"))
+    monkeypatch.setattr(swapi, "search_all_characters", lambda query, offline: [[luke]])
+    monkeypatch.setattr(swapi, "swapi_search", lambda query: [])
+    swapi.search_all("luke")
+    assert database.get_search_all_cache("luke")[0] == encode_character([luke])
+
+    main.search_task("all:luke", False)
+    assert "The force is not strong within you" in capsys.readouterr().out
+    assert decode_response(database.get_cache("all:luke")[1]) == []
+    assert decode_response(database.get_search_all_cache("luke")[0]) == [luke]
+
+
+def test_all_searches_move_out_of_the_cache(database):
+    characters = encode_character([decode_response(character("Luke Skywalker"))])
+    database.insert_cache("all:sky", characters, datetime.now())
+    with database.transaction() as conn:
+        conn.execute("DROP TABLE SEARCH_ALL;")
+        conn.execute(f"PRAGMA user_version = {len(database.MIGRATIONS) - 1};")
+
+    database.migrate_db()
+    assert database.get_cache("all:sky")[1] is None
+    assert database.get_search_all_cache("sky")[0] == characters
+
+
+def test_expand_fetches_each_url_once_then_reads_the_cache(database, monkeypatch):
+    films = [f"https://swapi.dev/api/films/{i}/" for i in (1, 2, 3)]
+    luke = {"name": "Luke Skywalker", "films": films[:2], "starships": []}
+    leia = {"name": "Leia Organa", "films": films[1:], "starships": []}
+    requests = Counter()
+
+    def swapi_request(url):
+        requests[url] += 1
+        return {"title": f"Film {url[-2]}", "url": url, "opening_crawl": "..."}
+
+    monkeypatch.setattr(swapi, "swapi_request", swapi_request)
+    resources = swapi.expand_resources([luke, leia], ("films", "starships"))
+    assert requests == Counter(films)
+    assert [resources[url]["title"] for url in films] == ["Film 1", "Film 2", "Film 3"]
+
+    # A later expansion reads the projected resources from the cache
+    resources = swapi.expand_resources([leia], ("films",))
+    assert requests == Counter(films)
+    assert resources[films[2]] == {"title": "Film 3", "url": films[2]}
+
+
+@pytest.mark.parametrize("argv", [["luke"], ["luke", "leia"], ["sky", "--all"]])
+def test_offline_search_without_mirror_fails(database, monkeypatch, capsys, argv):
+    monkeypatch.setattr(main.sys, "argv", ["main.py", "search", *argv, "--offline"])
+    with pytest.raises(SystemExit) as exit:
+        main.main()
+    assert exit.value.code == 1
+    assert "run 'python main.py sync' first" in capsys.readouterr().out
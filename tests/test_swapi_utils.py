@@ -0,0 +1,84 @@
+import pytest
+import requests
+
+from src.utils import swapi_utils
+
+
+def response(status: int, body: bytes = b"{}", headers: dict = None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers or {})
+    response.url = "https://swapi.dev/api/people/1/"
+    return response
+
+
+class FakeSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    delays = []
+    monkeypatch.setattr(swapi_utils.time, "sleep", delays.append)
+    return delays
+
+
+def test_retries_until_success(monkeypatch, delays):
+    session = FakeSession(
+        requests.exceptions.ConnectTimeout("connect timed out"),
+        response(503),
+        response(429, headers={"Retry-After": "2"}),
+        response(200, b'{"name": "Luke Skywalker"}'),
+    )
+    monkeypatch.setattr(swapi_utils, "get_session", lambda: session)
+    assert swapi_utils.swapi_request("https://swapi.dev/api/people/1/") == {
+        "name": "Luke Skywalker"
+    }
+    assert session.calls == 4
+    assert len(delays) == 3 and delays[2] == 2
+
+
+def test_gives_up_after_max_retries(monkeypatch, delays):
+    outcomes = [response(500)] * (swapi_utils.HTTP_MAX_RETRIES + 1)
+    session = FakeSession(*outcomes)
+    monkeypatch.setattr(swapi_utils, "get_session", lambda: session)
+    with pytest.raises(ValueError):
+        swapi_utils.swapi_get("https://swapi.dev/api/people/1/")
+    assert session.calls == swapi_utils.HTTP_MAX_RETRIES + 1
+    assert len(delays) == swapi_utils.HTTP_MAX_RETRIES
+
+
+def test_connection_errors_give_up_after_max_retries(monkeypatch, delays):
+    outcomes = [requests.exceptions.ConnectionError("refused")] * (
+        swapi_utils.HTTP_MAX_RETRIES + 1
+    )
+    session = FakeSession(*outcomes)
+    monkeypatch.setattr(swapi_utils, "get_session", lambda: session)
+    with pytest.raises(ValueError):
+        swapi_utils.swapi_get("https://swapi.dev/api/people/1/")
+    assert session.calls == swapi_utils.HTTP_MAX_RETRIES + 1
+
+
+def test_does_not_retry_not_found(monkeypatch, delays):
+    session = FakeSession(response(404))
+    monkeypatch.setattr(swapi_utils, "get_session", lambda: session)
+    with pytest.raises(ValueError):
+        swapi_utils.swapi_get("https://swapi.dev/api/people/1/")
+    assert session.calls == 1 and delays == []
+
+
+def test_backoff_delay_is_capped():
+    assert swapi_utils.backoff_delay(0, "3") == 3
+    assert swapi_utils.backoff_delay(0, "3600") == swapi_utils.HTTP_BACKOFF_MAX
+    for attempt in range(10):
+        assert 0 <= swapi_utils.backoff_delay(attempt) <= swapi_utils.HTTP_BACKOFF_MAX
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+from src.db import db
+from src.db.hits import flush_hits
+from src.libs.transfer import export_cache, import_cache
+from src.utils.storage_utils import decode_response, encode_planet
+from tests.test_db import character
+
+TATOOINE = {"name": "Tatooine", "url": "https://swapi.dev/api/planets/1/"}
+
+
+def contents() -> tuple:
+    entries = {
+        query: (decode_response(response), hits, timestamp, fetched)
+        for _, query, response, hits, timestamp, fetched in db.iter_cache_entries()
+    }
+    resources = {
+        url: (decode_response(response), timestamp)
+        for url, response, timestamp in db.iter_resources()
+    }
+    return entries, resources
+
+
+def use_new_database(path: str, monkeypatch) -> None:
+    flush_hits()
+    db.close_db()
+    monkeypatch.setattr(db, "DATABASE", path)
+    db.init_db()
+
+
+def test_export_import_round_trip(database, tmp_path, monkeypatch):
+    now = datetime.now()
+    database.write_cache_batch(
+        [
+            ("luke", character("Luke Skywalker"), now),
+            ("leia", character("Leia Organa"), now),
+            ("nobody", "[]", now),
+        ],
+        resources=[(TATOOINE["url"], encode_planet(TATOOINE), now)],
+    )
+    database.add_hits_cache([(4, now, database.get_cache("luke")[0])])
+    exported = contents()
+    path = str(tmp_path / "cache.jsonl.gz")
+    assert export_cache(path) == (3, 1)
+
+    use_new_database(str(tmp_path / "imported.db"), monkeypatch)
+    # Fetched before the exported entry, with fewer hits
+    earlier = now - timedelta(minutes=1)
+    db.write_cache_batch([("luke", character("Luke Skywalker"), earlier)])
+    assert import_cache(path) == (3, 1)
+    assert contents() == exported
+
+    # Importing again changes nothing, and keeps the hits counted since
+    leia = db.get_cache("leia")[0]
+    db.add_hits_cache([(10, now, leia)])
+    merged = contents()
+    assert import_cache(path) == (3, 1)
+    assert contents() == merged
+    assert merged[0]["leia"][1] == exported[0]["leia"][1] + 10
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from src.db.hits import record_search
+from src.libs import visualization
+from src.libs.plot_cache import plot_is_current
+from src.utils.metrics_utils import snapshot
+
+
+def test_results_are_labelled_by_whether_a_character_was_found(database):
+    now = datetime.now()
+    database.add_search_events(
+        [
+            (now, "luke", "Luke Skywalker", "found"),
+            (now, "leia", "Leia Organa", "found"),
+            (now, "nobody", None, "not_found"),
+        ]
+    )
+    with database.connection() as conn:
+        df = visualization.get_responses_data(conn)
+    results = dict(zip(df["QueryResult"], df["NumQueries"]))
+    assert results == {"Response": 2, "No Response": 1}
+
+
+def test_plot_is_redrawn_only_after_new_searches(database, tmp_path):
+    output = str(tmp_path / "plot.png")
+    record_search("luke", "Luke Skywalker", datetime.now())
+    visualization.visualize(output)
+    assert plot_is_current(output)
+
+    # An unchanged plot reuses every panel
+    rendered = snapshot()["counters"].get("plot.panels_rendered", 0)
+    visualization.visualize(output)
+    assert snapshot()["counters"]["plot.panels_rendered"] == rendered
+    assert plot_is_current(output)
+
+    record_search("leia", "Leia Organa", datetime.now())
+    assert not plot_is_current(output)
+    visualization.visualize(output)
+    assert plot_is_current(output)
+    # Every panel counts the new search
+    panels = len(visualization.PANELS)
+    assert snapshot()["counters"]["plot.panels_rendered"] == rendered + panels